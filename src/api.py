@@ -1,109 +1,138 @@
-import requests
-import replicate
 import os
-from typing import Optional, Dict, Any
-import time
-import re
+from typing import Optional, Dict, Any, List, Union
 from utils import load_config
-import fal_client
+from cache import get_cache, make_cache_key
+from http_client import download_bytes, download_to_file
+from rate_limiter import call_with_retries
+import tracing
+
+
+def get_cached_image(cache_key: str, output_file: Optional[str] = None) -> Union[bytes, str, None]:
+    image_cache = get_cache("images", ".png")
+    if image_cache is None:
+        return None
+    if output_file is not None:
+        image = output_file if image_cache.get_file(cache_key, output_file) else None
+    else:
+        image = image_cache.get(cache_key)
+    if image is not None:
+        tracing.annotate(cache_hit=True)
+        print(f"Image cache hit ({image_cache.hits} hits / {image_cache.misses} misses)")
+    return image
+
+
+def cache_image(cache_key: str, image_content: bytes) -> None:
+    image_cache = get_cache("images", ".png")
+    if image_cache is not None:
+        image_cache.put(cache_key, image_content)
+
+
+def fetch_image(image_url: str, cache_key: str, output_file: Optional[str] = None) -> Union[bytes, str]:
+    """Download a generated image through the pooled HTTP client and cache it.
+
+    With output_file the body is streamed straight to disk and the path is
+    returned; otherwise the image bytes are returned.
+    """
+    if output_file is None:
+        image_content = download_bytes(image_url)
+        cache_image(cache_key, image_content)
+        return image_content
+    download_to_file(image_url, output_file)
+    image_cache = get_cache("images", ".png")
+    if image_cache is not None:
+        image_cache.put_file(cache_key, output_file)
+    return output_file
+
+
+def fal_arguments(prompt: str, config: dict) -> Dict[str, Any]:
+    return {
+        "prompt": prompt,
+        "image_size": config["image_size"],
+        "num_images": config["num_images"],
+        "num_inference_steps": config["num_inference_steps"],
+        "enable_safety_checker": config["enable_safety_checker"],
+    }
+
+
+def fal_image_urls(result: Any) -> List[str]:
+    if result and isinstance(result, dict) and "images" in result:
+        images = result["images"]
+        if isinstance(images, list):
+            return [image.get("url") for image in images if image.get("url")]
+    return []
 
 
 def submit_fal_request(prompt: str, config: dict) -> Optional[str]:
-    try:
-        handler = fal_client.submit(
-            config["model"],
-            arguments={
-                "prompt": prompt,
-                "image_size": config["image_size"],
-                "num_images": config["num_images"],
-                "num_inference_steps": config["num_inference_steps"],
-                "enable_safety_checker": config["enable_safety_checker"],
-            },
-        )
-
-        result = handler.get()
-        if result and isinstance(result, dict) and "images" in result:
-            images = result["images"]
-            if isinstance(images, list) and images:
-                return images[0].get("url")
+    # Imported on first use so the unused backend's SDK is never loaded
+    import fal_client
 
-        return None
+    # Errors propagate so the rate limiter can see status codes and Retry-After
+    with tracing.span("image.request", backend="fal_flux_api"):
+        handler = fal_client.submit(config["model"], arguments=fal_arguments(prompt, config))
+        image_urls = fal_image_urls(handler.get())
+    return image_urls[0] if image_urls else None
+
+
+def fal_flux_api(prompt: str, max_retries: Optional[int] = None, output_file: Optional[str] = None) -> Union[bytes, str, None]:
+    config = load_config()
+    fal_config = config["fal_flux_api"]
+
+    # The key covers the prompt and every model parameter (model, image_size, steps, guidance)
+    cache_key = make_cache_key("fal_flux_api", prompt, fal_config)
+    cached_image = get_cached_image(cache_key, output_file)
+    if cached_image is not None:
+        return cached_image
+
+    def generate():
+        image_url = submit_fal_request(prompt, fal_config)
+        if not image_url:
+            raise ValueError("No image URL returned from FAL AI API")
+        return fetch_image(image_url, cache_key, output_file)
+
+    try:
+        return call_with_retries("fal", generate, max_retries=max_retries)
     except Exception as e:
         print(f"Error in FAL AI API request: {e}")
         return None
 
 
-def fal_flux_api(prompt: str, max_retries: int = 3) -> Optional[bytes]:
-    config = load_config()
-    fal_config = config["fal_flux_api"]
+def replicate_payload(prompt: str, config: dict) -> Dict[str, Any]:
+    return {
+        "prompt": prompt,
+        "aspect_ratio": config["aspect_ratio"],
+        "num_inference_steps": config["num_inference_steps"],
+        "disable_safety_checker": config["disable_safety_checker"],
+        "guidance": config["guidance"],
+        "output_quality": config["output_quality"],
+    }
 
-    for attempt in range(max_retries):
-        try:
-            image_url = submit_fal_request(prompt, fal_config)
-            if image_url:
-                response = requests.get(image_url)
-                response.raise_for_status()
-                return response.content
-            else:
-                raise ValueError("No image URL returned from FAL AI API")
-        except Exception as e:
-            if attempt < max_retries - 1:
-                print(
-                    f"Error in FAL AI API request (attempt {attempt + 1}/{max_retries}): {e}"
-                )
-                print("Retrying...")
-                time.sleep(1)  # Wait for 1 second before retrying
-            else:
-                print(f"Error in FAL AI API request after {max_retries} attempts: {e}")
-    return None
-
-
-def replicate_flux_api(prompt: str, max_retries: int = 3) -> Optional[bytes]:
+
+def replicate_flux_api(prompt: str, max_retries: Optional[int] = None, output_file: Optional[str] = None) -> Union[bytes, str, None]:
     config = load_config()
     replicate_config = config["replicate_flux_api"]
 
-    payload = {
-        "prompt": prompt,
-        "aspect_ratio": replicate_config["aspect_ratio"],
-        "num_inference_steps": replicate_config["num_inference_steps"],
-        "disable_safety_checker": replicate_config["disable_safety_checker"],
-        "guidance": replicate_config["guidance"],
-        "output_quality": replicate_config["output_quality"],
-    }
+    payload = replicate_payload(prompt, replicate_config)
+
+    # The key covers the prompt and every model parameter (model, aspect_ratio, steps, guidance)
+    cache_key = make_cache_key("replicate_flux_api", prompt, replicate_config)
+    cached_image = get_cached_image(cache_key, output_file)
+    if cached_image is not None:
+        return cached_image
+
+    import replicate
 
-    for attempt in range(max_retries):
-        try:
+    def generate():
+        with tracing.span("image.request", backend="replicate_flux_api"):
             image_urls = replicate.run(
                 config["replicate_flux_api"]["model"], input=payload
             )
-            if image_urls and isinstance(image_urls, list) and len(image_urls) > 0:
-                image_url = image_urls[0]
-                response = requests.get(image_url)
-                response.raise_for_status()
-                return response.content
-            else:
-                raise ValueError("No image URL returned from Replicate API")
-        except Exception as e:
-            if attempt < max_retries - 1:
-                print(
-                    f"Error in Flux Schnell generation (attempt {attempt + 1}/{max_retries}): {e}"
-                )
-                error_str = str(e)
-                if "status: 402" in error_str or "Insufficient credit" in error_str:
-                    print("Insufficient credit. Aborting retries.")
-                    break
-                
-                match = re.search(r"resets in ~?(\d+)s", error_str)
-                if match:
-                    wait_time = int(match.group(1)) + 1
-                    print(f"Rate limited. Waiting for {wait_time} seconds...")
-                    time.sleep(wait_time)
-                else:
-                    print("Retrying...")
-                    time.sleep(1)
-            else:
-                print(
-                    f"Error in Flux Schnell generation after {max_retries} attempts: {e}"
-                )
-    return None
+        if not (image_urls and isinstance(image_urls, list) and len(image_urls) > 0):
+            raise ValueError("No image URL returned from Replicate API")
+        return fetch_image(str(image_urls[0]), cache_key, output_file)
+
+    try:
+        return call_with_retries("replicate", generate, max_retries=max_retries)
+    except Exception as e:
+        print(f"Error in Flux Schnell generation: {e}")
+        return None
 
@@ -1,30 +1,110 @@
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
 from dotenv import load_dotenv
+from moviepy.audio.io.AudioFileClip import AudioFileClip
 from utils import load_config
+from cache import get_cache, make_cache_key
+from concurrency import stage_slot, submit_in_context
+from rate_limiter import call_with_retries
+import tracing
 
 load_dotenv()
 
 def generate_audio(client, text, output_file, voice_name):
+    with tracing.span("tts.synthesize", voice=voice_name, chars=len(text)):
+        return _generate_audio(client, text, output_file, voice_name)
+
+
+def _generate_audio(client, text, output_file, voice_name):
     config = load_config()
     # Get the speech rate from the config file
     speech_rate = config['tts']['speech_rate']
+    model = config['tts']['model']
+
+    # Identical text, voice, model and rate always produce the same speech
+    audio_cache = get_cache("tts", ".mp3")
+    cache_key = make_cache_key("tts", text, voice_name, model, speech_rate)
+    if audio_cache is not None and audio_cache.get_file(cache_key, output_file):
+        tracing.annotate(cache_hit=True)
+        print(f"Speech for text [{text}] served from cache ({audio_cache.hits} hits / {audio_cache.misses} misses)")
+        return True
+
+    def create_speech():
+        with stage_slot("tts"):
+            return client.audio.speech.create(
+                model=model,
+                voice=voice_name,
+                input=text,
+                speed=speech_rate,
+                response_format="mp3"
+            )
 
     try:
-        result = client.audio.speech.create(
-            model="tts-1",
-            voice=voice_name,
-            input=text,
-            speed=speech_rate,
-            response_format="mp3"
-        )
+        with tracing.span("tts.request", model=model):
+            result = call_with_retries("openai_tts", create_speech)
 
         # Save the audio content to the output file
-        with open(output_file, "wb") as audio_file:
-            audio_file.write(result.content)
+        with tracing.span("tts.write", bytes=len(result.content)):
+            with open(output_file, "wb") as audio_file:
+                audio_file.write(result.content)
+        if audio_cache is not None:
+            audio_cache.put(cache_key, result.content)
 
         print(f"Speech synthesized for text [{text}], and the audio was saved to [{output_file}]")
         return True
 
     except Exception as e:
+        tracing.annotate(error=str(e))
         print(f"Error generating audio: {str(e)}")
         return False
+
+
+def get_audio_duration(audio_file: str) -> float:
+    audio_clip = AudioFileClip(audio_file)
+    try:
+        return audio_clip.duration
+    finally:
+        audio_clip.close()
+
+
+def _synthesize_scene(client, scene: Dict[str, Any], voice_name: str) -> Optional[float]:
+    audio_file = scene['audio']
+    if not generate_audio(client, scene['subtitles'], audio_file, voice_name):
+        return None
+    return get_audio_duration(audio_file)
+
+
+def generate_scene_audio(
+    client,
+    storyboards: List[Dict[str, Any]],
+    voice_name: str,
+    max_workers: Optional[int] = None
+) -> List[Optional[float]]:
+    """Synthesize every scene's subtitles concurrently before rendering.
+
+    Writes each scene's audio to scene['audio'] and returns the audio durations
+    in scene order (None for scenes whose synthesis failed).
+    """
+    start_time = time.time()
+
+    if max_workers is None:
+        config = load_config()
+        max_workers = config['tts']['max_workers']
+    max_workers = max(1, max_workers)
+
+    for scene in storyboards:
+        os.makedirs(os.path.dirname(scene['audio']) or '.', exist_ok=True)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            submit_in_context(executor, _synthesize_scene, client, scene, voice_name)
+            for scene in storyboards
+        ]
+        durations = [future.result() for future in futures]
+
+    total_time = time.time() - start_time
+    print(f"Synthesized audio for {len(storyboards)} scenes with {max_workers} workers in {total_time:.2f} seconds")
+
+    return durations
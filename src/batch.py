@@ -0,0 +1,133 @@
+import os
+import csv
+import json
+import time
+import argparse
+import threading
+import traceback
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List
+from utils import load_config, config_overrides, validate_config, ConfigError, STORY_TYPES, IMAGE_STYLES, VOICES
+from concurrency import configure_stage_limits
+from rate_limiter import get_rate_limit_metrics
+
+
+def load_jobs(job_file: str) -> List[Dict[str, Any]]:
+    """Read jobs from a JSONL or CSV file.
+
+    Each job needs story_type, image_style and voice_name, and may carry an
+    optional id, topic and config (settings overriding config.json for that
+    job only; a JSON object, or a JSON string in CSV files).
+    """
+    jobs = []
+    with open(job_file, "r", encoding="utf-8") as f:
+        if job_file.lower().endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+
+    for i, row in enumerate(rows, 1):
+        job = {
+            "id": str(row.get("id") or i),
+            "story_type": (row.get("story_type") or "").strip(),
+            "image_style": (row.get("image_style") or "").strip(),
+            "voice_name": (row.get("voice_name") or "").strip(),
+            "topic": (row.get("topic") or "").strip() or None,
+            "config": row.get("config") or {},
+        }
+        if isinstance(job["config"], str):
+            job["config"] = json.loads(job["config"])
+        if job["story_type"] not in STORY_TYPES:
+            raise ValueError(f"Job {job['id']}: unknown story_type {job['story_type']!r}")
+        if job["image_style"] not in IMAGE_STYLES:
+            raise ValueError(f"Job {job['id']}: unknown image_style {job['image_style']!r}")
+        if job["voice_name"] not in VOICES:
+            raise ValueError(f"Job {job['id']}: unknown voice_name {job['voice_name']!r}")
+        try:
+            validate_config(job["config"], overrides=True)
+        except ConfigError as e:
+            raise ConfigError(f"Job {job['id']}: {e}") from None
+        jobs.append(job)
+    return jobs
+
+
+def run_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    from main import run_pipeline
+
+    start_time = time.time()
+    result = {
+        "id": job["id"],
+        "story_type": job["story_type"],
+        "image_style": job["image_style"],
+        "voice_name": job["voice_name"],
+        "topic": job["topic"],
+        "config": job["config"],
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    try:
+        with config_overrides(job["config"]):
+            outputs = run_pipeline(job["story_type"], job["image_style"], job["voice_name"], topic=job["topic"])
+        if outputs is None:
+            result["status"] = "failed"
+        else:
+            result["status"] = "succeeded"
+            result.update(outputs)
+    except Exception as e:
+        traceback.print_exc()
+        result["status"] = "error"
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["total_time"] = time.time() - start_time
+    return result
+
+
+def run_batch(job_file: str, results_file: str, max_jobs: int = None) -> List[Dict[str, Any]]:
+    config = load_config()
+    batch_config = config["batch"]
+    if max_jobs is None:
+        max_jobs = batch_config["max_jobs"]
+
+    jobs = load_jobs(job_file)
+    configure_stage_limits(batch_config["stage_limits"])
+    print(f"Running {len(jobs)} jobs with {max_jobs} concurrent pipelines")
+
+    results = []
+    results_lock = threading.Lock()
+    start_time = time.time()
+
+    os.makedirs(os.path.dirname(os.path.abspath(results_file)), exist_ok=True)
+    with ThreadPoolExecutor(max_workers=max(1, max_jobs)) as executor:
+        futures = {executor.submit(run_job, job): job for job in jobs}
+        for future in as_completed(futures):
+            result = future.result()
+            # Append each result as soon as its job finishes so progress survives a crash
+            with results_lock:
+                results.append(result)
+                with open(results_file, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(result, ensure_ascii=False) + "\n")
+            print(f"Job {result['id']} {result['status']} in {result['total_time']:.2f} seconds")
+
+    succeeded = sum(1 for result in results if result["status"] == "succeeded")
+    print(f"Batch finished: {succeeded}/{len(jobs)} succeeded in {time.time() - start_time:.2f} seconds")
+    print(f"Results written to {results_file}")
+    for provider, metrics in get_rate_limit_metrics().items():
+        print(
+            f"  {provider}: {metrics['calls']} calls, {metrics['retries']} retries, "
+            f"{metrics['throttled']} throttled, {metrics['failures']} failed, "
+            f"{metrics['queue_seconds']:.1f}s queued, {metrics['backoff_seconds']:.1f}s backing off"
+        )
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate many faceless videos from a job file without prompts.")
+    parser.add_argument("job_file", help="JSONL or CSV file with story_type, image_style, voice_name and optional topic")
+    parser.add_argument("--results", default="batch_results.jsonl", help="JSONL file that receives one result per job")
+    parser.add_argument("--max-jobs", type=int, default=None, help="number of pipelines to run concurrently (default: batch.max_jobs)")
+    args = parser.parse_args(argv)
+
+    run_batch(args.job_file, args.results, args.max_jobs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,420 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+import tracemalloc
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+
+
+def create_test_image(filename, width=768, height=1344):
+    # Noise plus a gradient so resampling cost is realistic
+    rng = np.random.default_rng(0)
+    gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+    noise = rng.integers(0, 64, (height, width, 3), dtype=np.uint8)
+    image = np.clip(gradient + noise, 0, 255).astype(np.uint8)
+    Image.fromarray(image).save(filename)
+    return filename
+
+
+def measure_fps(clip, duration, fps):
+    frame_times = np.arange(0, duration, 1 / fps)
+    start_time = time.perf_counter()
+    for t in frame_times:
+        clip.get_frame(t)
+    elapsed = time.perf_counter() - start_time
+    return len(frame_times) / elapsed
+
+
+def benchmark_zoom(image_file=None, duration=5.0, fps=24, upscale=2.0):
+    from moviepy.editor import ImageClip
+    from transitions import zoom, zoom_still
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if image_file is None:
+            image_file = create_test_image(os.path.join(tmp_dir, "scene.png"))
+
+        results = {
+            "warp_affine": measure_fps(zoom(ImageClip(image_file).set_duration(duration)), duration, fps),
+            "precomputed": measure_fps(zoom_still(image_file, duration, fps=fps, upscale=1), duration, fps),
+            f"precomputed_upscale_{upscale:g}": measure_fps(
+                zoom_still(image_file, duration, fps=fps, upscale=upscale), duration, fps
+            ),
+        }
+
+    baseline = results["warp_affine"]
+    print(f"Zoom renderer throughput ({duration:g}s at {fps} fps):")
+    for name, frames_per_second in results.items():
+        print(f"  {name:<28} {frames_per_second:8.1f} frames/s  ({frames_per_second / baseline:.2f}x)")
+    return results
+
+
+def measure_effect(effect, frame, frame_count, fps):
+    """Return ns per frame and bytes allocated per frame of effect(frame, t) over frame_count frames."""
+    frame_times = np.arange(frame_count) / fps
+    effect(frame, frame_times[0])  # an EffectChain allocates its buffers on the first frame
+    start_time = time.perf_counter_ns()
+    for t in frame_times:
+        effect(frame, t)
+    ns_per_frame = (time.perf_counter_ns() - start_time) / frame_count
+
+    # Timed separately: tracemalloc slows every allocation down
+    allocated = 0
+    tracemalloc.start()
+    try:
+        for t in frame_times:
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            effect(frame, t)
+            allocated += tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+    return ns_per_frame, allocated / frame_count
+
+
+def benchmark_effects(width=720, height=1280, frame_count=240, fps=24):
+    from transitions import EffectChain, Shake, Zoom
+
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    duration = frame_count / fps
+    effects = {
+        # One full-frame allocation per frame, for reference
+        "copy": lambda frame, t: frame.copy(),
+        "shake": EffectChain(Shake(duration)),
+        "zoom": EffectChain(Zoom(duration, fps)),
+        "shake+zoom": EffectChain(Shake(duration), Zoom(duration, fps)),
+    }
+
+    results = {}
+    for name, effect in effects.items():
+        ns_per_frame, allocated = measure_effect(effect, frame, frame_count, fps)
+        results[name] = {"ns_per_frame": ns_per_frame, "bytes_per_frame": allocated}
+
+    print(f"Frame effects on {width}x{height} frames ({frame_count} frames):")
+    for name, result in results.items():
+        print(
+            f"  {name:<12} {result['ns_per_frame']:12,.0f} ns/frame"
+            f"  {result['bytes_per_frame'] / 1024:10.1f} KiB allocated/frame"
+            f"  ({result['bytes_per_frame'] / frame.nbytes:.2f} frames)"
+        )
+    return results
+
+
+def create_test_audio(filename, duration):
+    from ffmpeg_renderer import get_ffmpeg_exe
+
+    subprocess.run(
+        [get_ffmpeg_exe(), "-y", "-loglevel", "error", "-f", "lavfi",
+         "-i", f"sine=frequency=220:duration={duration}", "-ac", "1", filename],
+        check=True,
+    )
+    return filename
+
+
+def create_test_scenes(tmp_dir, scene_count, scene_duration, width=720, height=1280):
+    transitions = ["zoom-in", "zoom-out", "none"]
+    scene_transitions = ["cut", "crossfade", "slide", "whip-pan"]
+    scenes = []
+    for i in range(1, scene_count + 1):
+        scenes.append({
+            "scene_number": i,
+            "image": create_test_image(os.path.join(tmp_dir, f"scene_{i}.png"), width, height),
+            "audio": create_test_audio(os.path.join(tmp_dir, f"scene_{i}.mp3"), scene_duration),
+            "transition_type": transitions[(i - 1) % len(transitions)],
+            "scene_transition": scene_transitions[(i - 1) % len(scene_transitions)],
+        })
+    return scenes
+
+
+@contextmanager
+def sample_peak_rss(interval=0.05):
+    """Track the highest RSS of this process while the block runs, sampled from a background thread."""
+    from utils import current_rss_mb
+
+    start_rss = current_rss_mb()
+    result = {"start": start_rss, "peak": start_rss}
+    stop = threading.Event()
+
+    def sample():
+        while not stop.wait(interval):
+            rss = current_rss_mb()
+            if rss is not None and rss > result["peak"]:
+                result["peak"] = rss
+
+    thread = threading.Thread(target=sample, daemon=True)
+    thread.start()
+    try:
+        yield result
+    finally:
+        stop.set()
+        thread.join()
+
+
+def benchmark_render(scene_count=6, scene_duration=10.0, renderers=("moviepy", "ffmpeg"), static=False,
+                     scene_transition=None, hold_static_frames=None):
+    """Render the same test scenes with each renderer.
+
+    static renders every scene without a zoom; scene_transition and
+    hold_static_frames override the video settings of the same names.
+    """
+    from utils import config_overrides
+    from audio_generator import get_audio_duration
+    from video_creator import render_with_moviepy, render_with_ffmpeg, render_with_segments, render_with_streaming
+
+    overrides = {}
+    if scene_transition is not None:
+        overrides["scene_transition"] = scene_transition
+    if hold_static_frames is not None:
+        overrides["hold_static_frames"] = hold_static_frames
+    with config_overrides({"video": overrides} if overrides else None) as config:
+        video_config = config["video"]
+    render_funcs = {
+        "moviepy": render_with_moviepy,
+        "ffmpeg": render_with_ffmpeg,
+        "segments": render_with_segments,
+        "streaming": render_with_streaming,
+    }
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        scenes = create_test_scenes(tmp_dir, scene_count, scene_duration)
+        if static:
+            for scene in scenes:
+                scene["transition_type"] = "none"
+        durations = [get_audio_duration(scene["audio"]) for scene in scenes]
+        total_frames = sum(durations) * video_config["fps"]
+
+        for renderer in renderers:
+            output_dir = os.path.join(tmp_dir, renderer)
+            os.makedirs(output_dir)
+            output_file = os.path.join(output_dir, "story_video.mp4")
+            start_time = time.perf_counter()
+            with sample_peak_rss() as rss:
+                render_funcs[renderer](scenes, durations, output_file, video_config)
+            elapsed = time.perf_counter() - start_time
+            results[renderer] = {
+                "seconds": elapsed,
+                "frames_per_second": total_frames / elapsed,
+                "size_bytes": os.path.getsize(output_file),
+                "rss_growth_mb": rss["peak"] - rss["start"] if rss["start"] is not None else None,
+            }
+
+    kind = "static scenes" if static else "scenes"
+    print(f"Render of {scene_count} {kind} x {scene_duration:g}s at 720x1280, {video_config['scene_transition']} transitions,"
+          f" held stills {'on' if video_config['hold_static_frames'] else 'off'}:")
+    for renderer, result in results.items():
+        # RSS growth is this process's peak during the render over its RSS before it
+        memory = f"  +{result['rss_growth_mb']:.0f} MB RSS" if result["rss_growth_mb"] is not None else ""
+        print(
+            f"  {renderer:<12} {result['seconds']:7.2f} s  {result['frames_per_second']:8.1f} frames/s"
+            f"  {result['size_bytes'] / 1e6:6.2f} MB{memory}"
+        )
+    return results
+
+
+def benchmark_pipeline(videos=1, concurrency=1, scenes=8, chat_latency=1.0, tts_latency=0.5,
+                       image_latency=2.0, renderer=None, streaming=False):
+    """Run the full pipeline offline for several videos and measure where the time goes.
+
+    OpenAI chat and TTS are replaced by offline.OfflineOpenAIClient and images
+    come from the local_stub backend, each with a fixed latency, so results
+    are reproducible and cost nothing. Image and speech caches are bypassed.
+    """
+    from main import run_pipeline
+    from cache import set_cache
+    from concurrency import configure_stage_limits, submit_in_context
+    from manifest import Manifest
+    from offline import OfflineOpenAIClient
+    from utils import config_overrides, load_config, peak_rss_mb
+
+    overrides = {
+        "image_generation": {"backend": "local_stub"},
+        "local_stub": {"latency_seconds": image_latency, "latency_jitter_seconds": 0.0},
+        "captions": {"engine": "native"},
+        "pipeline": {"streaming": streaming},
+    }
+    if renderer:
+        overrides["video"] = {"renderer": renderer}
+    set_cache("images", None)
+    set_cache("tts", None)
+    configure_stage_limits(load_config()["batch"]["stage_limits"])
+    client = OfflineOpenAIClient(chat_latency, tts_latency, scenes)
+
+    def run_video(story_dir):
+        os.makedirs(story_dir)
+        with config_overrides(overrides) as config:
+            start_time = time.perf_counter()
+            outputs = run_pipeline("Scary", "cinematic", "alloy", story_dir=story_dir, client=client)
+            elapsed = time.perf_counter() - start_time
+            if outputs is None:
+                raise RuntimeError(f"Pipeline failed for {story_dir}")
+            durations = Manifest(story_dir).get("audio")["data"]["durations"]
+            frames = sum(duration for duration in durations if duration) * config["video"]["fps"]
+        # Streaming renders inside the "scenes" stage, next to image and speech generation
+        render_seconds = outputs["timings"].get("video", outputs["timings"].get("scenes"))
+        return outputs["timings"], elapsed, frames / render_seconds
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            futures = [
+                submit_in_context(executor, run_video, os.path.join(tmp_dir, f"video_{i}"))
+                for i in range(videos)
+            ]
+            runs = [future.result() for future in futures]
+        wall_seconds = time.perf_counter() - start_time
+
+    stages = {}
+    for timings, _, _ in runs:
+        for stage, seconds in timings.items():
+            stages.setdefault(stage, []).append(seconds)
+    results = {
+        "settings": {
+            "videos": videos,
+            "concurrency": concurrency,
+            "scenes": scenes,
+            "chat_latency": chat_latency,
+            "tts_latency": tts_latency,
+            "image_latency": image_latency,
+            "renderer": renderer or load_config()["video"]["renderer"],
+            "streaming": streaming,
+        },
+        "wall_seconds": wall_seconds,
+        "videos_per_minute": videos / wall_seconds * 60,
+        "video_seconds": float(np.mean([elapsed for _, elapsed, _ in runs])),
+        "stage_seconds": {stage: float(np.mean(values)) for stage, values in stages.items()},
+        "render_frames_per_second": float(np.mean([fps for _, _, fps in runs])),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+    print(f"\nPipeline benchmark: {videos} videos x {scenes} scenes, {concurrency} at a time")
+    print(f"  {'wall clock':<24} {wall_seconds:8.2f} s  ({results['videos_per_minute']:.2f} videos/min)")
+    print(f"  {'per video':<24} {results['video_seconds']:8.2f} s")
+    for stage, seconds in results["stage_seconds"].items():
+        print(f"  {'stage ' + stage:<24} {seconds:8.2f} s")
+    print(f"  {'render':<24} {results['render_frames_per_second']:8.1f} frames/s")
+    if results["peak_rss_mb"] is not None:
+        print(
+            f"  {'peak RSS':<24} {results['peak_rss_mb']['self']:8.1f} MB"
+            f"  (largest child {results['peak_rss_mb']['children']:.1f} MB)"
+        )
+    return results
+
+
+# Metrics compared against the baseline, and whether a higher value is better
+BASELINE_METRICS = {
+    "wall_seconds": False,
+    "video_seconds": False,
+    "videos_per_minute": True,
+    "render_frames_per_second": True,
+}
+
+
+def flatten_metrics(results):
+    metrics = {name: results[name] for name in BASELINE_METRICS}
+    for stage, seconds in results["stage_seconds"].items():
+        metrics[f"stage_seconds.{stage}"] = seconds
+    if results["peak_rss_mb"] is not None:
+        metrics["peak_rss_mb.self"] = results["peak_rss_mb"]["self"]
+    return metrics
+
+
+def compare_to_baseline(results, baseline_file, tolerance=0.1):
+    """Print each metric next to the stored baseline and return the names that regressed by more than tolerance."""
+    with open(baseline_file, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline["settings"] != results["settings"]:
+        print(f"Warning: baseline {baseline_file} was recorded with different settings: {baseline['settings']}")
+
+    current = flatten_metrics(results)
+    previous = flatten_metrics(baseline)
+    regressions = []
+    print(f"\nCompared with {baseline_file}:")
+    for name, value in current.items():
+        if name not in previous or not previous[name]:
+            continue
+        change = (value - previous[name]) / previous[name]
+        higher_is_better = BASELINE_METRICS.get(name, False)
+        regressed = (-change if higher_is_better else change) > tolerance
+        if regressed:
+            regressions.append(name)
+        flag = "  REGRESSION" if regressed else ""
+        print(f"  {name:<32} {previous[name]:10.2f} -> {value:10.2f}  ({change:+.1%}){flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks for the video rendering pipeline.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    zoom_parser = subparsers.add_parser("zoom", help="compare zoom renderers in frames/sec")
+    zoom_parser.add_argument("--image", help="scene image to zoom (default: synthetic 768x1344 image)")
+    zoom_parser.add_argument("--duration", type=float, default=5.0)
+    zoom_parser.add_argument("--fps", type=int, default=24)
+    zoom_parser.add_argument("--upscale", type=float, default=2.0)
+
+    effects_parser = subparsers.add_parser("effects", help="time frame effects and count their allocations")
+    effects_parser.add_argument("--width", type=int, default=720)
+    effects_parser.add_argument("--height", type=int, default=1280)
+    effects_parser.add_argument("--frames", type=int, default=240)
+
+    render_parser = subparsers.add_parser("render", help="compare end-to-end video renderers")
+    render_parser.add_argument("--scenes", type=int, default=6)
+    render_parser.add_argument("--scene-duration", type=float, default=10.0)
+    render_parser.add_argument("--renderers", nargs="+", default=["moviepy", "ffmpeg", "segments", "streaming"])
+    render_parser.add_argument("--static", action="store_true", help="render every scene without a zoom")
+    render_parser.add_argument(
+        "--scene-transition", choices=["storyboard", "cut", "crossfade", "slide", "whip-pan"],
+        help="default: video.scene_transition",
+    )
+    render_parser.add_argument(
+        "--hold-static-frames", choices=["on", "off"], help="default: video.hold_static_frames",
+    )
+
+    pipeline_parser = subparsers.add_parser(
+        "pipeline", help="run the full pipeline offline with simulated API latency"
+    )
+    pipeline_parser.add_argument("--videos", type=int, default=1, help="number of videos to produce")
+    pipeline_parser.add_argument("--concurrency", type=int, default=1, help="videos produced at the same time")
+    pipeline_parser.add_argument("--scenes", type=int, default=8)
+    pipeline_parser.add_argument("--chat-latency", type=float, default=1.0, help="seconds per chat completion")
+    pipeline_parser.add_argument("--tts-latency", type=float, default=0.5, help="seconds per speech request")
+    pipeline_parser.add_argument("--image-latency", type=float, default=2.0, help="seconds per image")
+    pipeline_parser.add_argument("--renderer", choices=["moviepy", "ffmpeg", "segments", "streaming"], help="default: video.renderer")
+    pipeline_parser.add_argument("--streaming", action="store_true", help="use the streaming per-scene pipeline")
+    pipeline_parser.add_argument("--baseline", metavar="FILE", help="compare with results saved by --save-baseline")
+    pipeline_parser.add_argument("--save-baseline", metavar="FILE", help="save these results as the new baseline")
+    pipeline_parser.add_argument("--tolerance", type=float, default=0.1, help="relative change counted as a regression")
+
+    args = parser.parse_args(argv)
+    if args.command == "zoom":
+        benchmark_zoom(args.image, args.duration, args.fps, args.upscale)
+    elif args.command == "effects":
+        benchmark_effects(args.width, args.height, args.frames)
+    elif args.command == "render":
+        hold = None if args.hold_static_frames is None else args.hold_static_frames == "on"
+        benchmark_render(args.scenes, args.scene_duration, args.renderers, args.static, args.scene_transition, hold)
+    elif args.command == "pipeline":
+        results = benchmark_pipeline(
+            args.videos, args.concurrency, args.scenes, args.chat_latency, args.tts_latency,
+            args.image_latency, args.renderer, args.streaming,
+        )
+        regressions = compare_to_baseline(results, args.baseline, args.tolerance) if args.baseline else []
+        if args.save_baseline:
+            os.makedirs(os.path.dirname(os.path.abspath(args.save_baseline)), exist_ok=True)
+            with open(args.save_baseline, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=4)
+            print(f"Baseline saved to {args.save_baseline}")
+        if regressions:
+            sys.exit(f"{len(regressions)} metrics regressed: {', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    main()
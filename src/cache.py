@@ -0,0 +1,168 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+from typing import Any, Dict, Optional
+from utils import load_config
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def make_cache_key(*parts: Any) -> str:
+    # Hash a canonical JSON encoding so dict ordering never changes the key
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class DiskCache:
+    """Content-addressed file cache with a size cap and LRU eviction.
+
+    Entries are stored as <key><suffix> files inside cache_dir. A hit refreshes
+    the file's mtime, so the least recently used entries are evicted first once
+    the total size exceeds max_size_bytes.
+    """
+
+    def __init__(self, cache_dir: str, max_size_bytes: int, suffix: str = ""):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}{self.suffix}")
+
+    def _touch(self, path: str) -> bool:
+        try:
+            os.utime(path, None)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _record(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            self._record(False)
+            return None
+        self._touch(path)
+        self._record(True)
+        return data
+
+    def get_file(self, key: str, output_file: str) -> bool:
+        path = self._path(key)
+        try:
+            shutil.copyfile(path, output_file)
+        except FileNotFoundError:
+            self._record(False)
+            return False
+        self._touch(path)
+        self._record(True)
+        return True
+
+    def put(self, key: str, data: bytes) -> None:
+        # Write to a temp file first so concurrent readers never see partial entries
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self._path(key))
+        self.evict()
+
+    def put_file(self, key: str, source_file: str) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        os.close(fd)
+        shutil.copyfile(source_file, tmp_path)
+        os.replace(tmp_path, self._path(key))
+        self.evict()
+
+    def evict(self) -> None:
+        with self._lock:
+            entries = []
+            total_size = 0
+            for entry in os.scandir(self.cache_dir):
+                if not entry.is_file() or not entry.name.endswith(self.suffix) or entry.name.endswith(".tmp"):
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total_size += stat.st_size
+
+            # Oldest access time first
+            entries.sort()
+            for _, size, path in entries:
+                if total_size <= self.max_size_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                total_size -= size
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = 0
+            size = 0
+            for entry in os.scandir(self.cache_dir):
+                if entry.is_file() and entry.name.endswith(self.suffix) and not entry.name.endswith(".tmp"):
+                    entries += 1
+                    size += entry.stat().st_size
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": entries,
+                "size_bytes": size,
+                "max_size_bytes": self.max_size_bytes,
+            }
+
+
+_caches: Dict[str, Optional[DiskCache]] = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(name: str, suffix: str = "") -> Optional[DiskCache]:
+    """Return the shared cache configured under config['cache'][name], or None if disabled."""
+    with _caches_lock:
+        if name not in _caches:
+            cache_config = load_config()["cache"][name]
+            if cache_config["enabled"]:
+                cache_dir = cache_config["dir"]
+                if not os.path.isabs(cache_dir):
+                    cache_dir = os.path.join(os.path.dirname(script_dir), cache_dir)
+                _caches[name] = DiskCache(
+                    cache_dir,
+                    int(cache_config["max_size_mb"] * 1024 * 1024),
+                    suffix,
+                )
+            else:
+                _caches[name] = None
+        return _caches[name]
+
+
+def cache_stats() -> Dict[str, Dict[str, Any]]:
+    """Return stats() of every cache opened in this process, by name."""
+    with _caches_lock:
+        caches = {name: cache for name, cache in _caches.items() if cache is not None}
+    return {name: cache.stats() for name, cache in caches.items()}
+
+
+def set_cache(name: str, cache: Optional[DiskCache]) -> None:
+    """Replace the shared cache for name; None bypasses caching, as benchmarks need."""
+    with _caches_lock:
+        _caches[name] = cache
@@ -0,0 +1,305 @@
+import os
+import json
+import tempfile
+import threading
+import numpy as np
+from PIL import Image, ImageColor, ImageDraw, ImageFilter, ImageFont
+from typing import Any, Dict, List, Optional, Tuple
+from word_timing import scene_word_timings
+import tracing
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+font_path = os.path.join(os.path.dirname(script_dir), "font")
+atlas_path = os.path.join(font_path, "atlas")
+# Words are rasterized at this many sub-pixel x offsets, as PIL does for fractional positions
+SUBPIXEL_STEPS = 4
+
+
+def build_caption_track(
+    scenes: List[Dict[str, Any]],
+    durations: List[float],
+    offsets: List[float],
+    method: str = "energy",
+) -> List[Dict[str, Any]]:
+    track = []
+    with tracing.span("captions.track", scenes=len(scenes)) as span:
+        for scene, duration, offset in zip(scenes, durations, offsets):
+            for timing in scene_word_timings(scene, duration, method):
+                track.append({
+                    "word": timing["word"],
+                    "start": timing["start"] + offset,
+                    "end": timing["end"] + offset,
+                })
+        span.set(words=len(track))
+    return track
+
+
+class WordAtlas:
+    """Rasterized caption words for one font, size, stroke width and shadow blur.
+
+    Each word is stored as three color-independent alpha masks: the glyph
+    fill, the fill plus its stroke, and the blurred shadow. Any color
+    combination (normal and highlighted words) is composited from the same
+    masks, so a word is rasterized once per style and sub-pixel offset. The
+    atlas is kept in font/atlas/ and shared by every video rendered with
+    that style.
+    """
+
+    def __init__(self, captions_config: Dict[str, Any], path: Optional[str] = None, max_words: int = 0):
+        self.font = ImageFont.truetype(os.path.join(font_path, captions_config["font"]), captions_config["font_size"])
+        self.stroke_width = captions_config["stroke_width"]
+        self.blur_radius = captions_config["shadow_blur"] * captions_config["font_size"]
+        self.margin = int(self.stroke_width + 2 * self.blur_radius + 2)
+        ascent, descent = self.font.getmetrics()
+        self.height = ascent + descent + 2 * self.margin
+        self.path = path
+        self.max_words = max_words
+        self.words: Dict[Tuple[str, int], np.ndarray] = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            try:
+                with np.load(path) as data:
+                    keys = json.loads(str(data["words"]))
+                    for (word, phase), masks in zip(keys, np.split(data["masks"], data["offsets"][1:-1], axis=2)):
+                        self.words[(word, phase)] = masks
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Ignoring unreadable caption atlas {path}: {e}")
+                self.words = {}
+
+    def _rasterize(self, word: str, phase: int) -> np.ndarray:
+        width = int(np.ceil(self.font.getlength(word))) + 2 * self.margin + 1
+        size = (width, self.height)
+        origin = (self.margin + phase / SUBPIXEL_STEPS, self.margin)
+        fill = Image.new("L", size, 0)
+        ImageDraw.Draw(fill).text(origin, word, font=self.font, fill=255)
+        outer = Image.new("L", size, 0)
+        ImageDraw.Draw(outer).text(origin, word, font=self.font, fill=255, stroke_width=self.stroke_width, stroke_fill=255)
+        shadow = outer.filter(ImageFilter.GaussianBlur(self.blur_radius))
+        return np.stack([np.asarray(fill), np.asarray(outer), np.asarray(shadow)])
+
+    def get(self, word: str, phase: int = 0) -> np.ndarray:
+        """Return the (fill, outer, shadow) masks of word drawn phase / SUBPIXEL_STEPS pixels
+        right of the margin, shape (3, height, width)."""
+        key = (word, phase)
+        masks = self.words.get(key)
+        if masks is None:
+            masks = self._rasterize(word, phase)
+            with self._lock:
+                if not self.max_words or len(self.words) < self.max_words:
+                    self.words[key] = masks
+                    self._dirty = True
+        return masks
+
+    def save(self) -> None:
+        """Write the atlas if words were added since it was loaded."""
+        with self._lock:
+            if not self.path or not self._dirty or not self.words:
+                return
+            keys = list(self.words)
+            masks = [self.words[key] for key in keys]
+            self._dirty = False
+        offsets = np.cumsum([0] + [mask.shape[2] for mask in masks])
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # Replace atomically; concurrent renders may overwrite each other's additions, never corrupt the file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix=".npz")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez_compressed(
+                    f, words=np.array(json.dumps(keys)), masks=np.concatenate(masks, axis=2), offsets=offsets
+                )
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+_atlases: Dict[str, WordAtlas] = {}
+_atlases_lock = threading.Lock()
+
+
+def get_word_atlas(captions_config: Dict[str, Any]) -> WordAtlas:
+    """Return the shared atlas for the caption font and style, loading it from font/atlas/ on first use."""
+    font_name = os.path.splitext(captions_config["font"])[0]
+    style = f"{captions_config['font_size']}-s{captions_config['stroke_width']}-b{captions_config['shadow_blur']:g}"
+    key = f"{font_name}-{style}"
+    with _atlases_lock:
+        if key not in _atlases:
+            path = os.path.join(atlas_path, f"{key}.npz") if captions_config["atlas_cache"] else None
+            _atlases[key] = WordAtlas(captions_config, path, captions_config["atlas_max_words"])
+        return _atlases[key]
+
+
+def _blend_over(color, coverage, x, alpha, layer_color):
+    """Composite a word layer at column x over a premultiplied band, clipped to the band width."""
+    x0, x1 = max(0, x), min(color.shape[1], x + alpha.shape[1])
+    if x1 <= x0:
+        return
+    alpha = alpha[:, x0 - x:x1 - x, None]
+    if layer_color.ndim == 3:
+        layer_color = layer_color[:, x0 - x:x1 - x]
+    band_color = color[:, x0:x1]
+    band_color *= 1 - alpha
+    band_color += layer_color * alpha
+    band_coverage = coverage[:, x0:x1]
+    band_coverage *= 1 - alpha
+    band_coverage += alpha
+
+
+class CaptionRenderer:
+    """Burns word-highlighted captions into video frames.
+
+    Words are grouped into lines that fit the frame width; the active line is
+    drawn centered with the current word in the highlight color. Lines are
+    composited from the word masks of the shared WordAtlas, and each
+    (line, highlighted word) overlay is built once and kept while its line
+    is shown.
+    """
+
+    def __init__(self, captions_config: Dict[str, Any], frame_size):
+        self.config = captions_config
+        self.width, self.height = frame_size
+        self.atlas = get_word_atlas(captions_config)
+        self.font = self.atlas.font
+        self.space_width = self.font.getlength(" ")
+        self.colors = {
+            name: np.array(ImageColor.getrgb(captions_config[name])[:3], dtype=np.float32)
+            for name in ("font_color", "highlight_color", "stroke_color")
+        }
+        self.lines = []
+        self._layers = {}
+        self._overlays = {}
+
+    def set_words(self, words: List[Dict[str, Any]]) -> None:
+        max_width = self.width - 2 * self.config["padding"]
+        self.lines = []
+        current = []
+        current_width = 0.0
+        for word in words:
+            word_width = self.font.getlength(word["word"])
+            if current and current_width + self.space_width + word_width > max_width:
+                self.lines.append(current)
+                current = []
+                current_width = 0.0
+            current_width += (self.space_width if current else 0) + word_width
+            current.append(word)
+        if current:
+            self.lines.append(current)
+        self._line_starts = np.array([line[0]["start"] for line in self.lines])
+        self._layers = {}
+        self._overlays = {}
+
+        # Rasterize this video's new words up front and keep them for later videos
+        for line in self.lines:
+            for (_, phase), word in zip(self._word_positions(line), line):
+                self.atlas.get(word["word"], phase)
+        self.atlas.save()
+
+    def active(self, t):
+        """Return the (line, word) indices of the caption shown at time t, or None."""
+        if not self.lines:
+            return None
+        line_index = int(np.searchsorted(self._line_starts, t, side="right")) - 1
+        if line_index < 0:
+            return None
+        line = self.lines[line_index]
+        if t >= line[-1]["end"]:
+            return None
+        word_index = 0
+        for i, word in enumerate(line):
+            if word["start"] <= t:
+                word_index = i
+        return line_index, word_index
+
+    def _word_positions(self, line):
+        """Return the (mask column, sub-pixel phase) of each word in line, centered in the frame."""
+        text_width = sum(self.font.getlength(word["word"]) for word in line) + self.space_width * (len(line) - 1)
+        x = (self.width - text_width) / 2
+        positions = []
+        for word in line:
+            column = int(np.floor(x))
+            phase = int(round((x - column) * SUBPIXEL_STEPS))
+            if phase == SUBPIXEL_STEPS:
+                column, phase = column + 1, 0
+            positions.append((column - self.atlas.margin, phase))
+            x += self.font.getlength(word["word"]) + self.space_width
+        return positions
+
+    def _line_layers(self, line_index):
+        """Return the shadow band of a line and the (column, alpha, normal, highlighted) layers of its words."""
+        if line_index in self._layers:
+            return self._layers[line_index]
+
+        config = self.config
+        line = self.lines[line_index]
+        # Premultiplied color (0-255) and coverage (0-1) of the band, built back to front
+        color = np.zeros((self.atlas.height, self.width, 3), dtype=np.float32)
+        coverage = np.zeros((self.atlas.height, self.width, 1), dtype=np.float32)
+        placed = [
+            (x, self.atlas.get(word["word"], phase))
+            for (x, phase), word in zip(self._word_positions(line), line)
+        ]
+        if config["shadow_strength"] > 0:
+            for x, masks in placed:
+                shadow = np.clip(masks[2].astype(np.float32) * config["shadow_strength"], 0, 255) / 255
+                _blend_over(color, coverage, x, shadow, np.zeros(3, dtype=np.float32))
+
+        stroke = self.colors["stroke_color"]
+        words = []
+        for x, masks in placed:
+            outer = masks[1].astype(np.float32) / 255
+            # Stroke where only the outline covers, fill color inside the glyph
+            inside = np.divide(masks[0], masks[1], out=np.zeros(outer.shape, np.float32), where=masks[1] > 0)
+            inside = np.minimum(inside, 1)[:, :, None]
+            words.append((
+                x,
+                outer,
+                stroke + (self.colors["font_color"] - stroke) * inside,
+                stroke + (self.colors["highlight_color"] - stroke) * inside,
+            ))
+        # Frames arrive in time order, so only the current line's layers are kept
+        self._layers = {line_index: (color, coverage, words)}
+        return self._layers[line_index]
+
+    def _overlay(self, line_index, word_index):
+        key = (line_index, word_index)
+        if key in self._overlays:
+            return self._overlays[key]
+        # Like the line layers, only the current line's overlays are kept
+        if any(cached_line != line_index for cached_line, _ in self._overlays):
+            self._overlays = {}
+
+        config = self.config
+        band_height = self.atlas.height
+        shadow_color, shadow_coverage, words = self._line_layers(line_index)
+        color = shadow_color.copy()
+        coverage = shadow_coverage.copy()
+        for i, (x, outer, normal, highlighted) in enumerate(words):
+            _blend_over(color, coverage, x, outer, highlighted if i == word_index else normal)
+
+        premultiplied = np.round(color * 255).astype(np.uint16)
+        inverse_alpha = np.round(255 - coverage * 255).astype(np.uint16)
+
+        if config["position"] == "top":
+            y0 = config["padding"]
+        elif config["position"] == "bottom":
+            y0 = self.height - config["padding"] - band_height
+        else:
+            y0 = (self.height - band_height) // 2
+        y0 = max(0, min(self.height - band_height, y0))
+
+        overlay = (y0, premultiplied, inverse_alpha)
+        self._overlays[key] = overlay
+        return overlay
+
+    def composite(self, frame: np.ndarray, t: float, out: np.ndarray) -> np.ndarray:
+        """Write frame with the caption active at time t into out and return it."""
+        np.copyto(out, frame)
+        active = self.active(t)
+        if active is None:
+            return out
+        y0, premultiplied, inverse_alpha = self._overlay(*active)
+        band = out[y0:y0 + premultiplied.shape[0]]
+        band[:] = (band * inverse_alpha + premultiplied + 127) // 255
+        return out
@@ -0,0 +1,27 @@
+import threading
+import contextvars
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Optional
+
+# Process-wide limits on how many calls of each stage kind may run at once.
+# Stages are "llm", "image", "tts" and "render"; unconfigured stages are unlimited.
+_stage_semaphores: Dict[str, threading.BoundedSemaphore] = {}
+
+
+def configure_stage_limits(limits: Dict[str, Optional[int]]) -> None:
+    _stage_semaphores.clear()
+    for stage, limit in limits.items():
+        if limit:
+            _stage_semaphores[stage] = threading.BoundedSemaphore(limit)
+
+
+@contextmanager
+def stage_slot(stage: str):
+    semaphore = _stage_semaphores.get(stage)
+    with semaphore if semaphore is not None else nullcontext():
+        yield
+
+
+def submit_in_context(executor, fn, *args, **kwargs):
+    # Each task runs in a copy of the caller's context, so per-job config overrides reach worker threads
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
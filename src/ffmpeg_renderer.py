@@ -0,0 +1,550 @@
+import os
+import glob
+import time
+import tempfile
+import threading
+import subprocess
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import cv2
+from PIL import Image
+from typing import Any, Dict, List, Optional, Tuple
+import imageio_ffmpeg
+from transitions import SCENE_TRANSITIONS, blend_scenes, zoom_still
+from manifest import hash_file, hash_inputs
+from captions import CaptionRenderer, build_caption_track
+import tracing
+
+
+def get_ffmpeg_exe() -> str:
+    return imageio_ffmpeg.get_ffmpeg_exe()
+
+
+def load_scene_image(image_file, size):
+    image = np.array(Image.open(image_file).convert("RGB"))
+    if (image.shape[1], image.shape[0]) != size:
+        image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+    return image
+
+
+def get_output_size(image_file):
+    # yuv420p needs even dimensions
+    with Image.open(image_file) as image:
+        width, height = image.size
+    return width - width % 2, height - height % 2
+
+
+def scene_frames(scene, duration, frame_count, fps, size, video_config, lead_in=None, lead_out=None):
+    """Yield frame_count RGB frames of the given size for one scene.
+
+    lead_in and lead_out are transition frames that replace the scene's
+    first and last frames; only the frames between them are rendered.
+    """
+    first = len(lead_in) if lead_in is not None else 0
+    last = frame_count - (len(lead_out) if lead_out is not None else 0)
+    if lead_in is not None:
+        yield from lead_in
+    transition_type = scene["transition_type"]
+    if transition_type in ("zoom-in", "zoom-out"):
+        mode = "in" if transition_type == "zoom-in" else "out"
+        make_frame = zoom_still(
+            scene["image"], duration, fps=fps, mode=mode, upscale=video_config["zoom_upscale"]
+        ).make_frame
+        resize_buffer = None
+        for i in range(first, last):
+            frame = make_frame(i / fps)
+            if (frame.shape[1], frame.shape[0]) != size:
+                if resize_buffer is None:
+                    resize_buffer = np.empty((size[1], size[0], 3), dtype=np.uint8)
+                cv2.resize(frame, size, dst=resize_buffer, interpolation=cv2.INTER_AREA)
+                frame = resize_buffer
+            yield frame
+    elif last > first:
+        frame = load_scene_image(scene["image"], size)
+        for _ in range(first, last):
+            yield frame
+    if lead_out is not None:
+        yield from lead_out
+
+
+def scene_still(scene, duration, size, video_config, last=False):
+    """Return the first or last frame of a scene, as scene_frames() renders it."""
+    transition_type = scene["transition_type"]
+    if transition_type not in ("zoom-in", "zoom-out"):
+        return load_scene_image(scene["image"], size)
+    mode = "in" if transition_type == "zoom-in" else "out"
+    fps = video_config["fps"]
+    # make_frame clamps to the clip's last frame, and returns a buffer it reuses
+    frame = zoom_still(
+        scene["image"], duration, fps=fps, mode=mode, upscale=video_config["zoom_upscale"]
+    ).make_frame(duration if last else 0)
+    if (frame.shape[1], frame.shape[0]) != size:
+        return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+    return frame.copy()
+
+
+# Frames sent for a held run that shows a new image. x264 gives a frame the
+# quality its bits earn over the frames in its lookahead that reuse it, so a
+# still sent once would look worse than the same still at the full frame rate
+HELD_RUN_FRAMES = 12
+
+
+def scene_runs(scene, frame_count, lead_in_count, lead_out_count, video_config) -> List[Tuple[int, int]]:
+    """Return the (length, frames sent) runs of identical frames that scene_frames() yields.
+
+    Zoom and transition frames each change, so they are runs of one; the
+    still between the transitions of any other scene is a single run.
+    """
+    still = frame_count - lead_in_count - lead_out_count
+    if not video_config["hold_static_frames"] or scene["transition_type"] in ("zoom-in", "zoom-out") or still < 2:
+        return [(1, 1)] * frame_count
+    return [(1, 1)] * lead_in_count + [(still, min(still, HELD_RUN_FRAMES))] + [(1, 1)] * lead_out_count
+
+
+def caption_runs(runs, caption_renderer: CaptionRenderer, first_frame: int, fps: int) -> List[Tuple[int, int]]:
+    """Split runs wherever the burned-in caption changes; first_frame is the index of the first run's frame.
+
+    Only the caption band changes after a split, so the runs after it are
+    sent as a single frame.
+    """
+    split = []
+    index = first_frame
+    for length, sent in runs:
+        run_start = index
+        active = caption_renderer.active(index / fps)
+        for i in range(index + 1, index + length):
+            current = caption_renderer.active(i / fps)
+            if current != active:
+                split.append((i - run_start, min(i - run_start, sent)))
+                run_start, active, sent = i, current, 1
+        index += length
+        split.append((index - run_start, min(index - run_start, sent)))
+    return split
+
+
+def end_runs(runs) -> List[Tuple[int, int]]:
+    """Return runs with the last HELD_RUN_FRAMES frames of a stream sent back to back.
+
+    The last run has no next frame to end it, and decode timestamps only
+    catch up past a skip on the frames after it, whatever the B-frame delay.
+    A held run that reaches into those frames is split, so it is still held
+    up to them.
+    """
+    runs = list(runs)
+    remaining = HELD_RUN_FRAMES
+    index = len(runs) - 1
+    while remaining > 0 and index >= 0:
+        length, sent = runs[index]
+        if length <= remaining:
+            runs[index] = (length, length)
+        else:
+            held = length - remaining
+            runs[index:index + 1] = [(held, min(held, sent)), (remaining, remaining)]
+        remaining -= length
+        index -= 1
+    return runs
+
+
+def hold_args(runs, fps: int) -> List[str]:
+    """Return ffmpeg output arguments that stretch write_runs()' frames back over their runs.
+
+    A run's frames are sent at its start and the last of them is shown until
+    the next run starts. setpts moves the frames after a skip along by the
+    frames it skipped, and the output keeps those timestamps instead of
+    duplicating frames to a constant rate. force-cfr has x264 rate the
+    frames as if they were constant rate, rather than spending a held
+    frame's whole duration worth of bits on it, and setts gives every packet
+    one frame's duration, which setpts drops.
+    """
+    terms = []
+    sent_total = 0
+    for length, sent in runs:
+        sent_total += sent
+        if length > sent:
+            terms.append(f"+{length - sent}*gte(N\\,{sent_total})")
+    if not terms:
+        return []
+    return [
+        "-vf", f"setpts=(N{''.join(terms)})/FRAME_RATE/TB", "-fps_mode", "passthrough",
+        "-x264-params", "force-cfr=1",
+        "-bsf:v", f"setts=pts=PTS:dts=DTS:duration=1/({fps}*TB)",
+    ]
+
+
+def write_runs(stdin, frames, runs, compose=None) -> None:
+    """Write frames to an ffmpeg pipe, sending each run of identical frames as hold_args() expects.
+
+    compose(frame, index) returns the frame to send for the frame at index,
+    e.g. with a caption burned in; it is called once per run.
+    """
+    frames = iter(frames)
+    index = 0
+    for length, sent in runs:
+        frame = next(frames)
+        if compose is not None:
+            frame = compose(frame, index)
+        data = memoryview(np.ascontiguousarray(frame))
+        for _ in range(sent):
+            stdin.write(data)
+        for _ in range(length - 1):
+            next(frames)
+        index += length
+
+
+def scene_transition(scene: Dict[str, Any], video_config: Dict[str, Any]) -> str:
+    """Return the transition into scene: video.scene_transition, or the storyboard's choice when that is "storyboard"."""
+    transition = video_config["scene_transition"]
+    if transition == "storyboard":
+        transition = scene.get("scene_transition", "cut")
+    return transition if transition in SCENE_TRANSITIONS else "cut"
+
+
+def transition_split(count_before: int, count_after: int, video_config: Dict[str, Any]) -> Tuple[int, int]:
+    # Frames of a transition before and after the cut; each scene gives up at most half its frames
+    half = int(round(video_config["scene_transition_seconds"] * video_config["fps"] / 2))
+    return min(half, count_before // 2), min(half, count_after // 2)
+
+
+# Transition blocks by (image pair, effect, frame counts). Scenes render in
+# order, so the block ending one scene is reused to start the next.
+_TRANSITION_CACHE_SIZE = 2
+_transition_blocks: "OrderedDict[str, np.ndarray]" = OrderedDict()
+_transition_lock = threading.Lock()
+
+
+def transition_block(before, after, size, video_config) -> np.ndarray:
+    """Return every frame of the transition between two (scene, duration, frame_count) neighbours."""
+    scene_a, duration_a, count_a = before
+    scene_b, duration_b, count_b = after
+    effect = scene_transition(scene_b, video_config)
+    head, tail = transition_split(count_a, count_b, video_config)
+    key = hash_inputs(
+        hash_file(scene_a["image"]), scene_a["transition_type"], duration_a,
+        hash_file(scene_b["image"]), scene_b["transition_type"],
+        effect, head, tail, size, video_config["fps"], video_config["zoom_upscale"],
+    )
+    with _transition_lock:
+        if key in _transition_blocks:
+            _transition_blocks.move_to_end(key)
+            return _transition_blocks[key]
+
+    with tracing.span("video.transition", effect=effect, frames=head + tail):
+        block = blend_scenes(
+            effect,
+            scene_still(scene_a, duration_a, size, video_config, last=True),
+            scene_still(scene_b, duration_b, size, video_config),
+            head + tail,
+        )
+    with _transition_lock:
+        _transition_blocks[key] = block
+        while len(_transition_blocks) > _TRANSITION_CACHE_SIZE:
+            _transition_blocks.popitem(last=False)
+    return block
+
+
+def transition_frame_counts(scene, frame_count, previous, following, video_config) -> Tuple[int, int]:
+    """Return how many of a scene's first and last frames are transition frames."""
+    lead_in = lead_out = 0
+    if previous is not None and scene_transition(scene, video_config) != "cut":
+        lead_in = transition_split(previous[2], frame_count, video_config)[1]
+    if following is not None and scene_transition(following[0], video_config) != "cut":
+        lead_out = transition_split(frame_count, following[2], video_config)[0]
+    return lead_in, lead_out
+
+
+def scene_transition_frames(scene, duration, frame_count, previous, following, size, video_config):
+    """Return the (lead_in, lead_out) transition frames of a scene, each None at a cut.
+
+    previous and following are the neighbouring (scene, duration, frame_count)
+    tuples, or None at either end of the video.
+    """
+    lead_in_count, lead_out_count = transition_frame_counts(scene, frame_count, previous, following, video_config)
+    current = (scene, duration, frame_count)
+    lead_in = lead_out = None
+    if lead_in_count:
+        lead_in = transition_block(previous, current, size, video_config)[-lead_in_count:]
+    if lead_out_count:
+        lead_out = transition_block(current, following, size, video_config)[:lead_out_count]
+    return lead_in, lead_out
+
+
+def neighbour_frames(scenes, durations, counts, index):
+    """Return the (previous, following) neighbours of scenes[index] for scene_transition_frames()."""
+    previous = (scenes[index - 1], durations[index - 1], counts[index - 1]) if index > 0 else None
+    following = (scenes[index + 1], durations[index + 1], counts[index + 1]) if index + 1 < len(scenes) else None
+    return previous, following
+
+
+def frame_counts(durations: List[float], fps: int) -> List[int]:
+    # Round cumulative boundaries so video never drifts from the concatenated audio
+    counts = []
+    elapsed = 0.0
+    for duration in durations:
+        start_frame = int(round(elapsed * fps))
+        elapsed += duration
+        counts.append(max(1, int(round(elapsed * fps)) - start_frame))
+    return counts
+
+
+def write_concat_list(paths: List[str], list_file: str) -> None:
+    with open(list_file, "w", encoding="utf-8") as f:
+        for path in paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+
+
+def encoder_args(ffmpeg_config: Dict[str, Any]) -> List[str]:
+    return [
+        "-c:v", "libx264",
+        "-preset", ffmpeg_config["preset"],
+        "-crf", str(ffmpeg_config["crf"]),
+        "-threads", str(ffmpeg_config["threads"]),
+        "-pix_fmt", "yuv420p",
+    ]
+
+
+def render_with_ffmpeg(scenes: List[Dict[str, Any]], durations: List[float], output_file: str, video_config: Dict[str, Any], captions_config: Optional[Dict[str, Any]] = None) -> None:
+    """Render scenes by streaming raw RGB frames into a single ffmpeg process.
+
+    Scene audio files are joined by ffmpeg's concat demuxer and muxed in the
+    same pass, so no frame or audio sample goes through moviepy. When
+    captions_config is given, captions are burned into the frames on the way.
+    """
+    fps = video_config["fps"]
+    size = get_output_size(scenes[0]["image"])
+    counts = frame_counts(durations, fps)
+
+    caption_renderer = None
+    if captions_config is not None:
+        offsets = np.concatenate([[0], np.cumsum(counts)[:-1]]) / fps
+        caption_renderer = CaptionRenderer(captions_config, size)
+        caption_renderer.set_words(build_caption_track(scenes, durations, offsets, captions_config["word_timing"]))
+        caption_buffer = np.empty((size[1], size[0], 3), dtype=np.uint8)
+
+    # Runs of identical frames per scene, known up front so ffmpeg can be told how long each one is held
+    scene_run_lists = []
+    first_frame = 0
+    for i, (scene, frame_count) in enumerate(zip(scenes, counts)):
+        previous, following = neighbour_frames(scenes, durations, counts, i)
+        runs = scene_runs(scene, frame_count, *transition_frame_counts(scene, frame_count, previous, following, video_config), video_config)
+        if caption_renderer is not None:
+            runs = caption_runs(runs, caption_renderer, first_frame, fps)
+        scene_run_lists.append(runs)
+        first_frame += frame_count
+    scene_run_lists[-1] = end_runs(scene_run_lists[-1])
+    all_runs = [run for runs in scene_run_lists for run in runs]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        audio_list = os.path.join(tmp_dir, "audio.txt")
+        write_concat_list([scene["audio"] for scene in scenes], audio_list)
+
+        command = [
+            get_ffmpeg_exe(), "-y", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{size[0]}x{size[1]}", "-r", str(fps), "-i", "-",
+            "-f", "concat", "-safe", "0", "-i", audio_list,
+            "-map", "0:v", "-map", "1:a",
+            *hold_args(all_runs, fps),
+            *encoder_args(video_config["ffmpeg"]),
+            "-c:a", "aac", "-b:a", "192k",
+            "-movflags", "+faststart",
+            output_file,
+        ]
+        with tracing.span("video.encode", renderer="ffmpeg", frames=sum(counts), runs=len(all_runs)) as span:
+            process = subprocess.Popen(command, stdin=subprocess.PIPE)
+            caption_seconds = 0.0
+
+            def compose(frame, index):
+                nonlocal caption_seconds
+                caption_start = time.perf_counter()
+                frame = caption_renderer.composite(frame, (first_frame + index) / fps, caption_buffer)
+                caption_seconds += time.perf_counter() - caption_start
+                return frame
+
+            try:
+                first_frame = 0
+                for i, (scene, duration, frame_count) in enumerate(zip(scenes, durations, counts)):
+                    previous, following = neighbour_frames(scenes, durations, counts, i)
+                    lead_in, lead_out = scene_transition_frames(
+                        scene, duration, frame_count, previous, following, size, video_config
+                    )
+                    write_runs(
+                        process.stdin,
+                        scene_frames(scene, duration, frame_count, fps, size, video_config, lead_in, lead_out),
+                        scene_run_lists[i],
+                        compose if caption_renderer is not None else None,
+                    )
+                    first_frame += frame_count
+            finally:
+                process.stdin.close()
+                return_code = process.wait()
+                span.set(caption_seconds=caption_seconds)
+        if return_code != 0:
+            raise RuntimeError(f"ffmpeg exited with code {return_code} while rendering {output_file}")
+
+    print(f"Rendered {len(scenes)} scenes with ffmpeg to {output_file}")
+
+
+def render_scene_segment(scene, duration, frame_count, segment_file, size, video_config, captions_config=None, previous=None, following=None):
+    """Encode one scene (frames plus its own audio) into a standalone segment file.
+
+    previous and following are the neighbouring (scene, duration, frame_count)
+    tuples; each segment renders its own half of the transitions with them.
+    """
+    fps = video_config["fps"]
+    lead_in, lead_out = scene_transition_frames(scene, duration, frame_count, previous, following, size, video_config)
+    runs = scene_runs(scene, frame_count, *transition_frame_counts(scene, frame_count, previous, following, video_config), video_config)
+
+    if captions_config is not None:
+        caption_renderer = CaptionRenderer(captions_config, size)
+        caption_renderer.set_words(build_caption_track([scene], [duration], [0.0], captions_config["word_timing"]))
+        caption_buffer = np.empty((size[1], size[0], 3), dtype=np.uint8)
+        runs = caption_runs(runs, caption_renderer, 0, fps)
+
+        def compose(frame, index):
+            return caption_renderer.composite(frame, index / fps, caption_buffer)
+    else:
+        compose = None
+    runs = end_runs(runs)
+
+    tmp_file = f"{segment_file}.tmp.mp4"
+    command = [
+        get_ffmpeg_exe(), "-y", "-loglevel", "error",
+        "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{size[0]}x{size[1]}", "-r", str(fps), "-i", "-",
+        "-i", scene["audio"],
+        "-map", "0:v", "-map", "1:a",
+        *hold_args(runs, fps),
+        *encoder_args(video_config["ffmpeg"]),
+        "-c:a", "aac", "-b:a", "192k", "-ar", "44100", "-ac", "2",
+        tmp_file,
+    ]
+    process = subprocess.Popen(command, stdin=subprocess.PIPE)
+    try:
+        write_runs(
+            process.stdin,
+            scene_frames(scene, duration, frame_count, fps, size, video_config, lead_in, lead_out),
+            runs,
+            compose,
+        )
+    finally:
+        process.stdin.close()
+        return_code = process.wait()
+    if return_code != 0:
+        raise RuntimeError(f"ffmpeg exited with code {return_code} while rendering {segment_file}")
+    os.replace(tmp_file, segment_file)
+    return segment_file
+
+
+def segment_key(scene, duration, frame_count, size, video_config, captions_config=None, previous=None, following=None):
+    # Everything that affects the encoded segment, so unchanged scenes are reused
+    lead_in, lead_out = transition_frame_counts(scene, frame_count, previous, following, video_config)
+    transitions = []
+    if lead_in:
+        transitions.append((scene_transition(scene, video_config), hash_file(previous[0]["image"]), previous[0]["transition_type"], previous[1:], lead_in))
+    if lead_out:
+        transitions.append((scene_transition(following[0], video_config), hash_file(following[0]["image"]), following[0]["transition_type"], following[2], lead_out))
+    return hash_inputs(
+        hash_file(scene["image"]),
+        hash_file(scene["audio"]),
+        scene["transition_type"],
+        scene["subtitles"] if captions_config is not None else None,
+        captions_config,
+        duration,
+        frame_count,
+        size,
+        video_config["fps"],
+        video_config["zoom_upscale"],
+        video_config["ffmpeg"],
+        video_config["hold_static_frames"],
+        transitions,
+    )
+
+
+def segment_worker_count(video_config: Dict[str, Any]) -> int:
+    return video_config["segment_workers"] or os.cpu_count()
+
+
+def get_segment_dir(output_file: str) -> str:
+    segment_dir = os.path.join(os.path.dirname(os.path.abspath(output_file)), "segments")
+    os.makedirs(segment_dir, exist_ok=True)
+    return segment_dir
+
+
+def segment_frame_count(duration: float, fps: int) -> int:
+    # Each segment carries its own audio, so its frame count depends only on its own duration
+    return max(1, int(round(duration * fps)))
+
+
+def prepare_segment(scene, duration, size, segment_dir, video_config, captions_config=None, previous=None, following=None):
+    """Return the segment file for a scene and the render_scene_segment arguments, or None if it is up to date.
+
+    previous and following are the neighbouring (scene, duration) pairs, or
+    None at either end of the video.
+    """
+    fps = video_config["fps"]
+    frame_count = segment_frame_count(duration, fps)
+    previous = (*previous, segment_frame_count(previous[1], fps)) if previous else None
+    following = (*following, segment_frame_count(following[1], fps)) if following else None
+    key = segment_key(scene, duration, frame_count, size, video_config, captions_config, previous, following)
+    prefix = f"scene_{scene['scene_number']}_"
+    segment_file = os.path.join(segment_dir, f"{prefix}{key[:16]}.mp4")
+    if os.path.exists(segment_file):
+        return segment_file, None
+    # Drop segments rendered from this scene's previous inputs
+    for stale_file in glob.glob(os.path.join(segment_dir, f"{prefix}*.mp4")):
+        os.remove(stale_file)
+    return segment_file, (scene, duration, frame_count, segment_file, size, video_config, captions_config, previous, following)
+
+
+def render_with_segments(scenes: List[Dict[str, Any]], durations: List[float], output_file: str, video_config: Dict[str, Any], captions_config: Optional[Dict[str, Any]] = None) -> None:
+    """Render each scene to its own segment in a process pool, then concat without re-encoding.
+
+    Segments are kept next to the output file and named by a hash of their
+    inputs, so re-renders only encode the scenes that changed.
+    """
+    size = get_output_size(scenes[0]["image"])
+    segment_dir = get_segment_dir(output_file)
+
+    segment_files = []
+    pending = []
+    pairs = list(zip(scenes, durations))
+    for i, (scene, duration) in enumerate(pairs):
+        segment_file, render_args = prepare_segment(
+            scene, duration, size, segment_dir, video_config, captions_config,
+            pairs[i - 1] if i > 0 else None, pairs[i + 1] if i + 1 < len(pairs) else None,
+        )
+        segment_files.append(segment_file)
+        if render_args is not None:
+            pending.append(render_args)
+
+    print(f"Rendering {len(pending)} of {len(scenes)} scene segments ({len(scenes) - len(pending)} unchanged)")
+    if pending:
+        with ProcessPoolExecutor(max_workers=min(segment_worker_count(video_config), len(pending))) as executor:
+            futures = [executor.submit(tracing.timed_call, render_scene_segment, *args) for args in pending]
+            for args, future in zip(pending, futures):
+                record_segment_span(args, future.result())
+
+    concat_segments(segment_files, output_file)
+    print(f"Joined {len(segment_files)} scene segments into {output_file}")
+
+
+def record_segment_span(render_args, timed_result) -> None:
+    # Segments render in worker processes, so their spans are recorded from the returned timing
+    scene, duration, frame_count = render_args[:3]
+    _, start, seconds, pid = timed_result
+    tracing.record_span("video.segment", start, seconds, pid, scene=scene["scene_number"], frames=frame_count)
+
+
+def concat_segments(segment_files: List[str], output_file: str) -> None:
+    with tracing.span("video.concat", segments=len(segment_files)), tempfile.TemporaryDirectory() as tmp_dir:
+        segment_list = os.path.join(tmp_dir, "segments.txt")
+        write_concat_list(segment_files, segment_list)
+        subprocess.run(
+            [
+                get_ffmpeg_exe(), "-y", "-loglevel", "error",
+                "-f", "concat", "-safe", "0", "-i", segment_list,
+                "-c", "copy", "-movflags", "+faststart",
+                output_file,
+            ],
+            check=True,
+        )
@@ -0,0 +1,78 @@
+import os
+import atexit
+import tempfile
+import threading
+from typing import Any, Dict, Optional
+import httpx
+from utils import load_config
+import tracing
+
+_client: Optional[httpx.Client] = None
+_lock = threading.Lock()
+
+
+def _client_options(http_config: Dict[str, Any]) -> Dict[str, Any]:
+    timeout_config = http_config["timeout"]
+    return {
+        "timeout": httpx.Timeout(
+            connect=timeout_config["connect"],
+            read=timeout_config["read"],
+            write=timeout_config["write"],
+            pool=timeout_config["pool"],
+        ),
+        "limits": httpx.Limits(
+            max_connections=http_config["max_connections"],
+            max_keepalive_connections=http_config["max_keepalive_connections"],
+            keepalive_expiry=http_config["keepalive_expiry"],
+        ),
+        "follow_redirects": True,
+    }
+
+
+def get_http_client() -> httpx.Client:
+    """Return the process-wide pooled client; connections are kept alive across downloads."""
+    global _client
+    with _lock:
+        if _client is None:
+            _client = httpx.Client(**_client_options(load_config()["http"]))
+            atexit.register(_client.close)
+        return _client
+
+
+def _chunk_size() -> int:
+    return int(load_config()["http"]["chunk_size_kb"] * 1024)
+
+
+def _temp_file_for(output_file: str):
+    # Stream into a temp file next to the destination so a failed download never leaves a partial file
+    output_dir = os.path.dirname(os.path.abspath(output_file))
+    os.makedirs(output_dir, exist_ok=True)
+    return tempfile.mkstemp(dir=output_dir, suffix=".part")
+
+
+def download_bytes(url: str) -> bytes:
+    with tracing.span("http.download") as span:
+        response = get_http_client().get(url)
+        response.raise_for_status()
+        span.set(bytes=len(response.content))
+        return response.content
+
+
+def download_to_file(url: str, output_file: str) -> str:
+    """Stream url into output_file chunk by chunk and return output_file."""
+    fd, tmp_path = _temp_file_for(output_file)
+    with tracing.span("http.download", file=os.path.basename(output_file)) as span:
+        try:
+            with os.fdopen(fd, "wb") as f:
+                with get_http_client().stream("GET", url) as response:
+                    response.raise_for_status()
+                    for chunk in response.iter_bytes(_chunk_size()):
+                        f.write(chunk)
+                        span.add("bytes", len(chunk))
+            os.replace(tmp_path, output_file)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    return output_file
+
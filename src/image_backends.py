@@ -0,0 +1,222 @@
+import io
+import os
+import time
+import random
+import hashlib
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Type, Union
+from utils import load_config
+from cache import make_cache_key
+from rate_limiter import call_with_retries
+from http_client import download_to_file
+import tracing
+from api import (
+    fal_arguments,
+    fal_flux_api,
+    fal_image_urls,
+    fetch_image,
+    get_cached_image,
+    replicate_flux_api,
+    replicate_payload,
+)
+
+IMAGE_BACKENDS: Dict[str, Type["ImageBackend"]] = {}
+
+
+def register_backend(cls):
+    IMAGE_BACKENDS[cls.name] = cls
+    return cls
+
+
+def variant_file(output_file: str, index: int) -> str:
+    # Extra images from one request sit next to the first: scene_1.png, scene_1_2.png, ...
+    root, ext = os.path.splitext(output_file)
+    return f"{root}_{index + 1}{ext}"
+
+
+class ImageBackend(ABC):
+    """Common interface for image generation APIs.
+
+    Calling the backend generates one image, like the functions in api.py.
+    Backends that can take several prompts at once also provide
+    generate_batch(), which saves every image a request returns
+    (num_images > 1) as variant_file() siblings of the prompt's output file.
+    """
+
+    name = ""
+    provider = ""
+
+    def __init__(self, backend_config: Dict[str, Any]):
+        self.config = backend_config
+
+    @abstractmethod
+    def __call__(self, prompt: str, output_file: Optional[str] = None) -> Union[bytes, str, None]:
+        """Generate one image into output_file and return its path, or return the image bytes."""
+
+    def cache_key(self, prompt: str) -> str:
+        return make_cache_key(self.name, prompt, self.config)
+
+
+class BatchingImageBackend(ImageBackend):
+    """Backend whose provider queues requests, so generate_batch() submits every prompt before waiting on any."""
+
+    @abstractmethod
+    def submit(self, prompt: str) -> Any:
+        """Queue a request with the provider and return a handle for collect()."""
+
+    @abstractmethod
+    def collect(self, handle: Any) -> List[str]:
+        """Wait for a submitted request and return its image URLs."""
+
+    def _save(self, image_urls: List[str], cache_key: str, output_file: str) -> List[str]:
+        if not image_urls:
+            raise ValueError(f"No image URL returned from {self.name}")
+        files = [fetch_image(str(image_urls[0]), cache_key, output_file)]
+        for i, image_url in enumerate(image_urls[1:], 1):
+            files.append(download_to_file(str(image_url), variant_file(output_file, i)))
+        return files
+
+    def generate_batch(self, prompts: List[str], output_files: List[str]) -> List[Optional[List[str]]]:
+        """Generate one or more images per prompt; returns the saved files per prompt, or None."""
+        results: List[Optional[List[str]]] = [None] * len(prompts)
+        pending = []
+        for i, (prompt, output_file) in enumerate(zip(prompts, output_files)):
+            cache_key = self.cache_key(prompt)
+            if get_cached_image(cache_key, output_file) is not None:
+                results[i] = [output_file]
+                continue
+            try:
+                with tracing.span("image.submit", backend=self.name):
+                    pending.append((i, cache_key, call_with_retries(self.provider, self.submit, prompt)))
+            except Exception as e:
+                print(f"Error submitting {self.name} request: {e}")
+
+        for i, cache_key, handle in pending:
+            try:
+                with tracing.span("image.request", backend=self.name):
+                    image_urls = self.collect(handle)
+                results[i] = self._save(image_urls, cache_key, output_files[i])
+            except Exception as e:
+                # Retry just this prompt through the single-image path and its retry policy
+                print(f"Error in {self.name} batch request, retrying it alone: {e}")
+                if self(prompts[i], output_file=output_files[i]):
+                    results[i] = [output_files[i]]
+        return results
+
+
+@register_backend
+class ReplicateBackend(BatchingImageBackend):
+    name = "replicate_flux_api"
+    provider = "replicate"
+
+    def __call__(self, prompt, output_file=None):
+        return replicate_flux_api(prompt, output_file=output_file)
+
+    def submit(self, prompt):
+        import replicate
+
+        return replicate.models.predictions.create(
+            model=self.config["model"], input=replicate_payload(prompt, self.config)
+        )
+
+    def collect(self, handle):
+        handle.wait()
+        if handle.status != "succeeded":
+            raise RuntimeError(f"Prediction {handle.id} {handle.status}: {handle.error}")
+        output = handle.output
+        return output if isinstance(output, list) else [output]
+
+
+@register_backend
+class FalBackend(BatchingImageBackend):
+    name = "fal_flux_api"
+    provider = "fal"
+
+    def __call__(self, prompt, output_file=None):
+        return fal_flux_api(prompt, output_file=output_file)
+
+    def submit(self, prompt):
+        import fal_client
+
+        return fal_client.submit(self.config["model"], arguments=fal_arguments(prompt, self.config))
+
+    def collect(self, handle):
+        return fal_image_urls(handle.get())
+
+
+@register_backend
+class LocalStubBackend(ImageBackend):
+    """Deterministic placeholder images with simulated latency, for offline load tests.
+
+    The same prompt always gives the same image and the same latency. A batch
+    costs one request's latency, like a provider serving a batch in parallel.
+    """
+
+    name = "local_stub"
+
+    def _latency(self, prompt: str) -> float:
+        jitter = random.Random(prompt).uniform(-1, 1) * self.config["latency_jitter_seconds"]
+        return max(0.0, self.config["latency_seconds"] + jitter)
+
+    def _image(self, prompt: str, index: int = 0):
+        import numpy as np
+        from PIL import Image, ImageDraw
+
+        seed = int.from_bytes(hashlib.sha256(f"{prompt}\0{index}".encode("utf-8")).digest()[:8], "big")
+        rng = np.random.default_rng(seed)
+        width, height = self.config["width"], self.config["height"]
+        # Gradient plus noise, so encoding cost is close to a real scene image
+        top, bottom = rng.integers(0, 256, (2, 3))
+        gradient = np.linspace(top, bottom, height, dtype=np.float32)[:, None, :]
+        noise = rng.normal(0, 12, (height, width, 3)).astype(np.float32)
+        image = Image.fromarray(np.clip(gradient + noise, 0, 255).astype(np.uint8))
+        lines = [prompt[i:i + 40] for i in range(0, min(len(prompt), 200), 40)]
+        ImageDraw.Draw(image).multiline_text((20, 20), "\n".join(lines), fill="white")
+        return image
+
+    def __call__(self, prompt, output_file=None):
+        with tracing.span("image.request", backend=self.name):
+            time.sleep(self._latency(prompt))
+            image = self._image(prompt)
+        with tracing.span("image.write") as span:
+            if output_file is None:
+                buffer = io.BytesIO()
+                image.save(buffer, "PNG")
+                span.set(bytes=buffer.tell())
+                return buffer.getvalue()
+            image.save(output_file, "PNG")
+            span.set(bytes=os.path.getsize(output_file))
+        return output_file
+
+    def generate_batch(self, prompts, output_files):
+        with tracing.span("image.request", backend=self.name, prompts=len(prompts)):
+            time.sleep(max((self._latency(prompt) for prompt in prompts), default=0.0))
+        results = []
+        for prompt, output_file in zip(prompts, output_files):
+            files = []
+            for i in range(self.config["num_images"]):
+                image_file = output_file if i == 0 else variant_file(output_file, i)
+                with tracing.span("image.write") as span:
+                    self._image(prompt, i).save(image_file, "PNG")
+                    span.set(bytes=os.path.getsize(image_file))
+                files.append(image_file)
+            results.append(files)
+        return results
+
+
+_backends: Dict[str, ImageBackend] = {}
+
+
+def get_image_backend(name: Optional[str] = None) -> ImageBackend:
+    """Return the backend registered as name, or the one selected by image_generation.backend."""
+    config = load_config()
+    if name is None:
+        name = config["image_generation"]["backend"]
+    if name not in IMAGE_BACKENDS:
+        raise ValueError(f"Unknown image backend {name!r}, expected one of {', '.join(IMAGE_BACKENDS)}")
+    backend = _backends.get(name)
+    # A config reload or per-job override gives the backend a fresh config block
+    if backend is None or backend.config is not config[name]:
+        backend = IMAGE_BACKENDS[name](config[name])
+        _backends[name] = backend
+    return backend
@@ -1,17 +1,17 @@
 import os
 import re
 import time
-import requests
-import replicate
-from typing import Optional, Dict, Any, List, Callable
-from utils import create_blank_image
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, List, Callable, Tuple
+from utils import create_blank_image, load_config
+from concurrency import stage_slot, submit_in_context
+import tracing
 
-def generate_image(
+def build_prompt(
     storyboard: Dict[str, Any],
     characters: List[Dict[str, Any]],
-    style: str,
-    image_generator_func: Callable[[str], Optional[bytes]]
-) -> Optional[bytes]:
+    style: str
+) -> str:
     # Construct the prompt
     prompt = storyboard['description']
     
@@ -43,42 +43,110 @@ def generate_image(
         enhanced_prompt += " | " + " | ".join(character_descriptions)
     
     # Remove all bracketed content
-    enhanced_prompt = re.sub(r'\{\{.*?\}\}', '', enhanced_prompt)
-    
+    return re.sub(r'\{\{.*?\}\}', '', enhanced_prompt)
+
+
+def generate_image(
+    storyboard: Dict[str, Any],
+    characters: List[Dict[str, Any]],
+    style: str,
+    image_generator_func: Callable[..., Any],
+    output_file: Optional[str] = None
+) -> Any:
+    enhanced_prompt = build_prompt(storyboard, characters, style)
+    if output_file is not None:
+        # Let the backend stream the download straight into the scene file
+        return image_generator_func(enhanced_prompt, output_file=output_file)
     return image_generator_func(enhanced_prompt)
 
 
+def _generate_scene_image(
+    storyboard: Dict[str, Any],
+    characters: List[Dict[str, Any]],
+    style: str,
+    image_generator_func: Callable[..., Any],
+    output_file: str
+) -> Tuple[bool, float]:
+    start_time = time.time()
+    try:
+        with tracing.span("image.scene", scene=storyboard['scene_number']), stage_slot("image"):
+            saved = bool(generate_image(storyboard, characters, style, image_generator_func, output_file))
+    except Exception as e:
+        print(f"Error generating image for scene {storyboard['scene_number']}: {e}")
+        saved = False
+    return saved, time.time() - start_time
+
+
+def _generate_scene_batch(
+    storyboards: List[Dict[str, Any]],
+    characters: List[Dict[str, Any]],
+    style: str,
+    image_backend: Any,
+    output_files: List[str]
+) -> List[Tuple[bool, float]]:
+    start_time = time.time()
+    prompts = [build_prompt(storyboard, characters, style) for storyboard in storyboards]
+    scene_numbers = [storyboard['scene_number'] for storyboard in storyboards]
+    try:
+        with tracing.span("image.batch", scenes=scene_numbers), stage_slot("image"):
+            saved = [bool(files) for files in image_backend.generate_batch(prompts, output_files)]
+    except Exception as e:
+        print(f"Error generating images for scenes {', '.join(map(str, scene_numbers))}: {e}")
+        saved = [False] * len(storyboards)
+    batch_time = time.time() - start_time
+    return [(scene_saved, batch_time) for scene_saved in saved]
+
+
 def generate_and_download_images(
     storyboard_project: Dict[str, Any],
     story_dir: str,
     image_style: str,
-    image_generator_func: Callable[[str], Optional[bytes]]
+    image_generator_func: Callable[..., Any],
+    max_workers: Optional[int] = None
 ) -> List[str]:
-    start_time = time.time()  # 记录开始时间
-    
+    start_time = time.time()
+
+    config = load_config()
+    if max_workers is None:
+        max_workers = config['image_generation']['max_workers']
+    max_workers = max(1, max_workers)
+    batch_size = max(1, config['image_generation']['batch_size'])
+
     image_files = []
     characters = storyboard_project['characters']
-    
-    for i, storyboard in enumerate(storyboard_project['storyboards']):
-        image_content = generate_image(storyboard, characters, image_style, image_generator_func)
-        if image_content:
+    storyboards = storyboard_project['storyboards']
+    output_files = [os.path.join(story_dir, f"scene_{storyboard['scene_number']}.png") for storyboard in storyboards]
+
+    # Submit every scene prompt at once, at most max_workers requests in flight
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        if batch_size > 1 and hasattr(image_generator_func, 'generate_batch'):
+            # Batching backends and the local stub take several prompts per call
+            futures = [
+                submit_in_context(
+                    executor, _generate_scene_batch, storyboards[i:i + batch_size], characters, image_style,
+                    image_generator_func, output_files[i:i + batch_size],
+                )
+                for i in range(0, len(storyboards), batch_size)
+            ]
+            results = [result for future in futures for result in future.result()]
+        else:
+            futures = [
+                submit_in_context(
+                    executor, _generate_scene_image, storyboard, characters, image_style, image_generator_func,
+                    output_file,
+                )
+                for storyboard, output_file in zip(storyboards, output_files)
+            ]
+            results = [future.result() for future in futures]
+
+    # Resolve results in scene order so fallbacks can use the previous scene's image
+    for i, (storyboard, (saved, scene_time)) in enumerate(zip(storyboards, results)):
+        print(f"Scene {storyboard['scene_number']} image generation time: {scene_time:.2f} seconds")
+        if saved:
             image_filename = os.path.join(story_dir, f"scene_{storyboard['scene_number']}.png")
             storyboard['image'] = image_filename
-            try:
-                with open(image_filename, 'wb') as f:
-                    f.write(image_content)
-                image_files.append(image_filename)
-                print(f"Image saved for scene {storyboard['scene_number']}")
-            except IOError as e:
-                print(f"Failed to save image for scene {storyboard['scene_number']}: {e}")
-                if i > 0:
-                    storyboard['image'] = image_files[-1]  # Use the previous image
-                    image_files.append(image_files[-1])
-                else:
-                    # For the first image, create a blank image
-                    create_blank_image(image_filename)
-                    storyboard['image'] = image_filename
-                    image_files.append(image_filename)
+            image_files.append(image_filename)
+            print(f"Image saved for scene {storyboard['scene_number']}")
         else:
             print(f"Failed to generate image for scene {storyboard['scene_number']}")
             if i > 0:
@@ -90,10 +158,8 @@ def generate_and_download_images(
                 create_blank_image(image_filename)
                 storyboard['image'] = image_filename
                 image_files.append(image_filename)
-    
-    end_time = time.time()  
-    execution_time = end_time - start_time  
-    print(f"generate_and_download_images execution time: {execution_time:.2f} seconds")  
-    
-    return image_files
 
+    total_time = time.time() - start_time
+    print(f"Generated {len(storyboards)} scene images with {max_workers} workers in {total_time:.2f} seconds (wall clock)")
+
+    return image_files
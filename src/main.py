@@ -1,27 +1,36 @@
 import os
 import re
+import sys
 import json
+import time
+import argparse
+import subprocess
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from openai import OpenAI
 from utils import pick_voice_name
 from story_generator import (
     generate_story_and_title,
     generate_general_storyboard,
     generate_life_pro_tips_storyboard,
     generate_characters,
+    extract_character_names,
     generate_philosophy_storyboard,
     generate_fun_facts_storyboard,
 )
-from image_generator import generate_and_download_images
-from video_creator import create_video
 from utils import (
     create_resource_dir,
     pick_story_type,
     pick_image_style,
     load_config,
 )
-from api import replicate_flux_api, fal_flux_api
-from video_creator import add_subtitles
+from manifest import Manifest, hash_inputs, hash_file
+from cache import cache_stats
+from concurrency import stage_slot, submit_in_context
+import tracing
+
+# Stage modules (moviepy, cv2, the image SDKs, Whisper via shortcap) are imported
+# inside run_pipeline by the stage that needs them, which keeps startup fast.
 
 # Get the directory of the current script
 script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -30,111 +39,523 @@ dotenv_path = os.path.join(os.path.dirname(script_dir), ".env")
 # Load the .env file
 load_dotenv(dotenv_path)
 
+# Fail fast on a bad config.json, before any paid API call
 config = load_config()
-# Initialize the OpenAI client
-client = OpenAI(
-    api_key=os.getenv("OPENAI_API_KEY"),
-    base_url=os.getenv("OPENAI_BASE_URL"),
-)
+client = None
 
 
-def main():
-    # 1. pick story type, image style and voice name
-    story_type = pick_story_type()
-    image_style = pick_image_style()
-    voice_name = pick_voice_name()
+def get_openai_client():
+    """Create the OpenAI client on first use."""
+    global client
+    if client is None:
+        from openai import OpenAI
 
-    # 2. generate story and title
-    title, description, story = generate_story_and_title(client, story_type)
-    if story is None or title is None:
-        print("Failed to generate a story and title. Please try again later.")
-        return
+        # Retries are left to rate_limiter, which shares backoff across all workers
+        client = OpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            base_url=os.getenv("OPENAI_BASE_URL"),
+            max_retries=0,
+        )
+    return client
 
-    story_dir = create_resource_dir(script_dir, story_type, title)
 
-    # 3. generate characters
-    characters = []
-    if story_type.lower() != "life pro tips" and story_type.lower() != "fun facts":
-        print("\nGenerating character descriptions...")
-        characters = generate_characters(client, story)
-        if characters is None:
-            print("Failed to generate characters. Please try again later.")
-            return
-        print("characters: ", characters)
+def read_story(story_file):
+    with open(story_file, "r", encoding="utf-8") as f:
+        title, description, story = f.read().split("\n\n", 2)
+    return title, description, story
 
-    character_names = (
-        [character["name"] for character in characters] if characters else []
-    )
 
-    # 4. generate storyboard
-    print("\nGenerating storyboard...")
-    if story_type.lower() == "life pro tips":
-        storyboard_project = generate_life_pro_tips_storyboard(
-            client, title, story)
-    elif story_type.lower() == "philosophy":
-        storyboard_project = generate_philosophy_storyboard(
-            client, title, story, character_names
-        )
-    elif story_type.lower() == "fun facts":
-        storyboard_project = generate_fun_facts_storyboard(
-            client, title, story)
-    else:
-        storyboard_project = generate_general_storyboard(
-            client, title, story, character_names
+@contextmanager
+def timed_stage(timings, name):
+    """Time one pipeline stage into timings and trace it as a stage.<name> span."""
+    stage_start = time.time()
+    with tracing.span(f"stage.{name}") as stage:
+        try:
+            yield stage
+        finally:
+            timings[name] = time.time() - stage_start
+
+
+def run_pipeline(story_type, image_style, voice_name, story_dir=None, topic=None, client=None):
+    """Run every stage for one video, skipping stages already completed in story_dir.
+
+    Returns a dict with the story directory, output video paths and per-stage
+    timings in seconds, or None if a stage failed. client defaults to the
+    shared OpenAI client. With tracing enabled, the run's spans are appended
+    to trace.jsonl in the story directory.
+    """
+    tracing_config = load_config()["tracing"]
+    if not tracing_config["enabled"]:
+        return run_stages(story_type, image_style, voice_name, story_dir, topic, client)
+
+    trace = tracing.Trace("pipeline")
+    try:
+        with tracing.start_trace(
+            trace, story_type=story_type, image_style=image_style, voice_name=voice_name, topic=topic
+        ):
+            outputs = run_stages(story_type, image_style, voice_name, story_dir, topic, client)
+            trace.root.set(status="completed" if outputs else "failed")
+    finally:
+        # Failed runs are written too; they are the ones worth reading
+        trace_dir = trace.root.attributes.get("story_dir")
+        if trace_dir:
+            trace.write_jsonl(os.path.join(trace_dir, "trace.jsonl"))
+            if tracing_config["chrome_trace"]:
+                trace.write_chrome_trace(os.path.join(trace_dir, "trace.json"))
+        if tracing_config["print_summary"]:
+            trace.print_summary()
+    if outputs:
+        outputs["trace_id"] = trace.trace_id
+    return outputs
+
+
+def report_cache_stats():
+    """Print the image and speech cache counters and record them on the trace."""
+    stats = cache_stats()
+    for name, cache in stats.items():
+        print(
+            f"{name} cache: {cache['hits']} hits / {cache['misses']} misses in this process "
+            f"({cache['hit_rate']:.0%}), {cache['evictions']} evicted, {cache['entries']} entries, "
+            f"{cache['size_bytes'] / 1024 / 1024:.1f} of {cache['max_size_bytes'] / 1024 / 1024:.0f} MB"
         )
+    tracing.annotate_trace(caches=stats)
 
-    if len(storyboard_project.get("storyboards")) == 0:
-        print("Failed to generate storyboard. Please try again later.")
-        return
 
-    # Remove scenes with empty subtitles
-    storyboard_project["storyboards"] = [
-        scene
-        for scene in storyboard_project["storyboards"]
-        if scene["subtitles"].strip()
-    ]
+def run_stages(story_type, image_style, voice_name, story_dir=None, topic=None, client=None):
+    config = load_config()
+    client = client or get_openai_client()
+    manifest = Manifest(story_dir) if story_dir else None
+    timings = {}
+
+    # 2. generate story and title
+    with timed_stage(timings, "story") as stage:
+        story_inputs = hash_inputs(story_type, topic, config["story_generation"], config["openai"])
+        if manifest and manifest.is_fresh("story", story_inputs):
+            print("\nReusing story from previous run")
+            stage.set(reused=True)
+            title, description, story = read_story(os.path.join(story_dir, "story_english.txt"))
+        else:
+            title, description, story = generate_story_and_title(client, story_type, topic)
+            if story is None or title is None:
+                print("Failed to generate a story and title. Please try again later.")
+                return None
+
+            if story_dir is None:
+                story_dir = create_resource_dir(script_dir, story_type, title)
+                manifest = Manifest(story_dir)
+
+            # save the story to a file
+            story_file = os.path.join(story_dir, "story_english.txt")
+            with open(story_file, "w", encoding="utf-8") as f:
+                f.write(f"{title}\n\n{description}\n\n{story}")
+            manifest.record("story", story_inputs, [story_file])
+
+        tracing.annotate_trace(story_dir=story_dir, title=title)
+        manifest.set_params(story_type=story_type, image_style=image_style, voice_name=voice_name, topic=topic)
+
+    # 3. extract character names; they are all the storyboard needs from the characters
+    needs_characters = story_type.lower() != "life pro tips" and story_type.lower() != "fun facts"
+    character_names = []
+    if needs_characters:
+        with timed_stage(timings, "character_names") as stage:
+            names_inputs = hash_inputs(story, config["openai"])
+            if manifest.is_fresh("character_names", names_inputs):
+                print("\nReusing character names from previous run")
+                stage.set(reused=True)
+                character_names = manifest.get("character_names")["data"]["names"]
+            else:
+                print("\nExtracting character names...")
+                character_names = extract_character_names(client, story)
+                if character_names is None:
+                    print("Failed to extract character names. Please try again later.")
+                    return None
+                manifest.record("character_names", names_inputs, [], names=character_names)
+
+    # 3a. generate character descriptions
+    def characters_stage():
+        with timed_stage(timings, "characters") as stage:
+            if not needs_characters:
+                return []
+            characters_file = os.path.join(story_dir, "characters.json")
+            characters_inputs = hash_inputs(story, character_names, config["openai"])
+            if manifest.is_fresh("characters", characters_inputs):
+                print("\nReusing character descriptions from previous run")
+                stage.set(reused=True)
+                with open(characters_file, "r", encoding="utf-8") as f:
+                    characters = json.load(f)
+            else:
+                print("\nGenerating character descriptions...")
+                characters = generate_characters(client, story, character_names)
+                if characters is None:
+                    print("Failed to generate characters. Please try again later.")
+                    return None
+                with open(characters_file, "w", encoding="utf-8") as f:
+                    json.dump(characters, f, ensure_ascii=False, indent=4)
+                manifest.record("characters", characters_inputs, [characters_file])
+            print("characters: ", characters)
+            return characters
+
+    # 3b. generate storyboard
+    storyboard_file = os.path.join(story_dir, "storyboard_project.json")
+
+    def storyboard_stage():
+        with timed_stage(timings, "storyboard") as stage:
+            storyboard_inputs = hash_inputs(
+                title, story, story_type, character_names, config["storyboard"], config["openai"]
+            )
+            if manifest.is_fresh("storyboard", storyboard_inputs):
+                print("\nReusing storyboard from previous run")
+                stage.set(reused=True)
+                with open(storyboard_file, "r", encoding="utf-8") as f:
+                    storyboard_project = json.load(f)
+                stage.set(scenes=len(storyboard_project["storyboards"]))
+                return storyboard_project
+
+            print("\nGenerating storyboard...")
+            if story_type.lower() == "life pro tips":
+                storyboard_project = generate_life_pro_tips_storyboard(
+                    client, title, story)
+            elif story_type.lower() == "philosophy":
+                storyboard_project = generate_philosophy_storyboard(
+                    client, title, story, character_names
+                )
+            elif story_type.lower() == "fun facts":
+                storyboard_project = generate_fun_facts_storyboard(
+                    client, title, story)
+            else:
+                storyboard_project = generate_general_storyboard(
+                    client, title, story, character_names
+                )
+
+            if len(storyboard_project.get("storyboards")) == 0:
+                print("Failed to generate storyboard. Please try again later.")
+                return None
+
+            # Remove scenes with empty subtitles
+            storyboard_project["storyboards"] = [
+                scene
+                for scene in storyboard_project["storyboards"]
+                if scene["subtitles"].strip()
+            ]
+
+            with open(storyboard_file, "w", encoding="utf-8") as f:
+                json.dump(storyboard_project, f, ensure_ascii=False, indent=4)
+            manifest.record("storyboard", storyboard_inputs, [storyboard_file])
+            stage.set(scenes=len(storyboard_project["storyboards"]))
+            return storyboard_project
+
+    # Both calls only need the story and the character names, so they run side by side
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        characters_future = submit_in_context(executor, characters_stage)
+        storyboard_future = submit_in_context(executor, storyboard_stage)
+        characters = characters_future.result()
+        storyboard_project = storyboard_future.result()
+    if characters is None or storyboard_project is None:
+        return None
 
     storyboard_project["characters"] = characters
+    storyboards = storyboard_project["storyboards"]
+
+    audio_dir = os.path.join(story_dir, "audio")
+    os.makedirs(audio_dir, exist_ok=True)
+    for storyboard in storyboards:
+        storyboard['audio'] = os.path.join(audio_dir, f"scene_{storyboard['scene_number']}.mp3")
+
+    video_path = os.path.join(story_dir, "story_video.mp4")
+    subtitle_video_path = video_path.replace(".mp4", "_subtitle.mp4")
+    native_captions = config["captions"]["engine"] == "native"
 
-    # 5. save the story and storyboard to files
-    with open(
-        os.path.join(script_dir, story_dir, "story_english.txt"), "w", encoding="utf-8"
-    ) as f:
-        f.write(f"{title}\n\n{description}\n\n{story}")
-
-    # 6. generate images
-    print("\nGenerating images for each scene...")
-    image_files = generate_and_download_images(
-        storyboard_project,
-        story_dir,
+    image_backend = config["image_generation"]["backend"]
+    images_inputs = hash_inputs(
+        [scene["description"] for scene in storyboards],
+        characters,
         image_style,
-        replicate_flux_api,
+        image_backend,
+        config[image_backend],
+    )
+    audio_inputs = hash_inputs(
+        [scene["subtitles"] for scene in storyboards], voice_name, config["tts"]
+    )
+
+    # 5-6. with streaming enabled, every scene moves through image, audio and segment render on its own
+    streamed = config["pipeline"]["streaming"] and not (
+        manifest.is_fresh("images", images_inputs) and manifest.is_fresh("audio", audio_inputs)
     )
+    if streamed:
+        from image_backends import get_image_backend
+        from pipeline import run_streaming_pipeline
+
+        with timed_stage(timings, "scenes"):
+            print("\nStreaming scenes through image, audio and render stages...")
+            image_files, durations = run_streaming_pipeline(
+                client,
+                storyboard_project,
+                story_dir,
+                image_style,
+                get_image_backend(image_backend),
+                voice_name,
+                subtitle_video_path if native_captions else video_path,
+                config["captions"] if native_captions else None,
+            )
+            manifest.record(
+                "images",
+                images_inputs,
+                image_files,
+                image_files=[os.path.relpath(path, story_dir) for path in image_files],
+            )
+            manifest.record(
+                "audio",
+                audio_inputs,
+                [scene["audio"] for scene, duration in zip(storyboards, durations) if duration is not None],
+                durations=durations,
+            )
+
+    # 5. generate images
+    if not streamed:
+        with timed_stage(timings, "images") as stage:
+            if manifest.is_fresh("images", images_inputs):
+                print("\nReusing scene images from previous run")
+                stage.set(reused=True)
+                image_files = [manifest.resolve(path) for path in manifest.get("images")["data"]["image_files"]]
+            else:
+                from image_backends import get_image_backend
+                from image_generator import generate_and_download_images
 
-    # Update storyboard_project with image and audio paths
-    for i, storyboard in enumerate(storyboard_project['storyboards']):
+                print("\nGenerating images for each scene...")
+                image_files = generate_and_download_images(
+                    storyboard_project,
+                    story_dir,
+                    image_style,
+                    get_image_backend(image_backend),
+                )
+                manifest.record(
+                    "images",
+                    images_inputs,
+                    image_files,
+                    image_files=[os.path.relpath(path, story_dir) for path in image_files],
+                )
+
+    # Update storyboard_project with image paths
+    for i, storyboard in enumerate(storyboards):
         storyboard['image'] = image_files[i] if i < len(image_files) else None
-        storyboard['audio'] = os.path.join(story_dir, "audio", f"scene_{storyboard['scene_number']}.mp3")
+
+    # 6. generate audio
+    if not streamed:
+        with timed_stage(timings, "audio") as stage:
+            if manifest.is_fresh("audio", audio_inputs):
+                print("\nReusing scene audio from previous run")
+                stage.set(reused=True)
+                durations = manifest.get("audio")["data"]["durations"]
+            else:
+                from audio_generator import generate_scene_audio
+
+                print("\nGenerating audio for each scene...")
+                durations = generate_scene_audio(client, storyboards, voice_name)
+                manifest.record(
+                    "audio",
+                    audio_inputs,
+                    [scene["audio"] for scene, duration in zip(storyboards, durations) if duration is not None],
+                    durations=durations,
+                )
 
     # Save the storyboard_project to a json file
     print("\nSaving storyboard project...")
-    with open(
-        os.path.join(script_dir, story_dir, "storyboard_project.json"),
-        "w",
-        encoding="utf-8",
-    ) as f:
+    with open(storyboard_file, "w", encoding="utf-8") as f:
         json.dump(storyboard_project, f, ensure_ascii=False, indent=4)
 
-    # 7. create video
-    if image_files:
-        print("\nCreating video from images...")
-        audio_dir = os.path.join(story_dir, "audio")
-        os.makedirs(audio_dir, exist_ok=True)
-        video_path = os.path.join(story_dir, "story_video.mp4")
-        create_video(client, storyboard_project, video_path, audio_dir, voice_name)
-        print(f"Video created: {video_path}")
-    else:
+    # 7. align subtitle words to the scene audio
+    voiced = [(scene, duration) for scene, duration in zip(storyboards, durations) if duration is not None]
+    with timed_stage(timings, "word_timings") as stage:
+        timing_inputs = hash_inputs(
+            [scene["subtitles"] for scene, _ in voiced],
+            [hash_file(scene["audio"]) for scene, _ in voiced],
+            config["captions"]["word_timing"],
+        )
+        if manifest.is_fresh("word_timings", timing_inputs):
+            print("\nReusing word timings from previous run")
+            stage.set(reused=True)
+        else:
+            from word_timing import write_timing_files
+
+            print("\nAligning subtitle words to audio...")
+            timing_files = write_timing_files(
+                [scene for scene, _ in voiced],
+                [duration for _, duration in voiced],
+                story_dir,
+                config["captions"]["word_timing"],
+            )
+            manifest.record("word_timings", timing_inputs, list(timing_files.values()))
+
+    if not image_files:
         print("No images were generated. Cannot create video.")
+        return None
+
+    # 8. create video
+    video_inputs = hash_inputs(
+        [hash_file(path) for path in image_files],
+        [hash_file(scene["audio"]) for scene, duration in zip(storyboards, durations) if duration is not None],
+        [scene["transition_type"] for scene in storyboards],
+        [scene.get("scene_transition") for scene in storyboards],
+        durations,
+        config["video"],
+        [scene["subtitles"] for scene in storyboards] if native_captions else None,
+        config["captions"] if native_captions else None,
+    )
+    if streamed:
+        manifest.record("video", video_inputs, [subtitle_video_path if native_captions else video_path])
+    else:
+        with timed_stage(timings, "video") as stage:
+            if manifest.is_fresh("video", video_inputs):
+                print("\nReusing rendered video from previous run")
+                stage.set(reused=True)
+            else:
+                from video_creator import create_video
+
+                print("\nCreating video from images...")
+                # The native caption engine burns captions in during this same encode
+                with stage_slot("render"):
+                    create_video(
+                        client, storyboard_project, video_path, audio_dir, voice_name,
+                        durations=durations, subtitles=native_captions,
+                    )
+                manifest.record("video", video_inputs, [subtitle_video_path if native_captions else video_path])
+    if native_captions:
+        video_path = None
+    else:
+        print(f"Video created: {video_path}")
+
+    # 9. add subtitles
+    if not native_captions:
+        with timed_stage(timings, "subtitles") as stage:
+            subtitles_inputs = hash_inputs(hash_file(video_path), config["captions"])
+            if manifest.is_fresh("subtitles", subtitles_inputs):
+                print("\nReusing subtitled video from previous run")
+                stage.set(reused=True)
+            else:
+                from video_creator import add_subtitles
+
+                print("\nAdding subtitles...")
+                with stage_slot("render"):
+                    add_subtitles(video_path, subtitle_video_path)
+                manifest.record("subtitles", subtitles_inputs, [subtitle_video_path])
+    print(f"Subtitled video created: {subtitle_video_path}")
+    report_cache_stats()
+
+    return {
+        "story_dir": story_dir,
+        "title": title,
+        "video": video_path,
+        "subtitled_video": subtitle_video_path,
+        "timings": timings,
+    }
+
+
+# Modules each stage imports when it first runs, in pipeline order
+STAGE_IMPORTS = [
+    ("startup", ["main"]),
+    ("openai client", ["openai"]),
+    ("images", ["image_generator", "image_backends"]),
+    ("audio", ["audio_generator"]),
+    ("word timings", ["word_timing"]),
+    ("video", ["video_creator"]),
+    ("shortcap subtitles", ["shortcap"]),
+]
+
+# SDKs the image backends import on first call; local_stub needs none
+IMAGE_BACKEND_MODULES = {"replicate_flux_api": "replicate", "fal_flux_api": "fal_client"}
+
+
+def print_import_profile(top=15):
+    """Report import time per pipeline stage and the slowest packages at startup.
+
+    Each measurement runs in a fresh interpreter, so modules cached by this
+    process do not hide their cost.
+    """
+    stages = [(name, list(modules)) for name, modules in STAGE_IMPORTS]
+    backend_module = IMAGE_BACKEND_MODULES.get(config["image_generation"]["backend"])
+    if backend_module:
+        stages[2][1].append(backend_module)
+    script = (
+        "import json, time, importlib\n"
+        f"stages = {stages!r}\n"
+        "results = []\n"
+        "for name, modules in stages:\n"
+        "    start = time.perf_counter()\n"
+        "    try:\n"
+        "        for module in modules:\n"
+        "            importlib.import_module(module)\n"
+        "        error = None\n"
+        "    except ImportError as e:\n"
+        "        error = str(e)\n"
+        "    results.append([name, time.perf_counter() - start, error])\n"
+        "print(json.dumps(results))\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script], cwd=script_dir, capture_output=True, text=True, check=True
+    )
+    print("Import time by stage (each stage counts only modules not already loaded):")
+    for name, seconds, error in json.loads(result.stdout.strip().splitlines()[-1]):
+        note = f"  (not installed: {error})" if error else ""
+        print(f"  {name:<20} {seconds * 1000:8.1f} ms{note}")
+
+    # Attribute -X importtime self times to top-level packages
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=script_dir, capture_output=True, text=True, check=True,
+    )
+    package_times = {}
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+\d+ \|\s*(\S+)", line)
+        if match:
+            package = match.group(2).split(".")[0]
+            package_times[package] = package_times.get(package, 0) + int(match.group(1))
+    print("\nSlowest packages imported at startup (import main):")
+    for package, microseconds in sorted(package_times.items(), key=lambda item: -item[1])[:top]:
+        print(f"  {package:<20} {microseconds / 1000:8.1f} ms")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a faceless video from an AI-written story.")
+    parser.add_argument(
+        "--resume",
+        metavar="STORY_DIR",
+        help="resume a previous run, skipping every stage whose inputs are unchanged",
+    )
+    parser.add_argument(
+        "--import-profile",
+        action="store_true",
+        help="report where import time goes at startup and in each stage, then exit",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.import_profile:
+        print_import_profile()
+        return
+
+    if args.resume:
+        story_dir = os.path.abspath(args.resume)
+        manifest = Manifest(story_dir)
+        if not manifest.params:
+            print(f"No pipeline manifest found in {story_dir}. Cannot resume.")
+            return
+        story_type = manifest.params["story_type"]
+        image_style = manifest.params["image_style"]
+        voice_name = manifest.params["voice_name"]
+        topic = manifest.params.get("topic")
+        print(f"Resuming {story_type} story in {story_dir}")
+        run_pipeline(story_type, image_style, voice_name, story_dir, topic)
+        return
+
+    # 1. pick story type, image style and voice name
+    story_type = pick_story_type()
+    image_style = pick_image_style()
+    voice_name = pick_voice_name()
+
+    run_pipeline(story_type, image_style, voice_name)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
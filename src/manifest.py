@@ -0,0 +1,82 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from cache import make_cache_key
+
+MANIFEST_FILE = "manifest.json"
+
+
+def hash_inputs(*parts: Any) -> str:
+    return make_cache_key(*parts)
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """Per-story record of completed pipeline stages.
+
+    Each stage entry holds the hash of the inputs it was produced from and the
+    output files it wrote (relative to story_dir). A stage is fresh, and can be
+    skipped on resume, when its inputs hash matches and all outputs still exist.
+    """
+
+    def __init__(self, story_dir: str):
+        self.story_dir = story_dir
+        self.path = os.path.join(story_dir, MANIFEST_FILE)
+        self.params: Dict[str, Any] = {}
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        # Stages that run concurrently record into the same manifest
+        self._lock = threading.RLock()
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.params = data.get("params", {})
+            self.stages = data.get("stages", {})
+
+    def _relative(self, path: str) -> str:
+        return os.path.relpath(os.path.abspath(path), os.path.abspath(self.story_dir))
+
+    def resolve(self, relative_path: str) -> str:
+        return os.path.join(self.story_dir, relative_path)
+
+    def set_params(self, **params: Any) -> None:
+        with self._lock:
+            self.params.update(params)
+            self.save()
+
+    def get(self, stage: str) -> Optional[Dict[str, Any]]:
+        return self.stages.get(stage)
+
+    def is_fresh(self, stage: str, inputs_hash: str) -> bool:
+        entry = self.stages.get(stage)
+        if entry is None or entry["inputs_hash"] != inputs_hash:
+            return False
+        return all(os.path.exists(self.resolve(path)) for path in entry["outputs"])
+
+    def record(self, stage: str, inputs_hash: str, outputs: List[str], **data: Any) -> None:
+        with self._lock:
+            self.stages[stage] = {
+                "inputs_hash": inputs_hash,
+                "outputs": [self._relative(path) for path in outputs],
+                "completed_at": datetime.now().isoformat(timespec="seconds"),
+                "data": data,
+            }
+            self.save()
+
+    def save(self) -> None:
+        # Replace atomically so a crash mid-write never corrupts the manifest
+        with self._lock:
+            fd, tmp_path = tempfile.mkstemp(dir=self.story_dir, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"params": self.params, "stages": self.stages}, f, ensure_ascii=False, indent=4)
+            os.replace(tmp_path, self.path)
@@ -0,0 +1,126 @@
+import json
+import time
+import types
+import threading
+import subprocess
+from typing import Dict
+
+STORY_SENTENCES = [
+    "Anna found an old brass lamp in her grandmother's attic.",
+    "It was cold to the touch, even in the summer heat.",
+    "That night it began to glow on its own.",
+    "The light painted shadows that did not match the room.",
+    "One of the shadows turned its head toward her bed.",
+    "Anna pulled the plug, but the lamp kept shining.",
+    "By morning, every mirror in the house was covered in frost.",
+    "She carried the lamp back to the attic and locked the door.",
+    "The next evening, it was waiting on her nightstand.",
+    "Some gifts are not meant to be returned.",
+    "Her grandmother's diary had one line circled in red.",
+    "Never let the lamp see you sleep.",
+    "Anna has not slept since.",
+    "The glow grows brighter every night.",
+]
+
+CHARACTERS = [
+    {
+        "name": "Anna Price",
+        "ethnicity": "British",
+        "gender": "female",
+        "age": "28",
+        "facial_features": "pale skin, green eyes, freckles",
+        "body_type": "slim",
+        "hair_style": "shoulder-length auburn hair",
+        "accessories": "silver locket",
+    }
+]
+
+TRANSITIONS = ["zoom-in", "zoom-out", "none"]
+SCENE_TRANSITIONS = ["cut", "crossfade", "slide", "whip-pan"]
+
+
+def _completion(content: str):
+    return types.SimpleNamespace(
+        choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=content))]
+    )
+
+
+class _OfflineCompletions:
+    def __init__(self, latency: float, scene_count: int):
+        self.latency = latency
+        self.scene_count = scene_count
+
+    def create(self, model=None, temperature=None, messages=None, **kwargs):
+        time.sleep(self.latency)
+        prompt = messages[-1]["content"]
+        sentences = [STORY_SENTENCES[i % len(STORY_SENTENCES)] for i in range(self.scene_count)]
+        if "List the full name of every character" in prompt:
+            return _completion(json.dumps({"names": [character["name"] for character in CHARACTERS]}))
+        if "descriptions for each character" in prompt:
+            return _completion(json.dumps({"characters": CHARACTERS}))
+        if '"storyboards"' in prompt:
+            return _completion(json.dumps({
+                "project_info": {"title": "The Lamp", "user": "AI Generated", "timestamp": ""},
+                "storyboards": [
+                    {
+                        "scene_number": i + 1,
+                        "description": f"Anna Price in a dim attic, scene {i + 1}, lit by a brass lamp",
+                        "subtitles": sentence,
+                        "transition_type": TRANSITIONS[i % len(TRANSITIONS)],
+                        "scene_transition": SCENE_TRANSITIONS[i % len(SCENE_TRANSITIONS)],
+                    }
+                    for i, sentence in enumerate(sentences)
+                ],
+            }))
+        return _completion(
+            "Title: The Lamp\n\n"
+            "Description: A lamp that will not stay dark. #scary #horror #facelessvideos.app\n\n"
+            + " ".join(sentences)
+        )
+
+
+class _OfflineSpeech:
+    def __init__(self, latency: float, words_per_second: float):
+        self.latency = latency
+        self.words_per_second = words_per_second
+        self._audio: Dict[float, bytes] = {}
+        self._lock = threading.Lock()
+
+    def _synthesize(self, duration: float) -> bytes:
+        from ffmpeg_renderer import get_ffmpeg_exe
+
+        # Tone bursts with short gaps, so word alignment sees speech-like pauses
+        result = subprocess.run(
+            [
+                get_ffmpeg_exe(), "-loglevel", "error",
+                "-f", "lavfi", "-i", f"sine=frequency=180:duration={duration}",
+                "-af", "volume='if(lt(mod(t,0.45),0.35),1,0.02)':eval=frame",
+                "-ac", "1", "-f", "mp3", "-",
+            ],
+            stdout=subprocess.PIPE,
+            check=True,
+        )
+        return result.stdout
+
+    def create(self, model=None, voice=None, input="", speed=1.0, response_format="mp3", **kwargs):
+        time.sleep(self.latency)
+        # Round to half seconds so scenes of similar length share one encoded clip
+        duration = max(0.5, round(len(input.split()) / self.words_per_second / speed * 2) / 2)
+        with self._lock:
+            if duration not in self._audio:
+                self._audio[duration] = self._synthesize(duration)
+            content = self._audio[duration]
+        return types.SimpleNamespace(content=content)
+
+
+class OfflineOpenAIClient:
+    """Stand-in for the OpenAI client's chat and speech endpoints.
+
+    Returns a canned story, characters and a storyboard with scene_count
+    scenes, and synthetic mp3 speech whose length follows the text, after a
+    fixed per-request latency.
+    """
+
+    def __init__(self, chat_latency: float = 1.0, tts_latency: float = 0.5, scene_count: int = 8, words_per_second: float = 2.5):
+        self.chat = types.SimpleNamespace(completions=_OfflineCompletions(chat_latency, scene_count))
+        self.audio = types.SimpleNamespace(speech=_OfflineSpeech(tts_latency, words_per_second))
@@ -0,0 +1,224 @@
+import os
+import time
+import queue
+import threading
+import contextvars
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from image_generator import generate_image
+from audio_generator import generate_audio, get_audio_duration
+from ffmpeg_renderer import (
+    concat_segments,
+    get_output_size,
+    record_segment_span,
+    get_segment_dir,
+    prepare_segment,
+    render_scene_segment,
+    segment_worker_count,
+)
+from utils import create_blank_image, load_config
+from concurrency import stage_slot
+import tracing
+
+_DONE = object()
+_PENDING = object()
+
+
+def run_streaming_pipeline(
+    client,
+    storyboard_project: Dict[str, Any],
+    story_dir: str,
+    image_style: str,
+    image_generator_func: Callable[..., Any],
+    voice_name: str,
+    output_file: str,
+    captions_config: Optional[Dict[str, Any]] = None,
+) -> Tuple[List[str], List[Optional[float]]]:
+    """Move each scene through image -> audio -> segment render as soon as it is ready.
+
+    Stages are connected by bounded queues, so a slow stage holds back the
+    stages feeding it instead of letting finished work pile up. The segments
+    are joined into output_file once every scene is rendered. Returns the
+    image files and audio durations in scene order, like the staged pipeline.
+    """
+    config = load_config()
+    video_config = config["video"]
+    queue_size = config["pipeline"]["queue_size"]
+    storyboards = storyboard_project["storyboards"]
+    characters = storyboard_project["characters"]
+    scene_count = len(storyboards)
+
+    start_time = time.time()
+    image_files: List[Optional[str]] = [None] * scene_count
+    durations: List[Optional[float]] = [None] * scene_count
+    audio_done = [False] * scene_count
+    image_resolved = [threading.Event() for _ in storyboards]
+    errors = []
+
+    image_queue: "queue.Queue" = queue.Queue()
+    audio_queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+    render_queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+    for i in range(scene_count):
+        image_queue.put(i)
+
+    image_workers = max(1, config["image_generation"]["max_workers"])
+    audio_workers = max(1, config["tts"]["max_workers"])
+    render_workers = segment_worker_count(video_config)
+
+    def image_stage():
+        while True:
+            try:
+                i = image_queue.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                storyboard = storyboards[i]
+                scene_start = time.time()
+                image_filename = os.path.join(story_dir, f"scene_{storyboard['scene_number']}.png")
+                try:
+                    with tracing.span("image.scene", scene=storyboard["scene_number"]), stage_slot("image"):
+                        saved = bool(generate_image(storyboard, characters, image_style, image_generator_func, image_filename))
+                except Exception as e:
+                    print(f"Error generating image for scene {storyboard['scene_number']}: {e}")
+                    saved = False
+                if saved:
+                    image_files[i] = image_filename
+                elif i > 0:
+                    # Use the previous scene's image once it is known
+                    image_resolved[i - 1].wait()
+                    image_files[i] = image_files[i - 1]
+                else:
+                    create_blank_image(image_filename)
+                    image_files[i] = image_filename
+                storyboard["image"] = image_files[i]
+                image_resolved[i].set()
+                print(f"Scene {storyboard['scene_number']} image ready in {time.time() - scene_start:.2f} seconds")
+            except Exception as e:
+                # Unblock the scenes and render stage waiting on this image; the error is raised at the end
+                errors.append(e)
+                image_resolved[i].set()
+                continue
+            audio_queue.put(i)
+
+    def audio_stage():
+        while True:
+            i = audio_queue.get()
+            if i is _DONE:
+                return
+            storyboard = storyboards[i]
+            try:
+                if generate_audio(client, storyboard["subtitles"], storyboard["audio"], voice_name):
+                    durations[i] = get_audio_duration(storyboard["audio"])
+            except Exception as e:
+                # Keep draining the queue so the image stage never blocks; the error is raised at the end
+                errors.append(e)
+            audio_done[i] = True
+            if durations[i] is not None:
+                render_queue.put(i)
+            else:
+                print(f"No audio for scene {storyboard['scene_number']}, skipping it")
+
+    def neighbour(i, step):
+        # Nearest scene with audio before (step -1) or after (step 1) scene i, None at either end
+        j = i + step
+        while 0 <= j < scene_count:
+            if not audio_done[j]:
+                return _PENDING
+            if durations[j] is not None:
+                return j
+            j += step
+        return None
+
+    def render_stage(executor, segment_files):
+        futures = []
+        done = False
+        try:
+            # Every segment shares the first scene's frame size
+            image_resolved[0].wait()
+            size = get_output_size(image_files[0])
+            segment_dir = get_segment_dir(output_file)
+            in_flight = threading.BoundedSemaphore(render_workers)
+            transitions = video_config["scene_transition"] != "cut"
+            waiting = []
+            while not done:
+                i = render_queue.get()
+                if i is _DONE:
+                    done = True
+                else:
+                    waiting.append(i)
+                # A scene's transitions blend it with its neighbours, so it waits until they are known
+                for i in list(waiting):
+                    neighbours = [neighbour(i, -1), neighbour(i, 1)] if transitions else [None, None]
+                    if _PENDING in neighbours:
+                        continue
+                    waiting.remove(i)
+                    previous, following = [
+                        (storyboards[j], durations[j]) if j is not None else None for j in neighbours
+                    ]
+                    segment_file, render_args = prepare_segment(
+                        storyboards[i], durations[i], size, segment_dir, video_config, captions_config,
+                        previous, following,
+                    )
+                    segment_files[i] = segment_file
+                    if render_args is None:
+                        continue
+                    # Block while every render worker is busy or the job's render limit is reached,
+                    # which backs up the queues upstream
+                    in_flight.acquire()
+                    slot = ExitStack()
+                    slot.callback(in_flight.release)
+                    try:
+                        slot.enter_context(stage_slot("render"))
+                        future = executor.submit(tracing.timed_call, render_scene_segment, *render_args)
+                    except Exception:
+                        slot.close()
+                        raise
+                    future.add_done_callback(lambda _, slot=slot: slot.close())
+                    futures.append((render_args, future))
+        except Exception as e:
+            errors.append(e)
+            # Keep draining the queue so the audio stage never blocks; the error is raised at the end
+            while not done:
+                done = render_queue.get() is _DONE
+        for render_args, future in futures:
+            try:
+                record_segment_span(render_args, future.result())
+            except Exception as e:
+                errors.append(e)
+
+    segment_files: List[Optional[str]] = [None] * scene_count
+    os.makedirs(os.path.dirname(storyboards[0]["audio"]), exist_ok=True)
+    with ProcessPoolExecutor(max_workers=render_workers) as executor:
+        # Stage threads run in copies of this context so per-job config overrides apply to them
+        image_threads = [
+            threading.Thread(target=contextvars.copy_context().run, args=(image_stage,))
+            for _ in range(image_workers)
+        ]
+        audio_threads = [
+            threading.Thread(target=contextvars.copy_context().run, args=(audio_stage,))
+            for _ in range(audio_workers)
+        ]
+        render_thread = threading.Thread(
+            target=contextvars.copy_context().run, args=(render_stage, executor, segment_files)
+        )
+        for thread in image_threads + audio_threads + [render_thread]:
+            thread.start()
+
+        for thread in image_threads:
+            thread.join()
+        for _ in audio_threads:
+            audio_queue.put(_DONE)
+        for thread in audio_threads:
+            thread.join()
+        render_queue.put(_DONE)
+        render_thread.join()
+
+    if errors:
+        raise errors[0]
+
+    with stage_slot("render"):
+        concat_segments([path for path in segment_files if path is not None], output_file)
+    print(f"Streamed {scene_count} scenes to {output_file} in {time.time() - start_time:.2f} seconds (wall clock)")
+
+    return image_files, durations
@@ -0,0 +1,214 @@
+import re
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Optional
+from utils import load_config
+import tracing
+
+# Providers with their own quota: "openai_chat", "openai_tts", "replicate" and "fal"
+
+# Errors that will fail the same way on every attempt
+_FATAL_STATUS_CODES = {400, 401, 402, 403, 404, 422}
+_FATAL_MESSAGES = ("Insufficient credit", "status: 402")
+
+
+class TokenBucket:
+    """Thread-safe token bucket that slows down when the provider throttles.
+
+    Every 429 halves the effective rate (down to a tenth of the configured
+    one) and drains the bucket; each success restores a twentieth of the
+    configured rate. pause() blocks all callers until a deadline, so workers
+    sharing a provider back off together instead of stampeding.
+    """
+
+    def __init__(self, requests_per_minute: float, burst: int):
+        self.max_rate = requests_per_minute / 60.0
+        self.rate = self.max_rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self) -> float:
+        """Take one token, sleeping until one is available. Returns the seconds waited."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.blocked_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = max(self.blocked_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(delay)
+            waited += delay
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.blocked_until = max(self.blocked_until, now + seconds)
+            self.tokens = 0.0
+
+    def throttled(self) -> None:
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = max(self.max_rate / 10, self.rate / 2)
+
+    def succeeded(self) -> None:
+        with self._lock:
+            if self.rate < self.max_rate:
+                self._refill(time.monotonic())
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+def get_status_code(error: Exception) -> Optional[int]:
+    # openai and httpx errors carry status_code or a response; replicate errors carry status
+    for attribute in ("status_code", "status"):
+        value = getattr(error, attribute, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(error, "response", None)
+    value = getattr(response, "status_code", None)
+    return value if isinstance(value, int) else None
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """Seconds the provider asked us to wait, from Retry-After headers or the error message."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    # Replicate reports throttling as "... resets in ~12s" in the message
+    match = re.search(r"resets in ~?(\d+(?:\.\d+)?)s", str(error))
+    if match:
+        return float(match.group(1)) + 1
+    return None
+
+
+def is_retryable(error: Exception) -> bool:
+    if get_status_code(error) in _FATAL_STATUS_CODES:
+        return False
+    return not any(message in str(error) for message in _FATAL_MESSAGES)
+
+
+class ProviderLimiter:
+    """Shared quota, retry policy and metrics for one external provider."""
+
+    def __init__(self, name: str, provider_config: Dict[str, Any], retry_config: Dict[str, Any]):
+        self.name = name
+        requests_per_minute = provider_config["requests_per_minute"]
+        self.bucket = TokenBucket(requests_per_minute, provider_config["burst"]) if requests_per_minute else None
+        self.max_retries = retry_config["max_retries"]
+        self.base_delay = retry_config["base_delay"]
+        self.max_delay = retry_config["max_delay"]
+        self._lock = threading.Lock()
+        self.metrics = {
+            "calls": 0,
+            "attempts": 0,
+            "retries": 0,
+            "throttled": 0,
+            "failures": 0,
+            "queue_seconds": 0.0,
+            "backoff_seconds": 0.0,
+        }
+
+    def _count(self, metric: str, amount: float = 1) -> None:
+        with self._lock:
+            self.metrics[metric] += amount
+
+    def backoff(self, attempt: int) -> float:
+        # Exponential backoff with full jitter
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, func: Callable[..., Any], *args, max_retries: Optional[int] = None, **kwargs) -> Any:
+        """Call func under this provider's quota, retrying transient failures.
+
+        max_retries is the total number of attempts, as in the old per-module
+        retry loops. The last error is re-raised once attempts run out.
+        """
+        max_retries = max(1, max_retries or self.max_retries)
+        self._count("calls")
+        # Retries and waits are also added to the caller's trace span
+        span = tracing.current_span()
+        for attempt in range(max_retries):
+            if self.bucket is not None:
+                queue_seconds = self.bucket.acquire()
+                self._count("queue_seconds", queue_seconds)
+                span.add("queue_seconds", queue_seconds)
+            self._count("attempts")
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                if attempt == max_retries - 1 or not is_retryable(e):
+                    self._count("failures")
+                    raise
+                throttled = get_status_code(e) == 429 or "resets in" in str(e)
+                delay = get_retry_after(e)
+                if delay is None:
+                    delay = self.backoff(attempt)
+                delay = min(delay, self.max_delay)
+                if throttled:
+                    self._count("throttled")
+                    if self.bucket is not None:
+                        # Everyone sharing the quota waits out the throttle, then resumes slower
+                        self.bucket.throttled()
+                        self.bucket.pause(delay)
+                print(f"{self.name} request failed (attempt {attempt + 1}/{max_retries}): {e}. Retrying in {delay:.1f} seconds...")
+                self._count("retries")
+                self._count("backoff_seconds", delay)
+                span.add("retries")
+                span.add("backoff_seconds", delay)
+                time.sleep(delay)
+                continue
+            if self.bucket is not None:
+                self.bucket.succeeded()
+            return result
+
+
+_limiters: Dict[str, ProviderLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(provider: str) -> ProviderLimiter:
+    with _limiters_lock:
+        if provider not in _limiters:
+            rate_limits = load_config()["rate_limits"]
+            _limiters[provider] = ProviderLimiter(provider, rate_limits[provider], rate_limits["retry"])
+        return _limiters[provider]
+
+
+def call_with_retries(provider: str, func: Callable[..., Any], *args, max_retries: Optional[int] = None, **kwargs) -> Any:
+    return get_limiter(provider).call(func, *args, max_retries=max_retries, **kwargs)
+
+
+def get_rate_limit_metrics() -> Dict[str, Dict[str, Any]]:
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    metrics = {}
+    for limiter in limiters:
+        with limiter._lock:
+            metrics[limiter.name] = dict(limiter.metrics)
+        if limiter.bucket is not None:
+            metrics[limiter.name]["current_requests_per_minute"] = limiter.bucket.rate * 60
+    return metrics
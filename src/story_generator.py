@@ -8,8 +8,123 @@ import re
 import logging
 import json
 from datetime import datetime
-from typing import Dict, Any, List, Tuple
+from typing import Dict, Any, List, Optional, Tuple
 from utils import STORY_TYPE_HASHTAGS
+import tracing
+
+CHARACTER_FIELDS = [
+    "name", "ethnicity", "gender", "age", "facial_features", "body_type", "hair_style", "accessories"
+]
+TRANSITION_TYPES = ["zoom-in", "zoom-out", "none"]
+SCENE_TRANSITIONS = ["cut", "crossfade", "slide", "whip-pan"]
+
+
+def _object_schema(properties: Dict[str, Any]) -> Dict[str, Any]:
+    # Structured outputs in strict mode need every property required and no extras
+    return {"type": "object", "properties": properties, "required": list(properties), "additionalProperties": False}
+
+
+CHARACTER_NAMES_SCHEMA = _object_schema({"names": {"type": "array", "items": {"type": "string"}}})
+
+CHARACTERS_SCHEMA = _object_schema({
+    "characters": {
+        "type": "array",
+        "items": _object_schema({field: {"type": "string"} for field in CHARACTER_FIELDS}),
+    },
+})
+
+STORYBOARD_SCHEMA = _object_schema({
+    "project_info": _object_schema({
+        "title": {"type": "string"},
+        "user": {"type": "string"},
+        "timestamp": {"type": "string"},
+    }),
+    "storyboards": {
+        "type": "array",
+        "items": _object_schema({
+            "scene_number": {"type": "integer"},
+            "description": {"type": "string"},
+            "subtitles": {"type": "string"},
+            "transition_type": {"type": "string", "enum": TRANSITION_TYPES},
+            "scene_transition": {"type": "string", "enum": SCENE_TRANSITIONS},
+        }),
+    },
+})
+
+_JSON_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "integer": int,
+    "number": (int, float),
+    "boolean": bool,
+}
+
+
+def schema_errors(data: Any, schema: Dict[str, Any], path: str = "$") -> List[str]:
+    """Check data against the JSON Schema subset used by the schemas above."""
+    expected = _JSON_TYPES[schema["type"]]
+    if not isinstance(data, expected) or (isinstance(data, bool) and schema["type"] != "boolean"):
+        return [f"{path}: expected {schema['type']}, got {type(data).__name__}"]
+    if "enum" in schema and data not in schema["enum"]:
+        return [f"{path}: {data!r} is not one of {', '.join(schema['enum'])}"]
+    errors = []
+    if schema["type"] == "object":
+        for key in schema["required"]:
+            if key not in data:
+                errors.append(f"{path}.{key}: missing")
+        for key, value in data.items():
+            if key in schema["properties"]:
+                errors.extend(schema_errors(value, schema["properties"][key], f"{path}.{key}"))
+    elif schema["type"] == "array":
+        for i, item in enumerate(data):
+            errors.extend(schema_errors(item, schema["items"], f"{path}[{i}]"))
+    return errors
+
+
+def parse_json_response(response: str) -> Any:
+    try:
+        return json.loads(response)
+    except json.JSONDecodeError:
+        # Without JSON mode the object may be wrapped in prose or code fences
+        json_match = re.search(r'\{.*\}', response, re.DOTALL)
+        if json_match:
+            try:
+                return json.loads(json_match.group())
+            except json.JSONDecodeError:
+                pass
+    return None
+
+
+def request_json(client, messages: List[Dict[str, str]], name: str, schema: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Request a JSON object matching schema, repeating only this request when a reply does not validate.
+
+    Returns None if the API call fails or every attempt is invalid.
+    """
+    config = load_config()
+    json_mode = config['openai']['json_mode']
+    if json_mode == "json_schema":
+        response_format = {"type": "json_schema", "json_schema": {"name": name, "strict": True, "schema": schema}}
+    elif json_mode == "json_object":
+        response_format = {"type": "json_object"}
+    else:
+        response_format = None
+
+    attempts = max(1, config['openai']['json_attempts'])
+    for attempt in range(attempts):
+        # API errors and rate limits are already retried inside call_openai_api
+        response = call_openai_api(client, messages, response_format=response_format)
+        if not response:
+            print("API returned empty response")
+            return None
+        data = parse_json_response(response)
+        errors = ["$: reply is not valid JSON"] if data is None else schema_errors(data, schema)
+        if not errors:
+            return data
+        tracing.add("invalid_replies")
+        print(f"Invalid {name} reply (attempt {attempt + 1}/{attempts}): {'; '.join(errors[:3])}")
+        logging.error(f"Invalid {name} reply: {response}")
+    return None
 
 def get_story_type_guidelines(story_type: str) -> str:
     story_type_guidelines = {
@@ -107,7 +222,8 @@ def get_story_type_guidelines(story_type: str) -> str:
     
     return guidelines.format(story_type=story_type)
 
-def create_story_prompt(story_type: str, char_limit: Tuple[int, int]) -> str:
+def create_story_prompt(story_type: str, char_limit: Tuple[int, int], topic: Optional[str] = None) -> str:
+    topic_instruction = f"Build the content around the following topic: {topic}" if topic else ""
     base_prompt = f'''
     Create content based on the following guidelines:
 
@@ -117,6 +233,8 @@ def create_story_prompt(story_type: str, char_limit: Tuple[int, int]) -> str:
 
     {get_story_type_guidelines(story_type)}
 
+    {topic_instruction}
+
     Important: Please ensure the total character count is between {char_limit[0]} and {char_limit[1]} characters.
 
     Format your response as follows:
@@ -129,11 +247,11 @@ def create_story_prompt(story_type: str, char_limit: Tuple[int, int]) -> str:
     return base_prompt
 
 
-def generate_story_and_title(client, story_type: str) -> Tuple[str, str, str]:
+def generate_story_and_title(client, story_type: str, topic: Optional[str] = None) -> Tuple[str, str, str]:
     config = load_config()
     char_limit = (config['story_generation']['char_limit_min'], config['story_generation']['char_limit_max'])
 
-    prompt = create_story_prompt(story_type, char_limit)
+    prompt = create_story_prompt(story_type, char_limit, topic)
 
     messages = [
         {
@@ -183,26 +301,56 @@ def generate_story_and_title(client, story_type: str) -> Tuple[str, str, str]:
             return title, description, content
     return None, None, None
 
-def generate_characters(client, story: str) -> List[Dict[str, str]]:
+def extract_character_names(client, story: str) -> Optional[List[str]]:
+    """List the full names of the story's characters with a short LLM call.
+
+    The names are all the storyboard needs, so it can be generated alongside
+    the full character descriptions instead of after them.
+    """
+    prompt = f"""List the full name of every character in the following story, as each name appears in the story. Name unnamed characters by their role (for example "The Old Fisherman").
+
+        Story:
+        {story}
+
+        Output a JSON object: {{"names": ["Full Name", ...]}}
+        """
+
+    messages = [
+        {"role": "system", "content": "You extract character names from stories and reply with JSON only."},
+        {"role": "user", "content": prompt},
+    ]
+
+    data = request_json(client, messages, "character_names", CHARACTER_NAMES_SCHEMA)
+    return None if data is None else data["names"]
+
+
+def generate_characters(client, story: str, character_names: Optional[List[str]] = None) -> Optional[List[Dict[str, str]]]:
+    names_instruction = (
+        f"Describe exactly these characters, using these names unchanged: {', '.join(character_names)}"
+        if character_names else ""
+    )
     prompt = f"""Based on the following story, create detailed descriptions for each character, including their name, ethnicity, gender, age, facial features, body type, hair style, and accessories. Focus on permanent or long-term attributes.
+        {names_instruction}
 
         Story:
         {story}
 
         Output format:
-        [
-            {{
-                "name": "Character Name",
-                "ethnicity": "Character's Ethnicity",
-                "gender": "Character's Gender",
-                "age": "Character's Age",
-                "facial_features": "Description of Character's facial features",
-                "body_type": "Description of Character's body type",
-                "hair_style": "Description of Character's hair style",
-                "accessories": "Description of Character's accessories"
-            }},
-            ...
-        ]
+        {{
+            "characters": [
+                {{
+                    "name": "Character Name",
+                    "ethnicity": "Character's Ethnicity",
+                    "gender": "Character's Gender",
+                    "age": "Character's Age",
+                    "facial_features": "Description of Character's facial features",
+                    "body_type": "Description of Character's body type",
+                    "hair_style": "Description of Character's hair style",
+                    "accessories": "Description of Character's accessories"
+                }},
+                ...
+            ]
+        }}
 
         Guidelines:
         - Include the character's name as it appears in the story.
@@ -217,7 +365,7 @@ def generate_characters(client, story: str) -> List[Dict[str, str]]:
         - Focus on permanent or long-term features, not on changeable expressions or temporary states.
         - Do not include any descriptions of clothing or attire.
 
-        Please provide only the JSON array, without any additional text.
+        Please provide only the JSON object, without any additional text.
         """
 
     messages = [
@@ -236,24 +384,8 @@ def generate_characters(client, story: str) -> List[Dict[str, str]]:
         {"role": "user", "content": prompt},
     ]
 
-    response = call_openai_api(client, messages)
-    if not response:
-        print("API returned empty response")
-    
-    try:
-        return json.loads(response)
-    except json.JSONDecodeError:
-        # if the direct parsing fails, try to extract the JSON array part
-        array_match = re.search(r'\[.*\]', response, re.DOTALL)
-        if array_match:
-            try:
-                return json.loads(array_match.group())
-            except json.JSONDecodeError:
-                print("Failed to parse the response as a JSON array.")
-                return []
-        else:
-            print("No JSON array found in the response.")
-            return []
+    data = request_json(client, messages, "characters", CHARACTERS_SCHEMA)
+    return None if data is None else data["characters"]
 
 
 def generate_storyboard(client, title: str, story: str, story_type: str, character_names: List[str] = None) -> Dict[str, Any]:
@@ -313,6 +445,7 @@ def generate_storyboard(client, title: str, story: str, story_type: str, charact
         2. Description: A vivid description (60-70 words) focusing on key visual elements. {type_guidelines.get(story_type, type_guidelines["general"])}
         3. Subtitles: Use EXACT quotes from the original text. 
         4. Transition: Specify the type of transition to the current scene.
+        5. Scene transition: Specify how the previous scene hands over to the current scene.
 
         Guidelines:
         - Subtitles MUST contain only exact text from the original text, without any additions, omissions, or modifications.
@@ -341,6 +474,13 @@ def generate_storyboard(client, title: str, story: str, story_type: str, charact
             - zoom-out
         3. DO NOT use any other transition types, including fade, dissolve, or cut.
 
+        Use only the following options for scene transitions: cut, crossfade, slide, whip-pan
+        - Cut: The default. Use for continuous action and most scene changes.
+        - Crossfade: Use for the passage of time, memories, or a change of mood.
+        - Slide: Use to move between places or between parallel ideas.
+        - Whip-pan: Use sparingly for sudden surprises or fast changes of focus.
+        The first scene's scene transition is ignored; use "cut".
+
         Output the result as a JSON object with the following structure:
         {{
             "project_info": {{
@@ -350,12 +490,11 @@ def generate_storyboard(client, title: str, story: str, story_type: str, charact
             }},
             "storyboards": [
                 {{
-                    "scene_number": "Scene Number",
+                    "scene_number": 1,
                     "description": "Scene Description",
                     "subtitles": "Subtitles or Dialogue",
-                    "image": null,
-                    "audio": null,
-                    "transition_type": "Transition Type"
+                    "transition_type": "Transition Type",
+                    "scene_transition": "Scene Transition"
                 }},
                 ...
             ]
@@ -385,25 +524,14 @@ def generate_storyboard(client, title: str, story: str, story_type: str, charact
         {"role": "user", "content": prompt},
     ]
 
-    response = call_openai_api(client, messages)
-    if not response:
-        print("API returned empty response")
-        return create_empty_storyboard(title)
-    
-    json_match = re.search(r'\{.*\}', response, re.DOTALL)
-    if json_match:
-        json_str = json_match.group()
-        try:
-            storyboard_data = json.loads(json_str)
-            return storyboard_data
-        except json.JSONDecodeError as e:
-            print(f"JSON Decode Error: {e}")
-            logging.error(f"Failed to parse JSON: {json_str}")
-            return create_empty_storyboard(title)
-    else:
-        print("No JSON object found in the response")
-        logging.error(f"Full response: {response}")
+    storyboard_data = request_json(client, messages, "storyboard", STORYBOARD_SCHEMA)
+    if storyboard_data is None:
         return create_empty_storyboard(title)
+    # Filled in by the image and audio stages
+    for scene in storyboard_data["storyboards"]:
+        scene["image"] = None
+        scene["audio"] = None
+    return storyboard_data
 
 def generate_general_storyboard(client, title: str, story: str, character_names: List[str]) -> Dict[str, Any]:
     return generate_storyboard(client, title, story, "general", character_names)
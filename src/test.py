@@ -3,7 +3,7 @@ import json
 from dotenv import load_dotenv
 from openai import OpenAI
 from video_creator import create_video
-from api import replicate_flux_api, fal_flux_api
+from image_backends import get_image_backend
 from utils import pick_story_type, pick_image_style, pick_voice_name, load_config
 from story_generator import (
     generate_general_storyboard,
@@ -81,7 +81,7 @@ def test_text_to_image(script_dir):
     from image_generator import generate_and_download_images
 
     image_files = generate_and_download_images(
-        storyboard_project, story_dir, image_style, fal_flux_api
+        storyboard_project, story_dir, image_style, get_image_backend()
     )
     print(image_files)
 
@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Spans are only recorded inside start_trace(); elsewhere span() costs one context lookup.
+_current_trace: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar("current_trace", default=None)
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+_span_ids = itertools.count(1)
+
+# Attributes that add up across spans in summaries; others (scene numbers, names) identify a span
+SUMMED_ATTRIBUTES = (
+    "bytes", "frames", "words", "chars", "retries", "queue_seconds", "backoff_seconds",
+    "caption_seconds", "prompt_tokens", "completion_tokens", "total_tokens",
+)
+
+
+class Span:
+    """One timed step. Attributes hold what the step moved: bytes, tokens, retries."""
+
+    def __init__(self, name: str, parent_id: Optional[int], attributes: Dict[str, Any]):
+        self.name = name
+        self.span_id = next(_span_ids)
+        self.parent_id = parent_id
+        self.attributes = attributes
+        thread = threading.current_thread()
+        self.pid = os.getpid()
+        self.thread_id = thread.ident
+        self.thread_name = thread.name
+        self.start = time.time()
+        self.duration: Optional[float] = None
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def add(self, key: str, amount: float = 1) -> None:
+        self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def to_dict(self, trace_id: str) -> Dict[str, Any]:
+        return {
+            "trace_id": trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration": self.duration,
+            "pid": self.pid,
+            "thread": self.thread_name,
+            "attributes": self.attributes,
+        }
+
+
+class _NullSpan:
+    def set(self, **attributes) -> None:
+        pass
+
+    def add(self, key: str, amount: float = 1) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Trace:
+    """Finished spans of one run, shared by every thread working on it."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.trace_id = f"{name}-{int(time.time() * 1000)}-{os.getpid()}"
+        self.spans: List[Span] = []
+        self.root: Optional[Span] = None
+        self._lock = threading.Lock()
+
+    def add(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def write_jsonl(self, path: str) -> None:
+        # Appended, so the traces of earlier runs and resumes stay next to this one
+        with open(path, "a", encoding="utf-8") as f:
+            for span in sorted(self.spans, key=lambda span: span.start):
+                f.write(json.dumps(span.to_dict(self.trace_id), default=str) + "\n")
+
+    def write_chrome_trace(self, path: str) -> None:
+        """Write the trace in the Chrome trace event format (chrome://tracing, Perfetto)."""
+        origin = min(span.start for span in self.spans)
+        events = []
+        threads = {}
+        for span in self.spans:
+            threads[(span.pid, span.thread_id)] = span.thread_name
+            events.append({
+                "name": span.name,
+                "cat": span.name.split(".")[0],
+                "ph": "X",
+                "ts": (span.start - origin) * 1e6,
+                "dur": (span.duration or 0) * 1e6,
+                "pid": span.pid,
+                "tid": span.thread_id,
+                "args": span.attributes,
+            })
+        for (pid, thread_id), thread_name in threads.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": thread_id, "args": {"name": thread_name}})
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, default=str)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Count, total seconds and SUMMED_ATTRIBUTES totals per span name."""
+        totals: Dict[str, Dict[str, float]] = {}
+        for span in self.spans:
+            total = totals.setdefault(span.name, {"count": 0, "seconds": 0.0})
+            total["count"] += 1
+            total["seconds"] += span.duration or 0.0
+            for key in SUMMED_ATTRIBUTES:
+                if key in span.attributes:
+                    total[key] = total.get(key, 0) + span.attributes[key]
+        return totals
+
+    def print_summary(self) -> None:
+        print("\nTrace summary (count, total seconds, totals):")
+        for name, total in sorted(self.summary().items(), key=lambda item: -item[1]["seconds"]):
+            extras = ", ".join(
+                f"{key}={value:.2f}" if isinstance(value, float) else f"{key}={value}"
+                for key, value in total.items() if key not in ("count", "seconds")
+            )
+            print(f"  {name:<24} {total['count']:4d} {total['seconds']:9.2f} s  {extras}")
+
+
+@contextmanager
+def start_trace(trace: Trace, **attributes):
+    """Record every span opened in this context, and in threads started from a copy of it, into trace."""
+    trace_token = _current_trace.set(trace)
+    try:
+        with span(trace.name, **attributes) as root:
+            trace.root = root
+            yield trace
+    finally:
+        _current_trace.reset(trace_token)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time the enclosed block as a child of the current span."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield _NULL_SPAN
+        return
+    parent = _current_span.get()
+    current = Span(name, parent.span_id if parent else None, attributes)
+    span_token = _current_span.set(current)
+    start_time = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        current.set(error=f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        current.duration = time.perf_counter() - start_time
+        _current_span.reset(span_token)
+        trace.add(current)
+
+
+def current_span():
+    span = _current_span.get()
+    return span if span is not None and _current_trace.get() is not None else _NULL_SPAN
+
+
+def annotate(**attributes) -> None:
+    current_span().set(**attributes)
+
+
+def add(key: str, amount: float = 1) -> None:
+    current_span().add(key, amount)
+
+
+def annotate_trace(**attributes) -> None:
+    trace = _current_trace.get()
+    if trace is not None and trace.root is not None:
+        trace.root.set(**attributes)
+
+
+def timed_call(func: Callable[..., Any], *args, **kwargs) -> Tuple[Any, float, float, int]:
+    """Run func and return (result, start, duration, pid), for work done in another process."""
+    start = time.time()
+    start_time = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, start, time.perf_counter() - start_time, os.getpid()
+
+
+def record_span(name: str, start: float, duration: float, pid: Optional[int] = None, **attributes) -> None:
+    """Record a span timed elsewhere, such as a timed_call() in a process pool worker."""
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    parent = _current_span.get()
+    recorded = Span(name, parent.span_id if parent else None, attributes)
+    recorded.start = start
+    recorded.duration = duration
+    if pid is not None and pid != recorded.pid:
+        recorded.pid = pid
+        recorded.thread_id = pid
+        recorded.thread_name = f"worker-{pid}"
+    trace.add(recorded)
@@ -1,35 +1,132 @@
-from moviepy.editor import *
+# moviepy.editor also pulls in IPython and preview helpers; only VideoClip is needed here
+from moviepy.video.VideoClip import VideoClip
 import numpy as np
 from PIL import Image
+from typing import List
 import math
 import numpy
 import cv2
+from abc import ABC, abstractmethod
 
 
-def shake(clip, effect_duration=1, max_offset=5):
-    def shake_effect(get_frame, t):
-        frame = get_frame(t)
+class FrameEffect(ABC):
+    """One step of an EffectChain.
 
-        # Only apply the effect during the specified duration
-        if t < effect_duration:
-            dx = np.random.randint(-max_offset, max_offset + 1)
-            dy = np.random.randint(-max_offset, max_offset + 1)
+    apply() writes the effect of frame at time t into out, a preallocated
+    buffer of the same shape that is never the input frame. Effects that are
+    inactive at t are skipped without touching any buffer.
+    """
 
-            # Convert NumPy array to PIL Image
-            pil_image = Image.fromarray(frame)
+    def active(self, t: float) -> bool:
+        return True
 
-            # Create a new image with a black background
-            result = Image.new("RGB", pil_image.size, (0, 0, 0))
+    @abstractmethod
+    def apply(self, frame: np.ndarray, t: float, out: np.ndarray) -> None:
+        """Write the effect of frame at time t into out."""
 
-            # Paste the original image with an offset
-            result.paste(pil_image, (dx, dy))
 
-            # Convert back to NumPy array
-            return np.array(result)
-        else:
+def _shift_slices(offset: int, size: int):
+    # Source and destination slices moving a span of size pixels by offset
+    if offset >= 0:
+        return slice(0, size - offset), slice(offset, size)
+    return slice(-offset, size), slice(0, size + offset)
+
+
+class Shake(FrameEffect):
+    """Move the frame by a random offset of up to max_offset pixels for the first duration seconds."""
+
+    def __init__(self, duration: float = 1, max_offset: int = 5):
+        self.duration = duration
+        self.max_offset = max_offset
+
+    def active(self, t: float) -> bool:
+        return t < self.duration
+
+    def apply(self, frame: np.ndarray, t: float, out: np.ndarray) -> None:
+        dx = np.random.randint(-self.max_offset, self.max_offset + 1)
+        dy = np.random.randint(-self.max_offset, self.max_offset + 1)
+        h, w = frame.shape[:2]
+        if abs(dx) >= w or abs(dy) >= h:
+            out.fill(0)
+            return
+        src_y, dst_y = _shift_slices(dy, h)
+        src_x, dst_x = _shift_slices(dx, w)
+        out[dst_y, dst_x] = frame[src_y, src_x]
+        # Only the uncovered edges are blacked out
+        if dy > 0:
+            out[:dy] = 0
+        elif dy < 0:
+            out[h + dy:] = 0
+        if dx > 0:
+            out[:, :dx] = 0
+        elif dx < 0:
+            out[:, w + dx:] = 0
+
+
+class Zoom(FrameEffect):
+    """Zoom by up to 0.1 * speed over duration seconds, anchored at position."""
+
+    def __init__(self, duration: float, fps: float = 1, mode: str = "in", position: str = "center", speed: float = 3):
+        self.fps = fps
+        self.total_frames = max(1, int(duration * fps))  # ensure at least 1 frame
+        self.mode = mode
+        self.position = position
+        self.speed = speed
+
+    def apply(self, frame: np.ndarray, t: float, out: np.ndarray) -> None:
+        h, w = frame.shape[:2]
+        i = t * self.fps
+        if self.mode == "out":
+            i = self.total_frames - i
+        zoom = 1 + (i * ((0.1 * self.speed) / self.total_frames))
+
+        # compute the extra zoom to avoid black bars
+        zoom *= max(w / (w - 2), h / (h - 2))
+
+        tx, ty = _zoom_offsets(self.position, w - (w / zoom), h - (h / zoom))
+        M = np.array([[zoom, 0, -tx * zoom], [0, zoom, -ty * zoom]])
+        cv2.warpAffine(frame, M, (w, h), dst=out)
+
+
+class EffectChain:
+    """Apply effects in order, passing frames between two preallocated buffers.
+
+    The buffers are allocated on the first frame and reused, so a chain of
+    any length costs no per-frame allocations. The returned frame is only
+    valid until the next call; callers that keep frames must copy them.
+    """
+
+    def __init__(self, *effects: FrameEffect):
+        self.effects = list(effects)
+        self._buffers: List[np.ndarray] = []
+
+    def then(self, effect: FrameEffect) -> "EffectChain":
+        self.effects.append(effect)
+        self._buffers = []
+        return self
+
+    def __call__(self, frame: np.ndarray, t: float) -> np.ndarray:
+        active = [effect for effect in self.effects if effect.active(t)]
+        if not active:
             return frame
+        if not self._buffers or self._buffers[0].shape != frame.shape or self._buffers[0].dtype != frame.dtype:
+            self._buffers = [np.empty_like(frame) for _ in range(min(2, len(self.effects)))]
+        source = frame
+        for i, effect in enumerate(active):
+            out = self._buffers[i % len(self._buffers)]
+            effect.apply(source, t, out)
+            source = out
+        return source
+
+
+def apply_effects(clip, *effects: FrameEffect):
+    """Return clip with effects applied to every frame through one EffectChain."""
+    chain = EffectChain(*effects)
+    return clip.fl(lambda get_frame, t: chain(get_frame(t), t))
+
 
-    return clip.fl(shake_effect)
+def shake(clip, effect_duration=1, max_offset=5):
+    return apply_effects(clip, Shake(effect_duration, max_offset))
 
 
 def zoom(clip, mode="in", position="center", speed=3):
@@ -37,47 +134,129 @@ def zoom(clip, mode="in", position="center", speed=3):
         fps = clip.fps
     else:
         fps = 1
+    return apply_effects(clip, Zoom(clip.duration, fps, mode, position, speed))
 
-    duration = clip.duration
-    total_frames = max(1, int(duration * fps))  # ensure at least 1 frame
 
-    def main(getframe, t):
-        frame = getframe(t)
-        h, w = frame.shape[:2]
-        i = t * fps
-        if mode == "out":
-            i = total_frames - i
-        zoom = 1 + (i * ((0.1 * speed) / total_frames))
-        
-        # compute the extra zoom to avoid black bars
-        extra_zoom = max(w / (w - 2), h / (h - 2))
-        zoom *= extra_zoom
-
-        dw = w - (w / zoom)
-        dh = h - (h / zoom)
-
-        if position == "center":
-            tx, ty = dw / 2, dh / 2
-        elif position == "left":
-            tx, ty = 0, dh / 2
-        elif position == "right":
-            tx, ty = dw, dh / 2
-        elif position == "top":
-            tx, ty = dw / 2, 0
-        elif position == "topleft":
-            tx, ty = 0, 0
-        elif position == "topright":
-            tx, ty = dw, 0
-        elif position == "bottom":
-            tx, ty = dw / 2, dh
-        elif position == "bottomleft":
-            tx, ty = 0, dh
-        elif position == "bottomright":
-            tx, ty = dw, dh
+# Transitions between scenes, as opposed to the camera motion within a scene
+SCENE_TRANSITIONS = ("cut", "crossfade", "slide", "whip-pan")
+
+
+def _smoothstep(p):
+    return p * p * (3 - 2 * p)
+
+
+def _smootherstep(p):
+    # Slower start and end, faster middle: the whip of a whip-pan
+    return p * p * p * (p * (6 * p - 15) + 10)
+
+
+def _push(first, second, offsets, out):
+    # The second image pushes the first out to the left by offsets[i] pixels in frame i
+    w = first.shape[1]
+    for frame, x in zip(out, offsets):
+        frame[:, :w - x] = first[:, x:]
+        frame[:, w - x:] = second[:, :x]
+
+
+def blend_scenes(effect: str, first: np.ndarray, second: np.ndarray, frame_count: int) -> np.ndarray:
+    """Return frame_count frames of effect going from the still first to the still second.
+
+    The frames are computed together into one preallocated block, so a
+    transition costs a pass over its own frames and nothing else.
+    """
+    h, w = first.shape[:2]
+    out = np.empty((frame_count,) + first.shape, dtype=np.uint8)
+    # Frame centers, so no frame is entirely one scene
+    progress = (np.arange(frame_count) + 0.5) / frame_count
+    if effect == "crossfade":
+        for frame, p in zip(out, progress):
+            cv2.addWeighted(first, 1 - p, second, p, 0, dst=frame)
+    elif effect == "slide":
+        _push(first, second, np.round(_smoothstep(progress) * w).astype(int), out)
+    elif effect == "whip-pan":
+        offsets = np.round(_smootherstep(progress) * w).astype(int)
+        _push(first, second, offsets, out)
+        # Motion blur as long as the distance moved during the frame
+        speeds = np.abs(_smootherstep(np.minimum(progress + 0.5 / frame_count, 1)) - _smootherstep(np.maximum(progress - 0.5 / frame_count, 0))) * w
+        for frame, speed in zip(out, speeds):
+            kernel = int(min(speed, w // 4))
+            if kernel > 1:
+                cv2.blur(frame, (kernel, 1), dst=frame)
+    else:
+        raise ValueError(f"Unknown scene transition: {effect}")
+    return out
+
+
+def _zoom_offsets(position, dw, dh):
+    # dw/dh may be scalars or arrays of per-frame values
+    if position == "left":
+        return 0 * dw, dh / 2
+    elif position == "right":
+        return dw, dh / 2
+    elif position == "top":
+        return dw / 2, 0 * dh
+    elif position == "topleft":
+        return 0 * dw, 0 * dh
+    elif position == "topright":
+        return dw, 0 * dh
+    elif position == "bottom":
+        return dw / 2, dh
+    elif position == "bottomleft":
+        return 0 * dw, dh
+    elif position == "bottomright":
+        return dw, dh
+    return dw / 2, dh / 2  # default to center
+
+
+def zoom_still(image_file, duration, fps=24, mode="in", position="center", speed=3, upscale=2.0):
+    """Ken Burns zoom over a still image using precomputed crop rectangles.
+
+    The image is decoded once (on the first frame request), optionally
+    pre-upscaled so rounding the crop to whole pixels does not jitter, and every
+    frame is a crop + resize into a reused output buffer. Produces the same
+    framing as zoom() on an ImageClip of the same image.
+    """
+    total_frames = max(1, int(round(duration * fps)))
+    state = {}
+
+    def prepare():
+        image = np.array(Image.open(image_file).convert("RGB"))
+        h, w = image.shape[:2]
+        if upscale and upscale > 1:
+            source = cv2.resize(image, (int(w * upscale), int(h * upscale)), interpolation=cv2.INTER_CUBIC)
         else:
-            tx, ty = dw / 2, dh / 2  # default to center
-        M = np.array([[zoom, 0, -tx * zoom], [0, zoom, -ty * zoom]])
-        frame = cv2.warpAffine(frame, M, (w, h))
-        return frame
+            source = image
+        sh, sw = source.shape[:2]
+
+        # Per-frame zoom factors, matching zoom(): 1 -> 1 + 0.1 * speed over the clip
+        progress = np.arange(total_frames) / total_frames
+        if mode == "out":
+            progress = 1 - progress
+        zooms = (1 + progress * 0.1 * speed) * max(w / (w - 2), h / (h - 2))
+
+        crop_w = sw / zooms
+        crop_h = sh / zooms
+        x0, y0 = _zoom_offsets(position, sw - crop_w, sh - crop_h)
+        x0 = np.clip(np.round(x0), 0, sw - 1).astype(np.int32)
+        y0 = np.clip(np.round(y0), 0, sh - 1).astype(np.int32)
+        x1 = np.clip(np.round(x0 + crop_w), x0 + 1, sw).astype(np.int32)
+        y1 = np.clip(np.round(y0 + crop_h), y0 + 1, sh).astype(np.int32)
+
+        state["source"] = source
+        state["size"] = (w, h)
+        state["rects"] = np.stack([x0, y0, x1, y1], axis=1)
+        state["buffer"] = np.empty((h, w, 3), dtype=np.uint8)
+        state["index"] = None
+
+    def make_frame(t):
+        if not state:
+            prepare()
+        index = min(total_frames - 1, max(0, int(t * fps)))
+        if state["index"] != index:
+            x0, y0, x1, y1 = state["rects"][index]
+            crop = state["source"][y0:y1, x0:x1]
+            cv2.resize(crop, state["size"], dst=state["buffer"], interpolation=cv2.INTER_LINEAR)
+            state["index"] = index
+        return state["buffer"]
 
-    return clip.fl(main)
+    return VideoClip(make_frame, duration=duration)
@@ -1,10 +1,14 @@
 import os
 import re
+import sys
 import json
-from datetime import datetime
-import datetime
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from typing import List, Dict
-from PIL import Image
+from concurrency import stage_slot
+import tracing
 
 
 STORY_TYPES = [
@@ -35,6 +39,18 @@ STORY_TYPE_HASHTAGS = {
     "Love": "#love",
 }
 
+IMAGE_STYLES = ["photorealistic", "cinematic", "anime", "comic-book", "pixar-art"]
+
+# alloy, echo, fable, onyx, nova, and shimmer
+VOICES = [
+    "alloy",
+    "echo",
+    "fable",
+    "onyx",
+    "nova",
+    "shimmer"
+]
+
 def create_resource_dir(script_dir, story_type, title):
     # Remove leading and trailing quotation marks and spaces
     clean_title = title.strip().strip('"')
@@ -57,24 +73,40 @@ def create_resource_dir(script_dir, story_type, title):
 
     return story_dir
 
-def call_openai_api(client, messages, max_retries=3):
+def call_openai_api(client, messages, max_retries=None, response_format=None):
+    # Imported here because rate_limiter reads its settings through this module
+    from rate_limiter import call_with_retries
+
     config = load_config()
-    # Add a system message requesting JSON output
-    for attempt in range(max_retries):
-        try:
-            response = client.chat.completions.create(
+
+    # Only sent when asked for, since some OpenAI-compatible servers reject the parameter
+    extra_args = {"response_format": response_format} if response_format is not None else {}
+
+    def create_completion():
+        with stage_slot("llm"):
+            return client.chat.completions.create(
                 model=config['openai']['model'],
                 temperature=config['openai']['temperature'],
-                messages=messages
+                messages=messages,
+                **extra_args
             )
-            return response.choices[0].message.content
+
+    with tracing.span("llm.chat", model=config['openai']['model']) as span:
+        try:
+            response = call_with_retries("openai_chat", create_completion, max_retries=max_retries)
         except Exception as e:
+            span.set(error=str(e))
             print(f"An error occurred: {e}")
-            if attempt < max_retries - 1:
-                print(f"Retrying... (Attempt {attempt + 2} of {max_retries})")
-            else:
-                print("Max retries reached. Unable to get a valid response.")
-    return None
+            print("Max retries reached. Unable to get a valid response.")
+            return None
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            span.set(
+                prompt_tokens=usage.prompt_tokens,
+                completion_tokens=usage.completion_tokens,
+                total_tokens=usage.total_tokens,
+            )
+    return response.choices[0].message.content
 
 
 def create_empty_storyboard(title):
@@ -103,7 +135,7 @@ def pick_story_type():
             print("Invalid input. Please enter a number.")
 
 def pick_image_style():
-    styles = ["photorealistic", "cinematic", "anime", "comic-book", "pixar-art"]
+    styles = IMAGE_STYLES
     print("Choose an image style:")
     for i, style in enumerate(styles, 1):
         print(f"{i}. {style}")
@@ -120,7 +152,7 @@ def pick_image_style():
 
 def convert_to_timestamped_subtitles(chinese_storyboard_project: Dict, scene_duration: int = 10) -> List[Dict]:
     timestamped_subtitles = []
-    current_time = datetime.timedelta()
+    current_time = timedelta()
 
     for scene in chinese_storyboard_project['storyboards']:
         subtitles = scene['subtitles'].split('\n')
@@ -128,7 +160,7 @@ def convert_to_timestamped_subtitles(chinese_storyboard_project: Dict, scene_dur
 
         for subtitle in subtitles:
             start_time = current_time
-            end_time = current_time + datetime.timedelta(seconds=time_per_subtitle)
+            end_time = current_time + timedelta(seconds=time_per_subtitle)
 
             timestamped_subtitles.append({
                 'start_time': start_time.total_seconds(),
@@ -141,7 +173,7 @@ def convert_to_timestamped_subtitles(chinese_storyboard_project: Dict, scene_dur
     return timestamped_subtitles
 
 def format_timedelta(seconds: float) -> str:
-    td = datetime.timedelta(seconds=seconds)
+    td = timedelta(seconds=seconds)
     hours, remainder = divmod(td.seconds, 3600)
     minutes, seconds = divmod(remainder, 60)
     milliseconds = td.microseconds // 1000
@@ -154,27 +186,250 @@ def save_timestamped_subtitles(timestamped_subtitles: List[Dict], output_file: s
             f.write(f"{format_timedelta(subtitle['start_time'])} --> {format_timedelta(subtitle['end_time'])}\n")
             f.write(f"{subtitle['text']}\n\n")
 
+class ConfigError(ValueError):
+    """Raised when config.json or a config override is invalid."""
+
+
+NUMBER = (int, float)
+
+# Expected type of every setting; nested dicts are sections
+CONFIG_SCHEMA = {
+    "story_generation": {"char_limit_min": int, "char_limit_max": int},
+    "storyboard": {"max_scenes": int},
+    "openai": {"model": str, "temperature": NUMBER, "json_mode": str, "json_attempts": int},
+    "image_generation": {"backend": str, "max_workers": int, "batch_size": int},
+    "replicate_flux_api": {
+        "model": str,
+        "aspect_ratio": str,
+        "num_inference_steps": int,
+        "disable_safety_checker": bool,
+        "guidance": NUMBER,
+        "output_quality": int,
+    },
+    "fal_flux_api": {
+        "model": str,
+        "image_size": str,
+        "num_inference_steps": int,
+        "guidance_scale": NUMBER,
+        "enable_safety_checker": bool,
+        "num_images": int,
+    },
+    "local_stub": {
+        "latency_seconds": NUMBER,
+        "latency_jitter_seconds": NUMBER,
+        "width": int,
+        "height": int,
+        "num_images": int,
+    },
+    "http": {
+        "timeout": {"connect": NUMBER, "read": NUMBER, "write": NUMBER, "pool": NUMBER},
+        "max_connections": int,
+        "max_keepalive_connections": int,
+        "keepalive_expiry": NUMBER,
+        "chunk_size_kb": NUMBER,
+    },
+    "rate_limits": {
+        "retry": {"max_retries": int, "base_delay": NUMBER, "max_delay": NUMBER},
+        "openai_chat": {"requests_per_minute": NUMBER, "burst": int},
+        "openai_tts": {"requests_per_minute": NUMBER, "burst": int},
+        "replicate": {"requests_per_minute": NUMBER, "burst": int},
+        "fal": {"requests_per_minute": NUMBER, "burst": int},
+    },
+    "cache": {
+        "images": {"enabled": bool, "dir": str, "max_size_mb": NUMBER},
+        "tts": {"enabled": bool, "dir": str, "max_size_mb": NUMBER},
+    },
+    "tts": {"model": str, "speech_rate": NUMBER, "max_workers": int},
+    "video": {
+        "renderer": str,
+        "fps": int,
+        "zoom_engine": str,
+        "zoom_upscale": NUMBER,
+        "segment_workers": int,
+        "scene_transition": str,
+        "scene_transition_seconds": NUMBER,
+        "hold_static_frames": bool,
+        "ffmpeg": {"preset": str, "crf": int, "threads": int},
+    },
+    "captions": {
+        "engine": str,
+        "word_timing": str,
+        "font": str,
+        "font_size": int,
+        "font_color": str,
+        "stroke_width": int,
+        "stroke_color": str,
+        "shadow_strength": NUMBER,
+        "shadow_blur": NUMBER,
+        "highlight_color": str,
+        "padding": int,
+        "position": str,
+        "atlas_cache": bool,
+        "atlas_max_words": int,
+    },
+    "pipeline": {"streaming": bool, "queue_size": int},
+    "tracing": {"enabled": bool, "chrome_trace": bool, "print_summary": bool},
+    "batch": {
+        "max_jobs": int,
+        "stage_limits": {"llm": int, "image": int, "tts": int, "render": int},
+    },
+}
+
+CONFIG_CHOICES = {
+    "image_generation.backend": ("replicate_flux_api", "fal_flux_api", "local_stub"),
+    "openai.json_mode": ("json_schema", "json_object", "off"),
+    "video.renderer": ("moviepy", "ffmpeg", "segments", "streaming"),
+    "video.zoom_engine": ("precomputed", "warp"),
+    "video.scene_transition": ("storyboard", "cut", "crossfade", "slide", "whip-pan"),
+    "captions.engine": ("shortcap", "native"),
+    "captions.word_timing": ("energy", "weighted"),
+    "captions.position": ("top", "center", "bottom"),
+}
+
+# Sections read once into process-wide clients, caches and limiters
+PROCESS_WIDE_SECTIONS = ("http", "rate_limits", "cache", "batch")
+
+
+def _schema_errors(config, schema, path="", allow_missing=False):
+    errors = []
+    if not isinstance(config, dict):
+        return [f"{path or 'config'}: expected an object"]
+    for key, expected in schema.items():
+        key_path = f"{path}.{key}" if path else key
+        if key not in config:
+            if not allow_missing:
+                errors.append(f"{key_path}: missing")
+            continue
+        value = config[key]
+        if isinstance(expected, dict):
+            errors.extend(_schema_errors(value, expected, key_path, allow_missing))
+        elif not isinstance(value, expected) or (isinstance(value, bool) and expected is not bool):
+            # bool is an int subclass, so true/false would otherwise pass as numbers
+            errors.append(f"{key_path}: expected {getattr(expected, '__name__', 'a number')}, got {value!r}")
+        elif key_path in CONFIG_CHOICES and value not in CONFIG_CHOICES[key_path]:
+            errors.append(f"{key_path}: expected one of {', '.join(CONFIG_CHOICES[key_path])}, got {value!r}")
+    if allow_missing:
+        # Overrides are partial, so a typo would otherwise be silently ignored
+        for key in config:
+            if key not in schema:
+                errors.append(f"{path}.{key}: unknown setting" if path else f"{key}: unknown setting")
+    return errors
+
+
+def validate_config(config, overrides=False):
+    """Raise ConfigError listing every missing, unknown or mistyped setting.
+
+    With overrides=True, config is a partial config: missing settings are
+    fine, unknown ones and process-wide sections are not.
+    """
+    errors = _schema_errors(config, CONFIG_SCHEMA, allow_missing=overrides)
+    if overrides:
+        errors.extend(
+            f"{section}: cannot be overridden per job" for section in PROCESS_WIDE_SECTIONS if section in config
+        )
+    elif not errors and config["story_generation"]["char_limit_min"] > config["story_generation"]["char_limit_max"]:
+        errors.append("story_generation.char_limit_min: greater than char_limit_max")
+    if errors:
+        raise ConfigError("Invalid config:\n  " + "\n  ".join(errors))
+
+
+_config_cache = {}
+_config_lock = threading.Lock()
+_config_override = contextvars.ContextVar("config_override", default=None)
+
+
 def load_config(config_file='config.json'):
+    """Return the validated config, parsing config_file again only when its mtime changes.
+
+    Inside config_overrides() the job's merged config is returned instead.
+    The dict is shared between callers and must not be modified.
+    """
+    override = _config_override.get()
+    if override is not None and config_file == 'config.json':
+        return override
+
     script_dir = os.path.dirname(os.path.abspath(__file__))
     config_path = os.path.join(os.path.dirname(script_dir), config_file)
-    with open(config_path, 'r') as f:
-        return json.load(f)
+    mtime = os.stat(config_path).st_mtime_ns
+    with _config_lock:
+        cached = _config_cache.get(config_path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        with open(config_path, 'r') as f:
+            config = json.load(f)
+        validate_config(config)
+        _config_cache[config_path] = (mtime, config)
+        return config
+
+
+def reload_config(config_file='config.json'):
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    with _config_lock:
+        _config_cache.pop(os.path.join(os.path.dirname(script_dir), config_file), None)
+    return load_config(config_file)
+
+
+def merge_config(base, overrides):
+    merged = dict(base)
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_config(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+@contextmanager
+def config_overrides(overrides):
+    """Make load_config() return the config with overrides merged in, for this context only.
+
+    Threads started for the job must run in a copy of this context
+    (contextvars.copy_context) to see the overrides.
+    """
+    if not overrides:
+        yield load_config()
+        return
+    validate_config(overrides, overrides=True)
+    merged = merge_config(load_config(), overrides)
+    validate_config(merged)
+    token = _config_override.set(merged)
+    try:
+        yield merged
+    finally:
+        _config_override.reset(token)
+
+def peak_rss_mb():
+    """Peak resident set size of this process and of its largest finished child, in MB."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale,
+    }
+
+
+def current_rss_mb():
+    """Current resident set size of this process in MB, or None where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return None
 
 def create_blank_image(filename, width=720, height=1280):
+    from PIL import Image
+
     blank_image = Image.new('RGB', (width, height), color='black')
     blank_image.save(filename)
     print(f"Created blank image: {filename}")
 
 def pick_voice_name():
-    # alloy, echo, fable, onyx, nova, and shimmer
-    voices = [
-        "alloy",
-        "echo",
-        "fable",
-        "onyx",
-        "nova",
-        "shimmer"
-    ]
+    voices = VOICES
     print("Choose a voice:")
     for i, voice in enumerate(voices, 1):
         print(f"{i}. {voice}")
@@ -1,66 +1,268 @@
-from moviepy.editor import (
-    ImageClip,
-    TextClip,
-    CompositeVideoClip,
-    concatenate_videoclips,
-    AudioFileClip
+import numpy as np
+# Import from the submodules: moviepy.editor also loads IPython and preview helpers
+from moviepy.video.VideoClip import ImageClip, TextClip
+from moviepy.video.compositing.CompositeVideoClip import CompositeVideoClip
+from moviepy.video.compositing.concatenate import concatenate_videoclips
+from moviepy.audio.io.AudioFileClip import AudioFileClip
+from moviepy.video.fx.resize import resize
+from audio_generator import generate_scene_audio
+from transitions import zoom, zoom_still
+from ffmpeg_renderer import (
+    concat_segments,
+    frame_counts,
+    get_output_size,
+    neighbour_frames,
+    render_scene_segment,
+    render_with_ffmpeg,
+    render_with_segments,
+    segment_frame_count,
+    transition_block,
+    transition_frame_counts,
 )
-from audio_generator import generate_audio
-from transitions import zoom
+from captions import CaptionRenderer, build_caption_track
+from utils import current_rss_mb, load_config, peak_rss_mb
+import tracing
 import os
-import shortcap
+import weakref
+import tempfile
 
 script_dir = os.path.dirname(os.path.abspath(__file__))
 font_path = os.path.join(os.path.dirname(script_dir), "font")
 
 def add_subtitles(output_file, output_file_subtitle):
-    shortcap.add_captions(
-        video_file=output_file,
-        output_file=output_file_subtitle,
-
-        font=os.path.join(font_path, "TitanOne.ttf"),
-        font_size=70,
-        font_color="white",
-        stroke_width=3,
-        stroke_color="black",
-        shadow_strength=1.0,
-        shadow_blur=0.1,
-        highlight_current_word=True,
-        word_highlight_color="yellow",
-        line_count=1,
-        padding=70,
-        position="center",
-        use_local_whisper=False,
+    # shortcap loads Whisper, so it is only imported when the shortcap engine is used
+    import shortcap
+
+    captions_config = load_config()['captions']
+    with tracing.span("captions.shortcap"):
+        shortcap.add_captions(
+            video_file=output_file,
+            output_file=output_file_subtitle,
+
+            font=os.path.join(font_path, captions_config['font']),
+            font_size=captions_config['font_size'],
+            font_color=captions_config['font_color'],
+            stroke_width=captions_config['stroke_width'],
+            stroke_color=captions_config['stroke_color'],
+            shadow_strength=captions_config['shadow_strength'],
+            shadow_blur=captions_config['shadow_blur'],
+            highlight_current_word=True,
+            word_highlight_color=captions_config['highlight_color'],
+            line_count=1,
+            padding=captions_config['padding'],
+            position=captions_config['position'],
+            use_local_whisper=False,
+        )
+
+
+def build_scene_clip(scene, duration, video_config):
+    """Return one scene's video clip with its audio attached."""
+    fps = video_config['fps']
+
+    # Create audio clip
+    audio_clip = AudioFileClip(scene['audio'])
+
+    transition_type = scene['transition_type']
+
+    # The precomputed engine renders zooms straight from the still image
+    if video_config['zoom_engine'] == 'precomputed' and transition_type in ('zoom-in', 'zoom-out'):
+        mode = 'in' if transition_type == 'zoom-in' else 'out'
+        video_clip = zoom_still(
+            scene['image'], duration, fps=fps, mode=mode, upscale=video_config['zoom_upscale']
+        )
+        return video_clip.set_audio(audio_clip)
+
+    # Create image clip with duration matching the audio
+    image_clip = ImageClip(scene['image']).set_duration(duration)
+    
+    # Combine image, text, and audio
+    video_clip = image_clip.set_audio(audio_clip)
+    
+    # Apply transition effect
+    if transition_type == 'zoom-in':
+        return zoom(video_clip)
+    elif transition_type == 'zoom-out':
+        return zoom(video_clip, mode='out')
+    return video_clip
+
+
+def add_scene_transitions(clip, scene, duration, frame_count, previous, following, video_config):
+    """Replace the clip's first and last frames with its transitions from and to the neighbouring scenes.
+
+    previous and following are (scene, duration, frame_count) tuples, or None
+    at either end of the video. Transition frames are computed when the first
+    of them is requested.
+    """
+    fps = video_config['fps']
+    lead_in_count, lead_out_count = transition_frame_counts(scene, frame_count, previous, following, video_config)
+    if not lead_in_count and not lead_out_count:
+        return clip
+    size = tuple(clip.size)
+    current = (scene, duration, frame_count)
+    lead_out_start = frame_count - lead_out_count
+    # Weak references, so finished transitions are freed once transition_block's cache drops them
+    blocks = {}
+
+    def block(part, before, after):
+        ref = blocks.get(part)
+        frames = ref() if ref is not None else None
+        if frames is None:
+            frames = transition_block(before, after, size, video_config)
+            blocks[part] = weakref.ref(frames)
+        return frames
+
+    def transition_frame(get_frame, t):
+        index = int(round(t * fps))
+        if index < lead_in_count:
+            frames = block('in', previous, current)
+            return frames[len(frames) - lead_in_count + index]
+        if lead_out_count and index >= lead_out_start:
+            return block('out', current, following)[min(index - lead_out_start, lead_out_count - 1)]
+        return get_frame(t)
+
+    return clip.fl(transition_frame)
+
+
+def close_clip(clip):
+    # Each AudioFileClip keeps an ffmpeg reader process and its pipes open until closed
+    if clip.audio is not None:
+        clip.audio.close()
+    clip.close()
+
+
+def add_caption_overlay(clip, scenes, durations, offsets, captions_config):
+    caption_renderer = CaptionRenderer(captions_config, clip.size)
+    caption_renderer.set_words(build_caption_track(scenes, durations, offsets, captions_config["word_timing"]))
+    caption_buffer = np.empty((clip.h, clip.w, 3), dtype=np.uint8)
+    return clip.fl(
+        lambda get_frame, t: caption_renderer.composite(get_frame(t), t, caption_buffer)
     )
 
 
-def create_video(client, storyboard_project, output_file, audio_dir, voice_name):
-    clips = []
-    for scene in storyboard_project['storyboards']:
-        # Generate audio for the subtitle
-        audio_file = scene['audio']
-        generate_audio(client, scene['subtitles'], audio_file, voice_name)
-        
-        # Create audio clip
-        audio_clip = AudioFileClip(audio_file)
-        
-        # Create image clip with duration matching the audio
-        image_clip = ImageClip(scene['image']).set_duration(audio_clip.duration)
-        
-        # Combine image, text, and audio
-        video_clip = image_clip.set_audio(audio_clip)
-        
-        # Apply transition effect
-        transition_type = scene['transition_type']
-            
-        if transition_type == 'zoom-in':
-            clips.append(zoom(video_clip))
-        elif transition_type == 'zoom-out':
-            clips.append(zoom(video_clip, mode='out'))
+def render_with_moviepy(scenes, durations, output_file, video_config, captions_config=None):
+    fps = video_config['fps']
+
+    clips = [build_scene_clip(scene, duration, video_config) for scene, duration in zip(scenes, durations)]
+    try:
+        counts = frame_counts(durations, fps)
+        final_clip = concatenate_videoclips([
+            add_scene_transitions(clip, scene, duration, count, *neighbour_frames(scenes, durations, counts, i), video_config)
+            for i, (clip, scene, duration, count) in enumerate(zip(clips, scenes, durations, counts))
+        ])
+
+        if captions_config is not None:
+            offsets = np.concatenate([[0], np.cumsum(durations)[:-1]])
+            final_clip = add_caption_overlay(final_clip, scenes, durations, offsets, captions_config)
+
+        with tracing.span("video.encode", renderer="moviepy", frames=int(round(sum(durations) * fps))):
+            final_clip.write_videofile(output_file, fps=fps)
+    finally:
+        for clip in clips:
+            close_clip(clip)
+
+
+def segment_write_options(video_config):
+    # The settings render_scene_segment encodes with, so moviepy and ffmpeg segments join without re-encoding
+    ffmpeg_config = video_config['ffmpeg']
+    return dict(
+        codec='libx264',
+        preset=ffmpeg_config['preset'],
+        threads=ffmpeg_config['threads'],
+        ffmpeg_params=['-crf', str(ffmpeg_config['crf'])],
+        audio_codec='aac',
+        audio_fps=44100,
+        audio_bitrate='192k',
+    )
+
+
+def render_with_streaming(scenes, durations, output_file, video_config, captions_config=None):
+    """Encode one scene at a time with moviepy, then join the segments without re-encoding.
+
+    Only the current scene's image, zoom state and audio reader are open, so
+    memory and open files stay flat however many scenes the video has. With
+    video.hold_static_frames, scenes without a zoom skip moviepy and are
+    encoded by ffmpeg as held stills.
+    """
+    fps = video_config['fps']
+    # Joining without re-encoding needs every segment at one even size
+    size = get_output_size(scenes[0]['image'])
+    counts = [segment_frame_count(duration, fps) for duration in durations]
+
+    # Segments sit next to the output file and are removed once joined
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(output_file))) as segment_dir:
+        segment_files = []
+        for i, (scene, duration) in enumerate(zip(scenes, durations)):
+            segment_file = os.path.join(segment_dir, f"scene_{scene['scene_number']}.mp4")
+            neighbours = neighbour_frames(scenes, durations, counts, i)
+            with tracing.span("video.segment", scene=scene['scene_number'], frames=counts[i]):
+                if video_config['hold_static_frames'] and scene['transition_type'] not in ('zoom-in', 'zoom-out'):
+                    render_scene_segment(scene, duration, counts[i], segment_file, size, video_config, captions_config, *neighbours)
+                else:
+                    clip = build_scene_clip(scene, duration, video_config)
+                    try:
+                        if tuple(clip.size) != size:
+                            clip = resize(clip, newsize=size)
+                        clip = add_scene_transitions(clip, scene, duration, counts[i], *neighbours, video_config)
+                        if captions_config is not None:
+                            clip = add_caption_overlay(clip, [scene], [duration], [0.0], captions_config)
+                        # moviepy writes a frame for every 1/fps step below the clip duration, so end
+                        # half a frame early to get exactly counts[i] frames, and keep the whole audio
+                        # track like render_scene_segment does
+                        clip = clip.set_duration((counts[i] - 0.5) / fps).set_audio(clip.audio)
+                        clip.write_videofile(segment_file, fps=fps, logger=None, **segment_write_options(video_config))
+                    finally:
+                        close_clip(clip)
+            segment_files.append(segment_file)
+            rss = current_rss_mb()
+            memory = f", RSS {rss:.0f} MB" if rss is not None else ""
+            print(f"Encoded scene {scene['scene_number']} ({i + 1}/{len(scenes)}){memory}")
+
+        concat_segments(segment_files, output_file)
+    print(f"Rendered {len(scenes)} scenes one at a time to {output_file}")
+
+
+def create_video(client, storyboard_project, output_file, audio_dir, voice_name, durations=None, subtitles=True):
+    """Render the storyboard to output_file and return the path of the final video.
+
+    With subtitles and the "native" caption engine, captions are burned in
+    during the same encode and only the _subtitle.mp4 video is written.
+    """
+    config = load_config()
+    video_config = config['video']
+    subtitle_file = output_file.replace('.mp4', '_subtitle.mp4')
+    burn_in = subtitles and config['captions']['engine'] == 'native'
+    captions_config = config['captions'] if burn_in else None
+    render_file = subtitle_file if burn_in else output_file
+
+    # Synthesize all scene audio up front so rendering only assembles clips
+    if durations is None:
+        durations = generate_scene_audio(client, storyboard_project['storyboards'], voice_name)
+
+    scenes = []
+    scene_durations = []
+    for scene, duration in zip(storyboard_project['storyboards'], durations):
+        if duration is None:
+            print(f"No audio for scene {scene['scene_number']}, skipping it")
+            continue
+        scenes.append(scene)
+        scene_durations.append(duration)
+
+    with tracing.span("video.render", renderer=video_config['renderer'], scenes=len(scenes)) as span:
+        if video_config['renderer'] == 'ffmpeg':
+            render_with_ffmpeg(scenes, scene_durations, render_file, video_config, captions_config)
+        elif video_config['renderer'] == 'segments':
+            render_with_segments(scenes, scene_durations, render_file, video_config, captions_config)
+        elif video_config['renderer'] == 'streaming':
+            render_with_streaming(scenes, scene_durations, render_file, video_config, captions_config)
         else:
-            clips.append(video_clip)
+            render_with_moviepy(scenes, scene_durations, render_file, video_config, captions_config)
 
-    final_clip = concatenate_videoclips(clips)
-    final_clip.write_videofile(output_file, fps=24)
+        peak = peak_rss_mb()
+        if peak is not None:
+            span.set(peak_rss_mb=peak["self"], peak_child_rss_mb=peak["children"])
+            print(f"Peak memory so far: {peak['self']:.0f} MB (largest encoder process {peak['children']:.0f} MB)")
 
-    add_subtitles(output_file, output_file.replace('.mp4', '_subtitle.mp4'))
+    if subtitles and not burn_in:
+        add_subtitles(output_file, subtitle_file)
+        return subtitle_file
+    return render_file
@@ -0,0 +1,217 @@
+import os
+import re
+import json
+import subprocess
+import numpy as np
+from typing import Any, Dict, List, Tuple
+import imageio_ffmpeg
+from utils import save_timestamped_subtitles
+
+SAMPLE_RATE = 16000
+
+
+def split_words(text: str) -> List[str]:
+    return re.findall(r"\S+", text)
+
+
+def weighted_word_timings(text: str, duration: float) -> List[Dict[str, Any]]:
+    """Spread a scene's words over its audio duration, weighted by word length."""
+    words = split_words(text)
+    if not words:
+        return []
+    # Punctuation adds a little weight for the pause that usually follows it
+    weights = np.array([len(word) + 1 + 2 * (word[-1] in ",.;:!?") for word in words], dtype=np.float64)
+    boundaries = np.concatenate([[0.0], np.cumsum(weights) / weights.sum() * duration])
+    return [
+        {"word": word, "start": float(boundaries[i]), "end": float(boundaries[i + 1])}
+        for i, word in enumerate(words)
+    ]
+
+
+def decode_audio(audio_file: str, sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """Decode an audio file to mono float32 samples in [-1, 1] with ffmpeg."""
+    result = subprocess.run(
+        [
+            imageio_ffmpeg.get_ffmpeg_exe(), "-loglevel", "error",
+            "-i", audio_file,
+            "-f", "s16le", "-acodec", "pcm_s16le", "-ac", "1", "-ar", str(sample_rate), "-",
+        ],
+        stdout=subprocess.PIPE,
+        check=True,
+    )
+    return np.frombuffer(result.stdout, dtype=np.int16).astype(np.float32) / 32768.0
+
+
+def _runs(mask: np.ndarray) -> List[Tuple[bool, int, int]]:
+    # (value, start, end) for each run of equal values
+    change = np.flatnonzero(np.diff(mask.astype(np.int8))) + 1
+    starts = np.concatenate([[0], change])
+    ends = np.concatenate([change, [len(mask)]])
+    return [(bool(mask[start]), int(start), int(end)) for start, end in zip(starts, ends)]
+
+
+def speech_segments(
+    samples: np.ndarray,
+    sample_rate: int = SAMPLE_RATE,
+    frame_ms: int = 20,
+    min_silence_ms: int = 120,
+    min_speech_ms: int = 60,
+) -> List[Tuple[float, float]]:
+    """Find voiced spans with an adaptive RMS energy threshold."""
+    hop = int(sample_rate * frame_ms / 1000)
+    frame_count = len(samples) // hop
+    if frame_count == 0:
+        return []
+
+    frames = samples[:frame_count * hop].reshape(frame_count, hop)
+    energy_db = 20 * np.log10(np.sqrt(np.mean(frames ** 2, axis=1)) + 1e-9)
+    noise_floor = np.percentile(energy_db, 10)
+    speech_level = np.percentile(energy_db, 95)
+    if speech_level - noise_floor < 6:
+        # No usable contrast (constant tone or silence): treat everything as speech
+        return [(0.0, frame_count * hop / sample_rate)]
+    voiced = energy_db > noise_floor + 0.3 * (speech_level - noise_floor)
+
+    # Bridge pauses too short to be a word boundary, then drop blips too short to be speech
+    min_silence = max(1, min_silence_ms // frame_ms)
+    min_speech = max(1, min_speech_ms // frame_ms)
+    for value, start, end in _runs(voiced):
+        if not value and 0 < start and end < frame_count and end - start < min_silence:
+            voiced[start:end] = True
+    for value, start, end in _runs(voiced):
+        if value and end - start < min_speech:
+            voiced[start:end] = False
+
+    frame_seconds = hop / sample_rate
+    return [
+        (start * frame_seconds, end * frame_seconds)
+        for value, start, end in _runs(voiced)
+        if value
+    ]
+
+
+def align_words(text: str, audio_file: str) -> List[Dict[str, Any]]:
+    """Estimate per-word start/end times for known text spoken in audio_file.
+
+    Words are distributed over the voiced spans only, weighted by their letter
+    count, so pauses in the speech become gaps between words instead of
+    stretching them. Runs locally with no transcription.
+    """
+    words = split_words(text)
+    if not words:
+        return []
+
+    samples = decode_audio(audio_file)
+    duration = len(samples) / SAMPLE_RATE
+    segments = speech_segments(samples)
+    if not segments:
+        return weighted_word_timings(text, duration)
+
+    segment_starts = np.array([start for start, _ in segments])
+    segment_lengths = np.array([end - start for start, end in segments])
+    segment_ends = np.cumsum(segment_lengths)
+    speech_duration = segment_ends[-1]
+
+    weights = np.array([len(re.sub(r"\W", "", word)) + 1 for word in words], dtype=np.float64)
+    boundaries = np.concatenate([[0.0], np.cumsum(weights) / weights.sum() * speech_duration])
+
+    # Pauses fall between words: snap the nearest word boundary onto each pause
+    if len(words) > 1:
+        for pause in segment_ends[:-1]:
+            nearest = int(np.argmin(np.abs(boundaries[1:-1] - pause))) + 1
+            boundaries[nearest] = pause
+        boundaries = np.maximum.accumulate(boundaries)
+
+    def to_audio_time(speech_time, side):
+        # Starts on a segment boundary belong to the next segment, ends to the previous one
+        index = np.searchsorted(segment_ends, speech_time, side="right" if side == "start" else "left")
+        index = np.minimum(index, len(segments) - 1)
+        segment_offsets = segment_ends - segment_lengths
+        return segment_starts[index] + (speech_time - segment_offsets[index])
+
+    starts = to_audio_time(boundaries[:-1], "start")
+    ends = to_audio_time(boundaries[1:], "end")
+    return [
+        {"word": word, "start": float(start), "end": float(end)}
+        for word, start, end in zip(words, starts, ends)
+    ]
+
+
+def scene_word_timings(scene: Dict[str, Any], duration: float, method: str = "energy") -> List[Dict[str, Any]]:
+    if method == "energy":
+        try:
+            return align_words(scene["subtitles"], scene["audio"])
+        except (OSError, subprocess.CalledProcessError) as e:
+            print(f"Failed to align words for scene {scene['scene_number']}, falling back to weighted timing: {e}")
+    return weighted_word_timings(scene["subtitles"], duration)
+
+
+def format_ass_time(seconds: float) -> str:
+    centiseconds = int(round(seconds * 100))
+    hours, centiseconds = divmod(centiseconds, 360000)
+    minutes, centiseconds = divmod(centiseconds, 6000)
+    seconds, centiseconds = divmod(centiseconds, 100)
+    return f"{hours}:{minutes:02d}:{seconds:02d}.{centiseconds:02d}"
+
+
+def save_ass(scene_words: List[List[Dict[str, Any]]], output_file: str) -> None:
+    # One karaoke line per scene; \k durations are in centiseconds
+    with open(output_file, "w", encoding="utf-8") as f:
+        f.write("[Script Info]\nScriptType: v4.00+\n\n")
+        f.write("[Events]\nFormat: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\n")
+        for words in scene_words:
+            if not words:
+                continue
+            parts = []
+            previous_end = words[0]["start"]
+            for word in words:
+                gap = int(round((word["start"] - previous_end) * 100))
+                if gap > 0:
+                    parts.append(f"{{\\k{gap}}}")
+                parts.append(f"{{\\k{int(round((word['end'] - word['start']) * 100))}}}{word['word']} ")
+                previous_end = word["end"]
+            f.write(
+                f"Dialogue: 0,{format_ass_time(words[0]['start'])},{format_ass_time(words[-1]['end'])},"
+                f"Default,,0,0,0,,{''.join(parts).rstrip()}\n"
+            )
+
+
+def write_timing_files(
+    scenes: List[Dict[str, Any]],
+    durations: List[float],
+    output_dir: str,
+    method: str = "energy",
+) -> Dict[str, str]:
+    """Align every scene and write word timings as JSON, SRT and ASS on the video timeline."""
+    scene_words = []
+    offset = 0.0
+    for scene, duration in zip(scenes, durations):
+        scene_words.append([
+            {"word": word["word"], "start": word["start"] + offset, "end": word["end"] + offset}
+            for word in scene_word_timings(scene, duration, method)
+        ])
+        offset += duration
+
+    paths = {
+        "json": os.path.join(output_dir, "word_timings.json"),
+        "srt": os.path.join(output_dir, "word_timings.srt"),
+        "ass": os.path.join(output_dir, "word_timings.ass"),
+    }
+    with open(paths["json"], "w", encoding="utf-8") as f:
+        json.dump(
+            [
+                {"scene_number": scene["scene_number"], "words": words}
+                for scene, words in zip(scenes, scene_words)
+            ],
+            f, ensure_ascii=False, indent=4,
+        )
+    save_timestamped_subtitles(
+        [
+            {"start_time": word["start"], "end_time": word["end"], "text": word["word"]}
+            for words in scene_words
+            for word in words
+        ],
+        paths["srt"],
+    )
+    save_ass(scene_words, paths["ass"])
+    return paths
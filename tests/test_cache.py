@@ -0,0 +1,80 @@
+import os
+
+from cache import DiskCache, make_cache_key
+
+
+def test_cache_key_ignores_dict_order():
+    assert make_cache_key({"a": 1, "b": 2}) == make_cache_key({"b": 2, "a": 1})
+    assert make_cache_key("tts", "hello") != make_cache_key("tts", "hello!")
+
+
+def test_get_and_put_count_hits_and_misses(tmp_path):
+    cache = DiskCache(str(tmp_path), 1024, ".bin")
+
+    assert cache.get("key") is None
+    cache.put("key", b"data")
+    assert cache.get("key") == b"data"
+    assert cache.get("other") is None
+
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_get_file_copies_the_entry(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache"), 1024, ".bin")
+    output_file = str(tmp_path / "out.bin")
+
+    assert not cache.get_file("key", output_file)
+    cache.put("key", b"data")
+    assert cache.get_file("key", output_file)
+
+    with open(output_file, "rb") as f:
+        assert f.read() == b"data"
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_evict_removes_least_recently_used_entry(tmp_path):
+    cache = DiskCache(str(tmp_path), 250, ".bin")
+    for age, key in enumerate(["new", "middle", "old"]):
+        cache.put(key, b"x" * 100)
+        # Set access times apart explicitly; file system mtimes can be too coarse to order them
+        os.utime(cache._path(key), (1000 - age * 100, 1000 - age * 100))
+    # A hit refreshes the oldest entry, so "middle" is now the least recently used
+    assert cache.get("old") is not None
+
+    cache.evict()
+
+    assert cache.get("middle") is None
+    assert cache.get("old") is not None
+    assert cache.get("new") is not None
+    assert cache.evictions == 1
+
+
+def test_put_evicts_once_the_cache_is_over_its_cap(tmp_path):
+    cache = DiskCache(str(tmp_path), 150, ".bin")
+    cache.put("first", b"x" * 100)
+    os.utime(cache._path("first"), (1000, 1000))
+
+    cache.put("second", b"x" * 100)
+
+    assert cache.get("first") is None
+    assert cache.get("second") is not None
+
+
+def test_stats(tmp_path):
+    cache = DiskCache(str(tmp_path), 1024, ".bin")
+    cache.put("a", b"x" * 10)
+    cache.put("b", b"x" * 20)
+    cache.get("a")
+    cache.get("missing")
+    # Temp files from interrupted writes are not entries
+    (tmp_path / "partial.tmp").write_bytes(b"x" * 50)
+
+    assert cache.stats() == {
+        "hits": 1,
+        "misses": 1,
+        "hit_rate": 0.5,
+        "evictions": 0,
+        "entries": 2,
+        "size_bytes": 30,
+        "max_size_bytes": 1024,
+    }
@@ -0,0 +1,122 @@
+import copy
+import json
+import os
+import threading
+import contextvars
+
+import pytest
+
+from utils import ConfigError, config_overrides, load_config, validate_config
+
+
+def invalid(config, overrides=False):
+    with pytest.raises(ConfigError) as error:
+        validate_config(config, overrides=overrides)
+    return str(error.value)
+
+
+def test_shipped_config_is_valid():
+    validate_config(load_config())
+
+
+def test_bool_in_a_non_bool_setting_reports_the_expected_type():
+    config = copy.deepcopy(load_config())
+    config["video"]["renderer"] = True
+    config["video"]["fps"] = False
+
+    message = invalid(config)
+
+    assert "video.renderer: expected str, got True" in message
+    assert "video.fps: expected int, got False" in message
+
+
+def test_every_problem_is_listed():
+    config = copy.deepcopy(load_config())
+    del config["video"]["fps"]
+    config["cache"]["images"]["max_size_mb"] = "big"
+    config["video"]["renderer"] = "opengl"
+
+    message = invalid(config)
+
+    assert "video.fps: missing" in message
+    assert "cache.images.max_size_mb: expected a number, got 'big'" in message
+    assert "video.renderer: expected one of" in message
+
+
+def test_char_limits_must_be_ordered():
+    config = copy.deepcopy(load_config())
+    config["story_generation"]["char_limit_min"] = config["story_generation"]["char_limit_max"] + 1
+
+    assert "char_limit_min: greater than char_limit_max" in invalid(config)
+
+
+def test_overrides_may_be_partial_but_not_unknown_or_process_wide():
+    validate_config({"video": {"fps": 30}}, overrides=True)
+
+    assert "video.fsp: unknown setting" in invalid({"video": {"fsp": 30}}, overrides=True)
+    assert "cache: cannot be overridden per job" in invalid({"cache": {}}, overrides=True)
+
+
+def test_config_overrides_nest_and_restore():
+    base_fps = load_config()["video"]["fps"]
+    base_crf = load_config()["video"]["ffmpeg"]["crf"]
+
+    with config_overrides({"video": {"fps": 30}}):
+        with config_overrides({"video": {"ffmpeg": {"crf": 30}}}):
+            inner = load_config()
+            # The inner override merges over the outer one, not over config.json
+            assert inner["video"]["fps"] == 30
+            assert inner["video"]["ffmpeg"]["crf"] == 30
+            assert inner["video"]["ffmpeg"]["preset"] == load_config("config.json")["video"]["ffmpeg"]["preset"]
+        assert load_config()["video"]["fps"] == 30
+        assert load_config()["video"]["ffmpeg"]["crf"] == base_crf
+    assert load_config()["video"]["fps"] == base_fps
+
+
+def test_config_overrides_reach_threads_started_in_a_copied_context():
+    seen = {}
+    with config_overrides({"video": {"fps": 30}}):
+        thread = threading.Thread(
+            target=contextvars.copy_context().run, args=(lambda: seen.update(fps=load_config()["video"]["fps"]),)
+        )
+        thread.start()
+        thread.join()
+    assert seen["fps"] == 30
+
+
+def test_invalid_overrides_are_rejected_before_they_apply():
+    with pytest.raises(ConfigError):
+        with config_overrides({"video": {"fps": "fast"}}):
+            pass
+    assert load_config()["video"]["fps"] != "fast"
+
+
+def test_load_config_reparses_only_when_the_file_changes(tmp_path):
+    config_file = str(tmp_path / "config.json")
+    config = copy.deepcopy(load_config())
+    with open(config_file, "w") as f:
+        json.dump(config, f)
+    os.utime(config_file, ns=(1_000_000_000, 1_000_000_000))
+
+    first = load_config(config_file)
+    assert load_config(config_file) is first
+
+    config["video"]["fps"] = 30
+    with open(config_file, "w") as f:
+        json.dump(config, f)
+    os.utime(config_file, ns=(2_000_000_000, 2_000_000_000))
+
+    reloaded = load_config(config_file)
+    assert reloaded is not first
+    assert reloaded["video"]["fps"] == 30
+
+
+def test_load_config_rejects_an_invalid_file(tmp_path):
+    config_file = str(tmp_path / "config.json")
+    config = copy.deepcopy(load_config())
+    config["video"]["fps"] = True
+    with open(config_file, "w") as f:
+        json.dump(config, f)
+
+    with pytest.raises(ConfigError, match="video.fps: expected int"):
+        load_config(config_file)
@@ -0,0 +1,184 @@
+import io
+import os
+import re
+import subprocess
+
+import numpy as np
+import pytest
+
+from ffmpeg_renderer import (
+    HELD_RUN_FRAMES,
+    caption_runs,
+    end_runs,
+    get_ffmpeg_exe,
+    hold_args,
+    render_scene_segment,
+    scene_runs,
+    write_runs,
+)
+from utils import config_overrides, load_config
+
+HOLD = {"hold_static_frames": True}
+
+
+def total(runs):
+    return sum(length for length, _ in runs)
+
+
+def check_runs(runs):
+    for length, sent in runs:
+        assert 1 <= sent <= length
+
+
+def hold_timestamps(runs, fps=24):
+    """Evaluate hold_args()' setpts expression for every frame write_runs() sends, in frames."""
+    args = hold_args(runs, fps)
+    sent_frames = sum(sent for _, sent in runs)
+    if not args:
+        return list(range(sent_frames))
+    expression = args[args.index("-vf") + 1]
+    terms = [(int(skip), int(after)) for skip, after in re.findall(r"\+(\d+)\*gte\(N\\,(\d+)\)", expression)]
+    return [n + sum(skip for skip, after in terms if n >= after) for n in range(sent_frames)]
+
+
+def expected_timestamps(runs):
+    # Each run's frames are sent at its start and the last one is held to the next run
+    timestamps = []
+    start = 0
+    for length, sent in runs:
+        timestamps.extend(range(start, start + sent))
+        start += length
+    return timestamps
+
+
+class FakeCaptions:
+    """Caption track that changes at the given frame indices."""
+
+    def __init__(self, changes, fps=24):
+        self.changes = changes
+        self.fps = fps
+
+    def active(self, t):
+        index = int(round(t * self.fps))
+        return sum(change <= index for change in self.changes)
+
+
+@pytest.mark.parametrize("transition_type", ["none", "zoom-in", "zoom-out"])
+@pytest.mark.parametrize("lead_in, lead_out", [(0, 0), (6, 0), (0, 5), (6, 6), (40, 40)])
+def test_scene_runs_cover_every_frame(transition_type, lead_in, lead_out):
+    runs = scene_runs({"transition_type": transition_type}, 80, lead_in, lead_out, HOLD)
+
+    assert total(runs) == 80
+    check_runs(runs)
+    if transition_type == "none" and lead_in + lead_out < 78:
+        assert runs[lead_in] == (80 - lead_in - lead_out, HELD_RUN_FRAMES)
+    else:
+        assert runs == [(1, 1)] * 80
+
+
+def test_scene_runs_without_holding_are_single_frames():
+    runs = scene_runs({"transition_type": "none"}, 50, 0, 0, {"hold_static_frames": False})
+
+    assert runs == [(1, 1)] * 50
+
+
+def test_caption_runs_split_where_the_caption_changes():
+    runs = [(1, 1)] * 4 + [(100, HELD_RUN_FRAMES)] + [(1, 1)] * 4
+
+    split = caption_runs(runs, FakeCaptions([30, 31, 70]), 0, 24)
+
+    assert total(split) == total(runs)
+    check_runs(split)
+    assert split[4:8] == [(26, HELD_RUN_FRAMES), (1, 1), (39, 1), (34, 1)]
+
+
+def test_caption_runs_start_at_first_frame():
+    split = caption_runs([(50, HELD_RUN_FRAMES)], FakeCaptions([120]), 100, 24)
+
+    assert split == [(20, HELD_RUN_FRAMES), (30, 1)]
+
+
+@pytest.mark.parametrize("runs", [
+    [(200, HELD_RUN_FRAMES)],
+    [(1, 1)] * 6 + [(200, HELD_RUN_FRAMES)],
+    [(5, 1), (3, 1), (2, 1), (90, HELD_RUN_FRAMES), (4, 1)],
+    [(1, 1)] * 30,
+    [(7, 1)],
+])
+def test_end_runs_send_the_last_frames_back_to_back(runs):
+    ended = end_runs(runs)
+
+    assert total(ended) == total(runs)
+    check_runs(ended)
+    tail = 0
+    for length, sent in reversed(ended):
+        if tail >= HELD_RUN_FRAMES:
+            break
+        assert sent == length
+        tail += length
+
+
+def test_still_run_ending_in_a_transition_stays_held():
+    # A still followed by a lead-out shorter than HELD_RUN_FRAMES used to be sent whole
+    runs = scene_runs({"transition_type": "none"}, 120, 0, 5, HOLD)
+
+    ended = end_runs(runs)
+
+    assert total(ended) == 120
+    assert ended == [(108, HELD_RUN_FRAMES), (7, 7)] + [(1, 1)] * 5
+    assert sum(sent for _, sent in ended) == HELD_RUN_FRAMES + HELD_RUN_FRAMES
+
+
+def test_hold_args_place_every_sent_frame_at_its_run():
+    runs = end_runs(
+        caption_runs(scene_runs({"transition_type": "none"}, 240, 6, 5, HOLD), FakeCaptions([50, 130]), 0, 24)
+    )
+
+    assert total(runs) == 240
+    assert hold_timestamps(runs) == expected_timestamps(runs)
+
+
+def test_hold_args_are_empty_when_nothing_is_held():
+    assert hold_args([(1, 1)] * 10, 24) == []
+
+
+def test_write_runs_sends_each_run_start_as_planned():
+    runs = [(3, 2), (1, 1), (4, 1)]
+    frames = [np.full((2, 2, 3), i, dtype=np.uint8) for i in range(total(runs))]
+    composed = []
+
+    def compose(frame, index):
+        composed.append(index)
+        return frame
+
+    out = io.BytesIO()
+    write_runs(out, frames, runs, compose)
+
+    written = np.frombuffer(out.getvalue(), dtype=np.uint8).reshape(-1, 12)[:, 0]
+    assert list(written) == [0, 0, 3, 4]
+    assert composed == [0, 3, 4]
+
+
+def decoded_frame_count(video_file, fps):
+    result = subprocess.run(
+        [get_ffmpeg_exe(), "-i", video_file, "-map", "0:v", "-vf", f"fps={fps}", "-f", "null", "-"],
+        capture_output=True, text=True, check=True,
+    )
+    return int(re.findall(r"frame=\s*(\d+)", result.stderr)[-1])
+
+
+def test_held_segment_ending_in_a_transition_decodes_to_every_frame(tmp_path):
+    from benchmark import create_test_scenes
+
+    scenes = create_test_scenes(str(tmp_path), 2, 3.0, width=96, height=160)
+    scene, following = scenes[0], scenes[1]
+    scene["transition_type"] = "none"
+    following["scene_transition"] = "crossfade"
+    segment_file = str(tmp_path / "segment.mp4")
+    with config_overrides({"video": {"scene_transition": "storyboard", "hold_static_frames": True}}):
+        video_config = load_config()["video"]
+        fps = video_config["fps"]
+        render_scene_segment(scene, 3.0, 3 * fps, segment_file, (96, 160), video_config, following=(following, 3.0, 3 * fps))
+
+    assert os.path.exists(segment_file)
+    assert decoded_frame_count(segment_file, fps) == 3 * fps
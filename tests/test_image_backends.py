@@ -0,0 +1,111 @@
+import os
+
+import pytest
+
+import cache
+import image_backends
+from image_backends import BatchingImageBackend, ImageBackend, get_image_backend, variant_file
+from image_generator import generate_and_download_images
+from utils import config_overrides
+
+
+@pytest.fixture(autouse=True)
+def no_image_cache(monkeypatch):
+    monkeypatch.setitem(cache._caches, "images", None)
+
+
+def test_backends_must_implement_their_abstract_methods():
+    class NoCall(ImageBackend):
+        pass
+
+    class NoCollect(BatchingImageBackend):
+        def __call__(self, prompt, output_file=None):
+            return output_file
+
+        def submit(self, prompt):
+            return prompt
+
+    with pytest.raises(TypeError):
+        NoCall({})
+    with pytest.raises(TypeError):
+        NoCollect({})
+
+
+def test_only_batching_backends_submit_and_collect():
+    assert issubclass(image_backends.ReplicateBackend, BatchingImageBackend)
+    assert issubclass(image_backends.FalBackend, BatchingImageBackend)
+    assert not issubclass(image_backends.LocalStubBackend, BatchingImageBackend)
+
+
+def test_local_stub_batches_through_the_image_generator(tmp_path):
+    storyboard_project = {
+        "characters": [],
+        "storyboards": [{"scene_number": i + 1, "description": f"scene {i + 1}"} for i in range(5)],
+    }
+    overrides = {
+        "image_generation": {"batch_size": 2},
+        "local_stub": {"latency_seconds": 0, "latency_jitter_seconds": 0.0, "width": 64, "height": 96, "num_images": 2},
+    }
+    with config_overrides(overrides):
+        image_files = generate_and_download_images(
+            storyboard_project, str(tmp_path), "cinematic", get_image_backend("local_stub")
+        )
+
+    expected = [str(tmp_path / f"scene_{i + 1}.png") for i in range(5)]
+    assert image_files == expected
+    for image_file in expected:
+        assert os.path.exists(image_file)
+        assert os.path.exists(variant_file(image_file, 1))
+
+
+class FakeBatchingBackend(BatchingImageBackend):
+    name = "fake"
+    provider = "fal"
+
+    def __init__(self, failing_prompts=()):
+        super().__init__({})
+        self.failing_prompts = set(failing_prompts)
+        self.events = []
+
+    def __call__(self, prompt, output_file=None):
+        self.events.append(("single", prompt))
+        with open(output_file, "wb") as f:
+            f.write(b"single")
+        return output_file
+
+    def submit(self, prompt):
+        self.events.append(("submit", prompt))
+        return prompt
+
+    def collect(self, handle):
+        self.events.append(("collect", handle))
+        if handle in self.failing_prompts:
+            raise RuntimeError("prediction failed")
+        return [f"https://images.test/{handle}/{i}.png" for i in range(2)]
+
+
+def test_generate_batch_submits_everything_first_and_retries_failures_alone(tmp_path, monkeypatch):
+    downloads = []
+
+    def fake_download(url, output_file):
+        downloads.append((url, output_file))
+        with open(output_file, "wb") as f:
+            f.write(url.encode())
+        return output_file
+
+    monkeypatch.setattr(image_backends, "fetch_image", lambda url, cache_key, output_file: fake_download(url, output_file))
+    monkeypatch.setattr(image_backends, "download_to_file", fake_download)
+    backend = FakeBatchingBackend(failing_prompts={"b"})
+    output_files = [str(tmp_path / f"{prompt}.png") for prompt in "abc"]
+
+    results = backend.generate_batch(list("abc"), output_files)
+
+    kinds = [kind for kind, _ in backend.events]
+    assert kinds[:3] == ["submit"] * 3
+    assert ("single", "b") in backend.events
+    assert results == [
+        [output_files[0], variant_file(output_files[0], 1)],
+        [output_files[1]],
+        [output_files[2], variant_file(output_files[2], 1)],
+    ]
+    assert len(downloads) == 4
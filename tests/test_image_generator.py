@@ -0,0 +1,50 @@
+import threading
+import time
+
+from image_generator import generate_and_download_images
+
+FAILING_SCENES = {1, 3, 4, 6}
+
+
+class OutOfOrderImages:
+    """Image function whose later scenes finish first; scenes in FAILING_SCENES fail."""
+
+    def __init__(self, scene_count):
+        self.scene_count = scene_count
+        self.finished = []
+        self._lock = threading.Lock()
+
+    def __call__(self, prompt, output_file=None):
+        scene_number = int(prompt.split()[1])
+        time.sleep(0.05 * (self.scene_count - scene_number))
+        with self._lock:
+            self.finished.append(scene_number)
+        if scene_number in FAILING_SCENES:
+            if scene_number == 4:
+                raise RuntimeError("generation failed")
+            return None
+        with open(output_file, "wb") as f:
+            f.write(b"image")
+        return output_file
+
+
+def test_fallback_images_resolve_in_scene_order(tmp_path):
+    scene_count = 7
+    storyboard_project = {
+        "characters": [],
+        "storyboards": [{"scene_number": i + 1, "description": f"scene {i + 1}"} for i in range(scene_count)],
+    }
+    image_func = OutOfOrderImages(scene_count)
+
+    image_files = generate_and_download_images(
+        storyboard_project, str(tmp_path), "cinematic", image_func, max_workers=scene_count
+    )
+
+    # The pool finished the scenes in reverse, but each failed scene falls back to the scene before it
+    assert image_func.finished[0] == scene_count
+    assert image_func.finished[-1] == 1
+    expected_scenes = [1, 2, 2, 2, 5, 5, 7]
+    assert image_files == [str(tmp_path / f"scene_{number}.png") for number in expected_scenes]
+    assert [storyboard["image"] for storyboard in storyboard_project["storyboards"]] == image_files
+    # The first scene has nothing to fall back to, so it gets a blank image
+    assert (tmp_path / "scene_1.png").stat().st_size > 0
@@ -0,0 +1,90 @@
+import os
+
+import pytest
+
+import cache
+import main
+from main import run_pipeline
+from manifest import Manifest, hash_inputs
+from offline import OfflineOpenAIClient
+from utils import config_overrides
+
+
+def test_stage_is_fresh_only_for_matching_inputs_and_existing_outputs(tmp_path):
+    story_dir = str(tmp_path)
+    output_file = tmp_path / "story_english.txt"
+    output_file.write_text("story")
+    inputs = hash_inputs("scary", None, {"model": "gpt-4o"})
+
+    manifest = Manifest(story_dir)
+    assert not manifest.is_fresh("story", inputs)
+    manifest.record("story", inputs, [str(output_file)], words=1)
+
+    # A reloaded manifest sees the same stage
+    reloaded = Manifest(story_dir)
+    assert reloaded.is_fresh("story", inputs)
+    assert reloaded.get("story")["outputs"] == ["story_english.txt"]
+    assert reloaded.get("story")["data"] == {"words": 1}
+    assert not reloaded.is_fresh("story", hash_inputs("scary", None, {"model": "gpt-4o-mini"}))
+
+    output_file.unlink()
+    assert not reloaded.is_fresh("story", inputs)
+
+
+class _CountingClient(OfflineOpenAIClient):
+    """Offline client that counts chat prompts by the stage that sent them."""
+
+    def __init__(self):
+        super().__init__(chat_latency=0, tts_latency=0, scene_count=2)
+        self.prompts = []
+        completions = self.chat.completions
+        create = completions.create
+
+        def counting_create(messages=None, **kwargs):
+            self.prompts.append(messages[-1]["content"])
+            return create(messages=messages, **kwargs)
+
+        completions.create = counting_create
+
+    def storyboard_requests(self):
+        return sum('"storyboards"' in prompt for prompt in self.prompts)
+
+
+@pytest.fixture
+def offline_pipeline(monkeypatch):
+    # Bypass the shared on-disk caches so every stage does its own work
+    monkeypatch.setitem(cache._caches, "images", None)
+    monkeypatch.setitem(cache._caches, "tts", None)
+    overrides = {
+        "image_generation": {"backend": "local_stub"},
+        "local_stub": {"latency_seconds": 0, "latency_jitter_seconds": 0.0},
+        "captions": {"engine": "native"},
+        "pipeline": {"streaming": False},
+        "video": {"renderer": "ffmpeg"},
+    }
+    with config_overrides(overrides):
+        yield
+
+
+def test_resume_skips_unchanged_stages_and_reruns_changed_ones(tmp_path, offline_pipeline, monkeypatch):
+    story_dir = str(tmp_path)
+    client = _CountingClient()
+    monkeypatch.setattr(main, "get_openai_client", lambda: client)
+    outputs = run_pipeline("Scary", "cinematic", "alloy", story_dir=story_dir, client=client)
+    assert outputs is not None
+    assert set(outputs["timings"]) >= {"story", "storyboard", "images", "audio", "word_timings", "video"}
+    first_requests = len(client.prompts)
+    assert client.storyboard_requests() == 1
+
+    # --resume reads the run's parameters from the manifest; with the same inputs every stage is reused
+    video_file = os.path.join(story_dir, "story_video_subtitle.mp4")
+    client.prompts.clear()
+    main.main(["--resume", story_dir])
+    assert client.prompts == []
+    assert os.path.exists(video_file)
+
+    # The storyboard settings feed only the storyboard's inputs hash, so only that request is sent again
+    with config_overrides({"storyboard": {"max_scenes": 3}}):
+        assert run_pipeline("Scary", "cinematic", "alloy", story_dir=story_dir, client=client) is not None
+    assert client.storyboard_requests() == 1
+    assert len(client.prompts) == 1 < first_requests
@@ -0,0 +1,147 @@
+import os
+import threading
+import contextvars
+
+import pytest
+
+import cache
+import concurrency
+import pipeline
+import rate_limiter
+from concurrency import configure_stage_limits
+from image_backends import get_image_backend
+from offline import OfflineOpenAIClient
+from utils import config_overrides, load_config
+
+SCENES = 6
+
+
+class StageFailure(Exception):
+    pass
+
+
+def storyboard_project(story_dir):
+    return {
+        "characters": [],
+        "storyboards": [
+            {
+                "scene_number": i + 1,
+                "description": f"scene {i + 1}",
+                "subtitles": "The lamp was glowing again tonight.",
+                "transition_type": "none",
+                "scene_transition": "crossfade",
+                "audio": os.path.join(story_dir, "audio", f"scene_{i + 1}.mp3"),
+            }
+            for i in range(SCENES)
+        ],
+    }
+
+
+@pytest.fixture
+def streaming(monkeypatch):
+    monkeypatch.setitem(cache._caches, "images", None)
+    monkeypatch.setitem(cache._caches, "tts", None)
+    # The shared speech quota would otherwise pace every test after the first
+    unlimited = {"requests_per_minute": 0, "burst": 1}
+    monkeypatch.setitem(
+        rate_limiter._limiters, "openai_tts",
+        rate_limiter.ProviderLimiter("openai_tts", unlimited, load_config()["rate_limits"]["retry"]),
+    )
+    overrides = {
+        "local_stub": {"latency_seconds": 0, "latency_jitter_seconds": 0.0, "width": 64, "height": 96},
+        "pipeline": {"queue_size": 1},
+        "video": {"segment_workers": 2, "scene_transition": "storyboard"},
+    }
+    configure_stage_limits({"render": 1})
+    try:
+        with config_overrides(overrides):
+            yield
+    finally:
+        configure_stage_limits({})
+
+
+def run(story_dir):
+    """Run the streaming pipeline in a thread and return what it raised, failing if it never finishes."""
+    outcome = {}
+
+    def target():
+        try:
+            outcome["result"] = pipeline.run_streaming_pipeline(
+                OfflineOpenAIClient(chat_latency=0, tts_latency=0),
+                storyboard_project(story_dir),
+                story_dir,
+                "cinematic",
+                get_image_backend("local_stub"),
+                "alloy",
+                os.path.join(story_dir, "story_video.mp4"),
+            )
+        except Exception as e:
+            outcome["error"] = e
+
+    threads_before = set(threading.enumerate())
+    # A copy of this context carries the fixture's config overrides into the thread
+    thread = threading.Thread(target=contextvars.copy_context().run, args=(target,), daemon=True)
+    thread.start()
+    thread.join(120)
+    assert not thread.is_alive(), "streaming pipeline deadlocked"
+    # Every stage thread has been joined
+    assert set(threading.enumerate()) <= threads_before
+    # The render slot taken for each segment encode was given back
+    render_slot = concurrency._stage_semaphores["render"]
+    assert render_slot.acquire(blocking=False)
+    render_slot.release()
+    return outcome
+
+
+def test_streaming_pipeline_renders_every_scene(tmp_path, streaming):
+    outcome = run(str(tmp_path))
+
+    assert "error" not in outcome
+    image_files, durations = outcome["result"]
+    assert len(image_files) == SCENES
+    assert all(duration for duration in durations)
+    assert os.path.exists(tmp_path / "story_video.mp4")
+
+
+def test_image_stage_error_reaches_the_caller(tmp_path, streaming, monkeypatch):
+    def fail(*args):
+        raise StageFailure("image stage failed")
+
+    # generate_image errors are handled per scene; the blank first-scene fallback is not
+    monkeypatch.setattr(pipeline, "generate_image", lambda *args: False)
+    monkeypatch.setattr(pipeline, "create_blank_image", fail)
+
+    assert isinstance(run(str(tmp_path)).get("error"), StageFailure)
+
+
+def test_audio_stage_error_reaches_the_caller(tmp_path, streaming, monkeypatch):
+    generate_audio = pipeline.generate_audio
+
+    def fail_scene_2(client, text, output_file, voice_name):
+        if output_file.endswith("scene_2.mp3"):
+            raise StageFailure("audio stage failed")
+        return generate_audio(client, text, output_file, voice_name)
+
+    monkeypatch.setattr(pipeline, "generate_audio", fail_scene_2)
+
+    assert isinstance(run(str(tmp_path)).get("error"), StageFailure)
+
+
+def test_render_stage_error_reaches_the_caller(tmp_path, streaming, monkeypatch):
+    def fail(*args, **kwargs):
+        raise StageFailure("render stage failed")
+
+    monkeypatch.setattr(pipeline, "prepare_segment", fail)
+
+    assert isinstance(run(str(tmp_path)).get("error"), StageFailure)
+
+
+def test_segment_encode_error_reaches_the_caller(tmp_path, streaming, monkeypatch):
+    # Pool workers are forked after the patch, so they encode with it too
+    monkeypatch.setattr(pipeline, "render_scene_segment", failing_encode)
+
+    assert isinstance(run(str(tmp_path)).get("error"), StageFailure)
+
+
+def failing_encode(*args, **kwargs):
+    raise StageFailure("segment encode failed")
@@ -0,0 +1,159 @@
+import types
+from email.utils import format_datetime
+from datetime import datetime, timezone
+
+import pytest
+
+import rate_limiter
+from rate_limiter import ProviderLimiter, TokenBucket, get_retry_after, is_retryable
+
+RETRY_CONFIG = {"max_retries": 4, "base_delay": 1.0, "max_delay": 10.0}
+
+
+class FakeClock:
+    """Stands in for the time module; sleep() advances the clock instead of blocking."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter, "time", clock)
+    return clock
+
+
+class ApiError(Exception):
+    def __init__(self, status_code, headers=None, message="request failed"):
+        super().__init__(message)
+        self.status_code = status_code
+        self.response = types.SimpleNamespace(status_code=status_code, headers=headers or {})
+
+
+def failing(*errors, result="ok"):
+    """Return a function that raises each error in turn, then returns result."""
+    calls = []
+
+    def func():
+        calls.append(len(calls))
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+
+    func.calls = calls
+    return func
+
+
+def test_retry_after_sources(clock):
+    assert get_retry_after(ApiError(429, {"retry-after-ms": "1500"})) == 1.5
+    assert get_retry_after(ApiError(429, {"retry-after": "7"})) == 7.0
+    http_date = format_datetime(datetime.fromtimestamp(clock.now + 30, tz=timezone.utc), usegmt=True)
+    assert get_retry_after(ApiError(429, {"retry-after": http_date})) == pytest.approx(30)
+    assert get_retry_after(Exception("Request was throttled. Your rate limit resets in ~12s.")) == 13.0
+    assert get_retry_after(ApiError(429, {"retry-after": "soon"})) is None
+    assert get_retry_after(ApiError(500)) is None
+
+
+def test_token_bucket_waits_once_the_burst_is_spent(clock):
+    bucket = TokenBucket(requests_per_minute=60, burst=2)
+
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == pytest.approx(1.0)
+
+
+def test_token_bucket_pause_and_throttle(clock):
+    bucket = TokenBucket(requests_per_minute=60, burst=5)
+
+    bucket.throttled()
+    bucket.pause(4)
+    assert bucket.rate == pytest.approx(0.5)
+    # The pause drains the bucket; it refills at the halved rate, one token every 2 seconds
+    assert bucket.acquire() == pytest.approx(4)
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == pytest.approx(2)
+
+    for _ in range(20):
+        bucket.throttled()
+    assert bucket.rate == pytest.approx(bucket.max_rate / 10)
+    for _ in range(40):
+        bucket.succeeded()
+    assert bucket.rate == pytest.approx(bucket.max_rate)
+
+
+def test_429_waits_for_retry_after_and_slows_the_bucket(clock):
+    limiter = ProviderLimiter("test", {"requests_per_minute": 600, "burst": 5}, RETRY_CONFIG)
+    func = failing(ApiError(429, {"retry-after": "3"}))
+
+    assert limiter.call(func) == "ok"
+
+    assert len(func.calls) == 2
+    assert clock.sleeps[0] == 3.0
+    assert limiter.bucket.rate < limiter.bucket.max_rate
+    assert limiter.metrics["throttled"] == 1
+    assert limiter.metrics["retries"] == 1
+    assert limiter.metrics["backoff_seconds"] == 3.0
+
+
+def test_retry_after_is_capped_at_max_delay(clock):
+    limiter = ProviderLimiter("test", {"requests_per_minute": 0, "burst": 1}, RETRY_CONFIG)
+
+    limiter.call(failing(ApiError(429, {"retry-after": "3600"})))
+
+    assert clock.sleeps == [RETRY_CONFIG["max_delay"]]
+
+
+@pytest.mark.parametrize("status_code", [400, 401, 402, 403, 404, 422])
+def test_fatal_status_codes_are_not_retried(clock, status_code):
+    limiter = ProviderLimiter("test", {"requests_per_minute": 0, "burst": 1}, RETRY_CONFIG)
+    func = failing(ApiError(status_code))
+
+    with pytest.raises(ApiError):
+        limiter.call(func)
+
+    assert len(func.calls) == 1
+    assert clock.sleeps == []
+    assert limiter.metrics["failures"] == 1
+    assert not is_retryable(ApiError(status_code))
+
+
+def test_fatal_messages_are_not_retried(clock):
+    assert not is_retryable(Exception("Insufficient credit to run this model"))
+    assert is_retryable(ApiError(500))
+    assert is_retryable(ApiError(429))
+
+
+def test_last_error_is_raised_once_attempts_run_out(clock):
+    limiter = ProviderLimiter("test", {"requests_per_minute": 0, "burst": 1}, RETRY_CONFIG)
+    errors = [ApiError(500, message=f"attempt {i}") for i in range(3)]
+    func = failing(*errors)
+
+    with pytest.raises(ApiError, match="attempt 2"):
+        limiter.call(func, max_retries=3)
+
+    assert len(func.calls) == 3
+    assert len(clock.sleeps) == 2
+    assert limiter.metrics["retries"] == 2
+
+
+def test_backoff_bounds(monkeypatch):
+    limiter = ProviderLimiter("test", {"requests_per_minute": 0, "burst": 1}, RETRY_CONFIG)
+    bounds = []
+    monkeypatch.setattr(rate_limiter.random, "uniform", lambda low, high: bounds.append((low, high)) or high)
+
+    delays = [limiter.backoff(attempt) for attempt in range(6)]
+
+    assert delays == [1.0, 2.0, 4.0, 8.0, 10.0, 10.0]
+    assert all(low == 0 for low, _ in bounds)
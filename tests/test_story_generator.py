@@ -0,0 +1,30 @@
+import types
+import unittest
+
+from story_generator import generate_storyboard
+
+
+class _NonJsonCompletions:
+    def __init__(self):
+        self.calls = 0
+
+    def create(self, **kwargs):
+        self.calls += 1
+        message = types.SimpleNamespace(content="Sorry, I can't help with that.")
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+
+class GenerateStoryboardTest(unittest.TestCase):
+    def test_exhausted_attempts_return_empty_storyboard(self):
+        completions = _NonJsonCompletions()
+        client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=completions))
+
+        storyboard = generate_storyboard(client, "The Lamp", "Anna found a lamp.", "general", ["Anna Price"])
+
+        self.assertGreater(completions.calls, 0)
+        self.assertEqual(storyboard["project_info"]["title"], "The Lamp")
+        self.assertEqual(storyboard["storyboards"], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
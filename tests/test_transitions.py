@@ -0,0 +1,105 @@
+import types
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+from transitions import EffectChain, FrameEffect, Shake, Zoom, shake, zoom
+
+POSITIONS = ["center", "left", "right", "top", "topleft", "topright", "bottom", "bottomleft", "bottomright", "bogus"]
+
+
+def reference_shake(frame, t, effect_duration=1, max_offset=5):
+    # The per-frame shake before effects were chained: paste onto a new black PIL image
+    if t >= effect_duration:
+        return frame
+    dx = np.random.randint(-max_offset, max_offset + 1)
+    dy = np.random.randint(-max_offset, max_offset + 1)
+    pil_image = Image.fromarray(frame)
+    result = Image.new("RGB", pil_image.size, (0, 0, 0))
+    result.paste(pil_image, (dx, dy))
+    return np.array(result)
+
+
+def reference_zoom(frame, t, duration, fps, mode="in", position="center", speed=3):
+    # The per-frame zoom before effects were chained: a fresh warpAffine output per frame
+    total_frames = max(1, int(duration * fps))
+    h, w = frame.shape[:2]
+    i = t * fps
+    if mode == "out":
+        i = total_frames - i
+    scale = 1 + (i * ((0.1 * speed) / total_frames))
+    scale *= max(w / (w - 2), h / (h - 2))
+    dw = w - (w / scale)
+    dh = h - (h / scale)
+    offsets = {
+        "left": (0, dh / 2), "right": (dw, dh / 2), "top": (dw / 2, 0), "topleft": (0, 0),
+        "topright": (dw, 0), "bottom": (dw / 2, dh), "bottomleft": (0, dh), "bottomright": (dw, dh),
+    }
+    tx, ty = offsets.get(position, (dw / 2, dh / 2))
+    M = np.array([[scale, 0, -tx * scale], [0, scale, -ty * scale]])
+    return cv2.warpAffine(frame, M, (w, h))
+
+
+@pytest.fixture
+def frame():
+    return np.random.default_rng(1).integers(0, 256, (128, 72, 3), dtype=np.uint8)
+
+
+def fake_clip(frame, duration=5, fps=24):
+    # Just enough of a moviepy clip for shake() and zoom(): fl() wraps get_frame
+    clip = types.SimpleNamespace(duration=duration, fps=fps)
+    clip.fl = lambda effect: types.SimpleNamespace(get_frame=lambda t: effect(lambda t: frame, t))
+    return clip
+
+
+def test_frame_effects_must_implement_apply():
+    class Noop(FrameEffect):
+        pass
+
+    with pytest.raises(TypeError):
+        Noop()
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_shake_matches_the_per_frame_shake(frame, seed):
+    np.random.seed(seed)
+    expected = reference_shake(frame, 0.5)
+    np.random.seed(seed)
+    actual = shake(fake_clip(frame)).get_frame(0.5)
+
+    assert np.array_equal(actual, expected)
+
+
+def test_shake_leaves_frames_after_its_duration_alone(frame):
+    assert shake(fake_clip(frame), effect_duration=1).get_frame(2) is frame
+
+
+@pytest.mark.parametrize("mode", ["in", "out"])
+@pytest.mark.parametrize("position", POSITIONS)
+def test_zoom_matches_the_per_frame_zoom(frame, mode, position):
+    clip = zoom(fake_clip(frame), mode, position)
+    for t in (0, 1.3, 4.99):
+        assert np.array_equal(clip.get_frame(t), reference_zoom(frame, t, 5, 24, mode, position))
+
+
+def test_chain_matches_nested_per_frame_effects(frame):
+    chain = EffectChain(Shake(1, 5)).then(Zoom(5, 24, "out", "topright"))
+    for seed, t in enumerate((0.2, 0.5, 0.9, 1.5)):
+        np.random.seed(seed)
+        expected = reference_zoom(reference_shake(frame, t), t, 5, 24, "out", "topright")
+        np.random.seed(seed)
+        actual = chain(frame, t)
+        assert np.array_equal(actual, expected)
+        # The input frame is never written to
+        assert actual is not frame
+
+
+def test_chain_reuses_its_buffers(frame):
+    chain = EffectChain(Shake(5, 5), Zoom(5, 24))
+    first = chain(frame, 0.5)
+    second = chain(frame, 1.0)
+
+    assert second is first
+    assert len(chain._buffers) == 2
@@ -0,0 +1,102 @@
+import wave
+
+import numpy as np
+import pytest
+
+from word_timing import SAMPLE_RATE, align_words, scene_word_timings, speech_segments, weighted_word_timings
+
+BURSTS = [(0.2, 0.8), (1.2, 2.0), (2.5, 3.0)]
+DURATION = 3.5
+# One analysis frame; segment edges are found to this resolution
+TOLERANCE = 0.02
+
+
+def synthetic_speech(bursts, duration, sample_rate=SAMPLE_RATE):
+    """Tone bursts over faint noise, standing in for words separated by pauses."""
+    rng = np.random.default_rng(0)
+    t = np.arange(int(duration * sample_rate)) / sample_rate
+    samples = rng.normal(0, 0.002, len(t))
+    for start, end in bursts:
+        inside = (t >= start) & (t < end)
+        samples[inside] += 0.5 * np.sin(2 * np.pi * 180 * t[inside])
+    return samples.astype(np.float32)
+
+
+def write_wav(path, samples, sample_rate=SAMPLE_RATE):
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes((np.clip(samples, -1, 1) * 32767).astype(np.int16).tobytes())
+    return str(path)
+
+
+def inside_a_segment(start, end, segments):
+    return any(
+        segment_start - TOLERANCE <= start and end <= segment_end + TOLERANCE
+        for segment_start, segment_end in segments
+    )
+
+
+def test_speech_segments_find_the_bursts():
+    segments = speech_segments(synthetic_speech(BURSTS, DURATION))
+
+    assert len(segments) == len(BURSTS)
+    for (start, end), (burst_start, burst_end) in zip(segments, BURSTS):
+        assert start == pytest.approx(burst_start, abs=TOLERANCE)
+        assert end == pytest.approx(burst_end, abs=TOLERANCE)
+
+
+def test_short_pauses_are_bridged_and_blips_dropped():
+    samples = synthetic_speech([(0.2, 0.6), (0.66, 1.0), (2.0, 2.04)], 2.5)
+
+    segments = speech_segments(samples)
+
+    assert len(segments) == 1
+    assert segments[0][0] == pytest.approx(0.2, abs=TOLERANCE)
+    assert segments[0][1] == pytest.approx(1.0, abs=TOLERANCE)
+
+
+def test_silence_counts_as_one_segment():
+    assert speech_segments(np.zeros(SAMPLE_RATE, dtype=np.float32)) == [(0.0, 1.0)]
+
+
+def test_words_land_inside_the_speech_segments(tmp_path):
+    audio_file = write_wav(tmp_path / "scene.wav", synthetic_speech(BURSTS, DURATION))
+    text = "Anna found an old brass lamp in her grandmother's attic."
+
+    words = align_words(text, audio_file)
+
+    assert [word["word"] for word in words] == text.split()
+    for word in words:
+        assert word["start"] < word["end"]
+        assert inside_a_segment(word["start"], word["end"], BURSTS), word
+    assert words[0]["start"] == pytest.approx(BURSTS[0][0], abs=TOLERANCE)
+    assert words[-1]["end"] == pytest.approx(BURSTS[-1][1], abs=TOLERANCE)
+    starts = [word["start"] for word in words]
+    assert starts == sorted(starts)
+
+
+def test_no_speech_falls_back_to_weighted_timings(tmp_path):
+    # Clicks in silence are too short to be speech, so no segment survives
+    samples = synthetic_speech([(start, start + 0.04) for start in (0.1, 0.3, 0.5, 0.7)], 1.0)
+    audio_file = write_wav(tmp_path / "click.wav", samples)
+    assert speech_segments(samples) == []
+
+    words = align_words("a quiet scene", audio_file)
+
+    assert words == weighted_word_timings("a quiet scene", len(samples) / SAMPLE_RATE)
+
+
+def test_undecodable_audio_falls_back_to_weighted_timings(tmp_path):
+    scene = {"scene_number": 1, "subtitles": "a missing file", "audio": str(tmp_path / "missing.mp3")}
+
+    assert scene_word_timings(scene, 2.0) == weighted_word_timings("a missing file", 2.0)
+
+
+def test_weighted_timings_cover_the_duration():
+    words = weighted_word_timings("Hello, brave new world.", 4.0)
+
+    assert words[0]["start"] == 0.0
+    assert words[-1]["end"] == pytest.approx(4.0)
+    assert all(a["end"] == b["start"] for a, b in zip(words, words[1:]))